@@ -1,12 +1,44 @@
+import functools
+import json
+import os
+import uuid
 import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from game_engine import GameEngine
+from memory_monitor import get_monitor
 from state_manager import GameStateManager
+from turn_worker import load_registry
 
 st.set_page_config(page_title="文字冒险游戏", layout="wide")
 
+def session_active(session_id):
+    """web会话是否仍然连接，仍有会话显示的对局不会被移出登记表"""
+    return runtime.exists() and runtime.get_instance().is_active_session(session_id)
+
+@st.cache_resource
+def get_game_registry():
+    """所有会话共享的对局登记表与后台回合线程池"""
+    return load_registry(is_session_active=session_active)
+
+registry = get_game_registry()
+run_ctx = get_script_run_ctx()
+session_id = run_ctx.session_id if run_ctx is not None else None
+
 # 初始化全局状态
 if "engine" not in st.session_state:
-    st.session_state.engine = GameEngine()
+    entry = registry.attach(st.query_params.get("game"), session_id)
+    if entry is not None:
+        # 刷新页面后按地址栏中的对局标识重新接上原来的对局（包括正在生成的回合）
+        st.session_state.engine = entry.engine
+        st.session_state.state_manager = entry.state_manager
+        st.session_state.play_id = entry.play_id
+        st.session_state.menu_mode = "game"
+        st.session_state.game_started = not entry.view.get('is_ended', False)
+    else:
+        st.session_state.engine = GameEngine()
+        # 玩家浏览菜单时在后台预加载模型
+        st.session_state.engine.warm_up()
 if "state_manager" not in st.session_state:
     st.session_state.state_manager = GameStateManager()
 if "game_started" not in st.session_state:
@@ -15,226 +47,370 @@ if "menu_mode" not in st.session_state:
     st.session_state.menu_mode = "main"
 if "message" not in st.session_state:
     st.session_state.message = ""
+if "save_pending" not in st.session_state:
+    st.session_state.save_pending = False
 
 engine = st.session_state.engine
+# 对局登记后由后台回合线程修改，页面只读取登记表发布的快照（registry.view），修改时持有该局的锁（registry.locked）
 state_manager = st.session_state.state_manager
 
+# 开启内存监控时登记本会话，用于按会话拆分内存占用
+memory_monitor = get_monitor()
+if memory_monitor is not None:
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex[:8]
+    memory_monitor.register_session(st.session_state.session_id, engine, state_manager)
+
+# ---------- 缓存的读取 ----------
+
+@st.cache_data(show_spinner=False, ttl=300)
+def load_save_summaries(_state_manager, save_directory, directory_version):
+    """读取存档列表及每个存档的摘要
+
+    结果在所有会话间共享；directory_version为存档目录的修改时间，存档增删后自动失效，
+    本页面保存或删除存档时还会主动清除缓存（覆盖同名存档不改变目录修改时间）
+    """
+    return [(save, _state_manager.get_save_info(save['name'])) for save in _state_manager.list_saves()]
+
+def get_save_summaries():
+    directory = state_manager.save_directory
+    return load_save_summaries(state_manager, directory, os.stat(directory).st_mtime_ns)
+
+# ---------- 操作回调：在本次渲染之前修改状态，每个操作只渲染一次 ----------
+
+def go_to(mode):
+    st.session_state.menu_mode = mode
+
+def register_play():
+    """为当前会话的新对局登记标识并写入地址栏，刷新页面后可以接上"""
+    play_id = registry.register(engine, state_manager, replace=st.session_state.get("play_id"), session_id=session_id)
+    st.session_state.play_id = play_id
+    st.query_params["game"] = play_id
+    return play_id
+
+def supersede_play():
+    """新的对局取代当前对局：取消其仍在生成的回合，等它退出后才能复用同一个引擎和状态管理器"""
+    if registry.cancel(st.session_state.get("play_id"), "开始了新的对局", wait=5.0):
+        return True
+    st.session_state.message = "上一回合仍在生成中，请稍候。"
+    return False
+
+def start_new_game():
+    if not supersede_play():
+        return
+    player_name = st.session_state.get("player_name") or "冒险者"
+    with registry.locked(st.session_state.get("play_id")):
+        state_manager.create_new_game(player_name)
+    # 开场场景同样在后台生成
+    registry.submit(register_play(), 0, engine.start_new_game, state_manager, description="开局")
+    st.session_state.game_started = True
+    st.session_state.menu_mode = "game"
+    st.session_state.save_pending = False
+    st.session_state.show_attributes = False
+    st.session_state.message = f"欢迎，{player_name}！你的冒险即将开始..."
+
+def load_save(save_name):
+    if not supersede_play():
+        return
+    with registry.locked(st.session_state.get("play_id")):
+        loaded = state_manager.load_game(save_name)
+    if loaded:
+        register_play()
+        st.session_state.game_started = not registry.view(st.session_state.play_id)['is_ended']
+        st.session_state.menu_mode = "game"
+        st.session_state.save_pending = False
+        st.session_state.message = f"已读取存档：{save_name}"
+
+def delete_save(save_name):
+    if state_manager.delete_save(save_name):
+        load_save_summaries.clear()
+        st.session_state.message = f"已删除存档: {save_name}"
+
+def take_turn(player_input, turn):
+    # turn为渲染按钮时该局已完成的回合数，重复点击或过期页面上的点击不会再次生成
+    # 走过的分支默认复用已生成的剧情，勾选“重新生成”时重新调用模型
+    play_turn = functools.partial(engine.play_turn, regenerate=st.session_state.get("regenerate", False))
+    job = registry.submit(st.session_state.play_id, turn, play_turn, player_input, state_manager,
+                          description=player_input)
+    if job is None and registry.busy(st.session_state.play_id):
+        st.session_state.message = "上一回合仍在生成中，请稍候。"
+
+def apply_finished_turn(job):
+    """把后台完成的回合结果反映到页面状态"""
+    if job.status == "failed":
+        st.session_state.message = f"生成失败，请重试：{job.error}"
+        return
+    if job.status == "cancelled":
+        return
+    result = job.result
+    if not isinstance(result, dict):
+        return
+    if result['messages']:
+        st.session_state.message = result['messages'][-1]
+    if result['dead']:
+        st.session_state.message = "你的生命值已降为0，游戏结束！"
+        st.session_state.game_started = False
+    elif result['ended']:
+        st.session_state.message = "游戏结束！"
+        st.session_state.game_started = False
+
+def rewind(steps):
+    """撤销（steps>0）或重做（steps<0）若干回合"""
+    play_id = st.session_state.play_id
+    if registry.busy(play_id):
+        st.session_state.message = "上一回合仍在生成中，请稍候。"
+        return
+    with registry.locked(play_id):
+        done = engine.undo(state_manager, steps) if steps > 0 else engine.redo(state_manager, -steps)
+    if done:
+        # 旧页面上的选项属于撤销前的场景，使其失效
+        registry.bump_turn(play_id)
+        st.session_state.game_started = not registry.view(play_id)['is_ended']
+        st.session_state.message = f"已撤销 {steps} 个回合" if steps > 0 else f"已重做 {-steps} 个回合"
+
+def rewind_to():
+    target = st.session_state.get("rewind_target")
+    if target is not None:
+        rewind(registry.view(st.session_state.play_id)['position'] - target)
+
+def request_save():
+    st.session_state.save_pending = True
+
+def confirm_save():
+    save_name = st.session_state.get("save_name")
+    play_id = st.session_state.get("play_id")
+    if registry.busy(play_id):
+        st.session_state.message = "上一回合仍在生成中，请稍候。"
+        return
+    with registry.locked(play_id):
+        saved = bool(save_name) and state_manager.save_game(save_name)
+    if saved:
+        load_save_summaries.clear()
+        st.session_state.message = f"已保存游戏：{save_name}"
+    st.session_state.save_pending = False
+
+def toggle_attributes():
+    st.session_state.show_attributes = not st.session_state.get("show_attributes", False)
+
+def back_to_main_menu():
+    # 离开对局后不再需要正在生成的回合，立即释放模型后端
+    registry.cancel(st.session_state.get("play_id"), "返回主菜单")
+    st.query_params.pop("game", None)
+    st.session_state.menu_mode = "main"
+    st.session_state.game_started = False
+    st.session_state.save_pending = False
+
+# ---------- 页面 ----------
+
+def show_message():
+    if st.session_state.message:
+        st.info(st.session_state.message)
+        st.session_state.message = ""
+
 def show_main_menu():
     st.title("🧙‍♂️ 文字冒险游戏")
     st.markdown("---")
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        if st.button("新游戏"):
-            st.session_state.menu_mode = "new_game"
+        st.button("新游戏", on_click=go_to, args=("new_game",))
     with col2:
-        if st.button("继续游戏"):
-            st.session_state.menu_mode = "continue_game"
+        st.button("继续游戏", on_click=go_to, args=("continue_game",))
     with col3:
-        if st.button("查看存档"):
-            st.session_state.menu_mode = "view_saves"
+        st.button("查看存档", on_click=go_to, args=("view_saves",))
     with col4:
-        if st.button("退出游戏"):
-            st.session_state.menu_mode = "quit"
+        st.button("退出游戏", on_click=go_to, args=("quit",))
 
     st.markdown("---")
     st.markdown("> 请选择上方操作开始游戏。")
+    show_model_status()
+    if memory_monitor is not None:
+        st.button("内存监控", on_click=go_to, args=("memory",))
+
+def show_model_status():
+    if not engine.use_ai_generation:
+        return
+    status = engine.get_generation_status()
+    state = status['model_status']['state']
+    if status['circuit']['state'] == "open":
+        st.warning("AI服务暂时不可用，剧情将由预设内容继续，恢复后自动切回AI生成。")
+    elif state == "loading":
+        st.info("模型加载中，首次生成可能需要稍候...")
+    elif state == "unavailable":
+        st.warning("模型暂不可用，将在生成时重试。")
 
 def show_new_game():
     st.header("新游戏")
+    show_model_status()
     with st.form("new_game_form"):
-        player_name = st.text_input("请输入角色名称（可留空，默认为冒险者）")
-        submitted = st.form_submit_button("开始冒险")
-        if submitted:
-            state_manager.create_new_game(player_name or "冒险者")
-            engine.start_new_game(state_manager)
-            st.session_state.game_started = True
-            st.session_state.menu_mode = "game"
-            st.session_state.message = f"欢迎，{player_name or '冒险者'}！你的冒险即将开始..."
-    if st.button("返回主菜单"):
-        st.session_state.menu_mode = "main"
+        st.text_input("请输入角色名称（可留空，默认为冒险者）", key="player_name")
+        st.form_submit_button("开始冒险", on_click=start_new_game)
+    st.button("返回主菜单", on_click=go_to, args=("main",))
 
 def show_continue_game():
     st.header("继续游戏")
-    saves = state_manager.list_saves()
+    show_message()
+    saves = get_save_summaries()
     if not saves:
         st.info("没有找到任何存档文件。")
     else:
-        for save in saves:
-            save_info = state_manager.get_save_info(save['name'])
+        for save, save_info in saves:
             if save_info:
                 st.markdown(f"**{save['name']}** - {save_info['player_name']} (等级{save_info['player_level']}) - {save_info['last_updated']}")
-                if st.button(f"读取存档: {save['name']}"):
-                    if state_manager.load_game(save['name']):
-                        st.session_state.game_started = True
-                        st.session_state.menu_mode = "game"
-                        st.session_state.message = f"已读取存档：{save['name']}"
-                        return
-    if st.button("返回主菜单"):
-        st.session_state.menu_mode = "main"
+                st.button(f"读取存档: {save['name']}", on_click=load_save, args=(save['name'],))
+    st.button("返回主菜单", on_click=go_to, args=("main",))
 
 def show_view_saves():
     st.header("存档详情")
-    saves = state_manager.list_saves()
+    show_message()
+    saves = get_save_summaries()
     if not saves:
         st.info("没有找到任何存档文件。")
     else:
-        for save in saves:
-            save_info = state_manager.get_save_info(save['name'])
+        for save, save_info in saves:
             if save_info:
                 st.markdown(f"**存档名称:** {save['name']}  ")
                 st.markdown(f"角色: {save_info['player_name']} (等级 {save_info['player_level']})  ")
                 st.markdown(f"当前场景: {save_info['current_scene']}  ")
                 st.markdown(f"游戏状态: {'已结束' if save_info['is_ended'] else '进行中'}  ")
                 st.markdown(f"最后更新: {save_info['last_updated']}  ")
-                if st.button(f"删除存档: {save['name']}"):
-                    state_manager.delete_save(save['name'])
-                    st.success(f"已删除存档: {save['name']}")
-    if st.button("返回主菜单"):
-        st.session_state.menu_mode = "main"
+                st.button(f"删除存档: {save['name']}", on_click=delete_save, args=(save['name'],))
+    st.button("返回主菜单", on_click=go_to, args=("main",))
 
-def show_game():
-    current_state = state_manager.get_current_state()
-    player_status = current_state.get('player_status', {})
-    options = current_state.get('options', [])
-    option_events = current_state.get('option_events', [])
-    special_options = ["保存游戏", "查看角色属性", "返回主菜单"]
+def show_memory_monitor():
+    st.header("内存监控")
+    st.json(memory_monitor.get_status())
+    st.button("立即快照", on_click=memory_monitor.snapshot)
+    if not memory_monitor.records:
+        st.info("还没有快照。")
+    else:
+        record = memory_monitor.records[-1]
+        st.markdown(f"**当前跟踪内存:** {record['traced_bytes'] / 1024 / 1024:.1f} MB"
+                    + (f"（较上次 {record['traced_delta'] / 1024:+.1f} KB，间隔 {record['elapsed']} 秒）" if 'traced_delta' in record else ""))
+        st.markdown("### 按子系统")
+        st.table([
+            {'子系统': name, '大小(KB)': round(size / 1024, 1),
+             '变化(KB)': round(record.get('subsystem_deltas', {}).get(name, 0) / 1024, 1)}
+            for name, size in record['subsystems'].items()
+        ])
+        st.markdown("### 存活对象")
+        st.table([
+            {'类型': name, '数量': count, '变化': record.get('instance_deltas', {}).get(name, 0)}
+            for name, count in record['instances'].items()
+        ])
+        st.markdown("### 按会话")
+        st.table([{'会话': sid, **data} for sid, data in record['sessions'].items()])
+        if record.get('top_growth'):
+            st.markdown("### 增长最多的分配位置")
+            st.table(record['top_growth'])
+        st.download_button(
+            "导出全部快照",
+            "\n".join(json.dumps(r, ensure_ascii=False) for r in memory_monitor.records),
+            file_name="memory_snapshots.jsonl"
+        )
+    st.button("返回主菜单", on_click=go_to, args=("main",))
+
+# 游戏页面分为场景、角色状态、选项三个片段，片段内的交互只重新运行该片段；
+# 片段在每次运行时自己读取登记表发布的快照，而不是使用整页渲染时传入的旧参数
+
+@st.fragment
+def scene_panel(play_id):
+    view = registry.view(play_id)
     st.markdown("# 🗺️ 当前场景")
-    st.markdown(f"<div style='background:#222831;color:#f2f2f2;padding:1.5em;border-radius:10px;font-size:1.2em;'>{current_state.get('description','')}</div>", unsafe_allow_html=True)
+    st.markdown(f"<div style='background:#222831;color:#f2f2f2;padding:1.5em;border-radius:10px;font-size:1.2em;'>{view['description']}</div>", unsafe_allow_html=True)
+
+@st.fragment
+def status_panel(play_id):
+    player = registry.view(play_id)['player']
+    inventory = ', '.join(player['inventory']) or '无'
+    st.markdown("## 🧑‍🎤 角色状态")
+    st.markdown(f"**姓名:** {player['name']}")
+    st.markdown(f"**等级:** {player['level']}")
+    st.markdown(f"**经验:** {player['experience']}")
+    st.markdown(f"**生命值:** {player['health']}/{player['max_health']}")
+    st.markdown(f"**背包:** {inventory}")
+    if player['skills']:
+        st.markdown("**技能:**")
+        for skill, lv in player['skills'].items():
+            st.markdown(f"- {skill}: {lv}")
+    if player['attributes']:
+        st.markdown("**其他属性:**")
+        for k, v in player['attributes'].items():
+            st.markdown(f"- {k}: {v}")
+    st.button("查看角色属性", key="special_1", on_click=toggle_attributes)
+    if st.session_state.get("show_attributes", False):
+        st.info(f"姓名: {player['name']}\n等级: {player['level']}\n经验: {player['experience']}\n生命值: {player['health']}/{player['max_health']}\n背包: {inventory}")
+
+@st.fragment
+def options_panel(play_id):
+    """选项片段：提交回合只重新运行本片段并在此显示生成进度，回合完成后才整页渲染新的场景和状态"""
+    if registry.busy(play_id):
+        turn_progress(play_id)
+        return
+    entry = registry.get(play_id)
+    view = entry.view
+    st.markdown("## 🎲 可选项")
+    for i, opt in enumerate(view['options']):
+        st.button(opt, key=f"opt_{i}", on_click=take_turn, args=(opt, entry.turns))
+    if engine.use_ai_generation:
+        st.checkbox("重新生成（不复用之前生成过的剧情）", key="regenerate")
+    st.button("保存游戏", key="special_0", on_click=request_save)
+    if st.session_state.save_pending:
+        st.text_input("请输入存档名称", key="save_name")
+        st.button("确认保存", on_click=confirm_save)
+    st.markdown("---")
+    show_message()
+
+def game_controls(play_id):
+    """撤销、重做与返回主菜单会改变整个页面，放在片段之外，点击时只做一次整页渲染"""
+    view = registry.view(play_id)
+    col_undo, col_redo = st.columns(2)
+    with col_undo:
+        st.button("↶ 撤销", key="undo", on_click=rewind, args=(1,), disabled=not view['can_go_back'])
+    with col_redo:
+        st.button("↷ 重做", key="redo", on_click=rewind, args=(-1,), disabled=not view['can_go_forward'])
+    if view['can_jump']:
+        with st.expander("回到其他回合"):
+            labels = {e['position']: f"第{e['position']}回合：{e['label']}" + ("（当前）" if e['current'] else "")
+                      for e in view['turn_history']}
+            st.selectbox("选择回合", list(labels), format_func=labels.get, key="rewind_target",
+                         index=view['position'])
+            st.button("回到该回合", key="rewind_to", on_click=rewind_to)
+    st.button("返回主菜单", key="special_2", on_click=back_to_main_menu)
+    if not st.session_state.game_started:
+        st.button("返回主菜单", key="end_back_main", on_click=back_to_main_menu)
+
+@st.fragment(run_every=registry.poll_interval)
+def turn_progress(play_id):
+    """回合在后台生成时定时轮询，完成后整页渲染结果"""
+    entry = registry.get(play_id)
+    job = entry.job if entry is not None else None
+    if job is None or job.finished:
+        st.rerun()
+    st.info(f"AI正在生成剧情，请稍候...（已等待 {job.elapsed:.0f} 秒）")
+
+def show_game():
+    play_id = st.session_state.get("play_id")
+    if registry.get(play_id) is None:
+        # 对局已因长时间闲置被移出登记表，重新登记
+        play_id = register_play()
+    job = registry.collect(play_id)
+    if job is not None:
+        apply_finished_turn(job)
+    pending = registry.busy(play_id)
+    st.session_state.turn_pending = pending
+    show_model_status()
+    scene_panel(play_id)
     st.markdown("---")
     col1, col2 = st.columns([2,1])
     with col2:
-        st.markdown("## 🧑‍🎤 角色状态")
-        st.markdown(f"**姓名:** {player_status.get('name','冒险者')}")
-        st.markdown(f"**等级:** {player_status.get('level',1)}")
-        st.markdown(f"**经验:** {getattr(state_manager.player, 'experience', 0)}")
-        st.markdown(f"**生命值:** {player_status.get('health',100)}/{player_status.get('max_health',100)}")
-        st.markdown(f"**背包:** {', '.join(player_status.get('inventory', [])) or '无'}")
-        skills = getattr(state_manager.player, 'skills', {})
-        if skills:
-            st.markdown("**技能:**")
-            for skill, lv in skills.items():
-                st.markdown(f"- {skill}: {lv}")
-        attributes = getattr(state_manager.player, 'attributes', {})
-        if attributes:
-            st.markdown("**其他属性:**")
-            for k, v in attributes.items():
-                st.markdown(f"- {k}: {v}")
+        status_panel(play_id)
     with col1:
-        st.markdown("## 🎲 可选项")
-        option_buttons = []
-        for i, opt in enumerate(options):
-            if st.button(opt, key=f"opt_{i}"):
-                st.session_state.selected_option = opt
-        for i, opt in enumerate(special_options):
-            if st.button(opt, key=f"special_{i}"):
-                st.session_state.selected_option = opt
-        # 保存游戏输入框状态
-        if "save_pending" not in st.session_state:
-            st.session_state.save_pending = False
-        # 处理选项
-        if st.session_state.get("save_pending", False):
-            save_name = st.text_input("请输入存档名称", key="save_name")
-            if st.button("确认保存"):
-                if save_name:
-                    state_manager.save_game(save_name)
-                    st.session_state.message = f"已保存游戏：{save_name}"
-                st.session_state.save_pending = False
-                if hasattr(st, 'rerun'):
-                    st.rerun()
-                else:
-                    st.experimental_rerun()
-        elif "selected_option" in st.session_state:
-            player_input = st.session_state.selected_option
-            # 用spinner包裹所有耗时处理
-            with st.spinner("AI正在生成剧情，请稍候..."):
-                # 特殊选项
-                if player_input == "保存游戏":
-                    st.session_state.save_pending = True
-                    del st.session_state.selected_option
-                    if hasattr(st, 'rerun'):
-                        st.rerun()
-                    else:
-                        st.experimental_rerun()
-                elif player_input == "查看角色属性":
-                    st.info(f"姓名: {state_manager.player.name}\n等级: {state_manager.player.level}\n经验: {state_manager.player.experience}\n生命值: {state_manager.player.health}/{state_manager.player.max_health}\n背包: {', '.join(state_manager.player.inventory) or '无'}")
-                    del st.session_state.selected_option
-                    if hasattr(st, 'rerun'):
-                        st.rerun()
-                    else:
-                        st.experimental_rerun()
-                elif player_input == "返回主菜单":
-                    st.session_state.menu_mode = "main"
-                    st.session_state.game_started = False
-                    del st.session_state.selected_option
-                    if hasattr(st, 'rerun'):
-                        st.rerun()
-                    else:
-                        st.experimental_rerun()
-                else:
-                    # 触发AI结构化事件
-                    chosen_index = None
-                    if options and player_input in options:
-                        chosen_index = options.index(player_input)
-                    elif options and player_input.isdigit():
-                        idx = int(player_input) - 1
-                        if 0 <= idx < len(options):
-                            chosen_index = idx
-                    if chosen_index is not None and option_events and chosen_index < len(option_events):
-                        event_str = option_events[chosen_index]
-                        player = state_manager.player
-                        if event_str and event_str != "none":
-                            try:
-                                if event_str.startswith("heal:"):
-                                    amount = int(event_str.split(":")[1])
-                                    player.heal(amount)
-                                    st.session_state.message = f"[事件] 你恢复了 {amount} 点生命值！"
-                                elif event_str.startswith("damage:"):
-                                    amount = int(event_str.split(":")[1])
-                                    player.take_damage(amount)
-                                    st.session_state.message = f"[事件] 你受到了 {amount} 点伤害！"
-                                elif event_str.startswith("add_item:"):
-                                    item = event_str.split(":", 1)[1]
-                                    player.add_item(item)
-                                    st.session_state.message = f"[事件] 你获得了物品：{item}"
-                                elif event_str.startswith("remove_item:"):
-                                    item = event_str.split(":", 1)[1]
-                                    if player.remove_item(item):
-                                        st.session_state.message = f"[事件] 你失去了物品：{item}"
-                                elif event_str.startswith("add_experience:"):
-                                    exp = int(event_str.split(":")[1])
-                                    player.add_experience(exp)
-                                    st.session_state.message = f"[事件] 你获得了 {exp} 点经验！"
-                            except Exception as e:
-                                st.session_state.message = f"[事件处理异常] {e}"
-                    next_state = engine.next_step(player_input, state_manager)
-                    if next_state:
-                        state_manager.update_story(
-                            next_state.get('scene_id', f"scene_{state_manager.story.current_scene_id}"),
-                            next_state.get('description', ''),
-                            next_state.get('options', []),
-                            player_input,
-                            next_state.get('option_events', [])
-                        )
-                        if next_state.get('is_end', False):
-                            state_manager.end_game(next_state.get('ending_type', 'normal'))
-                            st.session_state.message = "游戏结束！"
-                            st.session_state.game_started = False
-                        if not state_manager.player.is_alive():
-                            st.session_state.message = "你的生命值已降为0，游戏结束！"
-                            state_manager.end_game("dead")
-                            st.session_state.game_started = False
-                    del st.session_state.selected_option
-                    if hasattr(st, 'rerun'):
-                        st.rerun()
-                    else:
-                        st.experimental_rerun()
-    st.markdown("---")
-    if st.session_state.message:
-        st.info(st.session_state.message)
-        st.session_state.message = ""
-    if not st.session_state.game_started:
-        if st.button("返回主菜单", key="end_back_main"):
-            st.session_state.menu_mode = "main"
+        if pending:
+            turn_progress(play_id)
+            st.button("返回主菜单", key="pending_back_main", on_click=back_to_main_menu)
+        else:
+            options_panel(play_id)
+            game_controls(play_id)
 
 def main():
     if st.session_state.menu_mode == "main":
@@ -247,8 +423,10 @@ def main():
         show_view_saves()
     elif st.session_state.menu_mode == "game":
         show_game()
+    elif st.session_state.menu_mode == "memory" and memory_monitor is not None:
+        show_memory_monitor()
     elif st.session_state.menu_mode == "quit":
         st.warning("感谢游玩，再见！")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
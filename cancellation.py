@@ -0,0 +1,148 @@
+# 协作式取消：页面关闭、返回主菜单、被新请求取代或回合时间预算用完时，中止该回合尚未完成的模型调用，把后端算力让给其他玩家
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+
+class GenerationCancelled(Exception):
+    """生成已被取消；与普通生成失败不同，不应回退到预设剧情"""
+
+
+class CancelToken:
+    """一次回合生成的取消令牌，可在任意线程中取消
+
+    生成代码在各次模型调用之间检查令牌；正在进行的请求通过on_cancel注册中止回调，取消时立即断开
+    """
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "已取消") -> bool:
+        """取消并执行已注册的中止回调；重复取消时返回False"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"执行取消回调失败: {e}")
+        return True
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """注册取消时执行的回调（已取消时立即执行），返回注销函数"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise GenerationCancelled(self.reason)
+
+    def wait(self, timeout: float) -> bool:
+        """等待至多timeout秒，期间被取消时提前返回True"""
+        return self._event.wait(timeout)
+
+
+class Deadline:
+    """一个回合的时间预算：到期时取消自己的令牌，中止进行中的模型调用；上级令牌被取消时一并取消
+
+    生成代码把token当作普通取消令牌传下去，捕获GenerationCancelled后用expired区分超时与放弃
+    """
+
+    REASON = "回合时间预算已用完"
+
+    def __init__(self, seconds: float, parent: Optional[CancelToken] = None):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.token = CancelToken()
+        self.expired = False
+        self._timer = threading.Timer(max(seconds, 0.0), self.expire)
+        self._timer.daemon = True
+        self._timer.start()
+        self._unregister = parent.on_cancel(lambda: self.token.cancel(parent.reason)) if parent else (lambda: None)
+
+    def expire(self) -> None:
+        """预算用完：到期或剩余时间已不够做任何事时提前结束"""
+        if not self.token.cancelled:
+            self.expired = True
+            self.token.cancel(self.REASON)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        return max(self.seconds - self.elapsed(), 0.0)
+
+    def finish(self) -> None:
+        """回合结束后停止计时并解除与上级令牌的关联"""
+        self._timer.cancel()
+        self._unregister()
+
+
+@dataclass
+class DeadlinePolicy:
+    """回合时间预算与逐级降级的阈值（秒）：剩余时间低于阈值时跳过或缩减对应阶段"""
+    enabled: bool = False
+    seconds: float = 30.0
+    # 剩余时间不足时不调用模型摘要，改用本地摘要；模型摘要最多用到剩余event_min_remaining为止
+    llm_summary_min_remaining: float = 24.0
+    # 剩余时间不足时跳过事件推进；事件推进最多用到剩余full_scene_min_remaining为止
+    event_min_remaining: float = 18.0
+    # 剩余时间不足时限制场景输出长度为capped_scene_tokens
+    full_scene_min_remaining: float = 12.0
+    capped_scene_tokens: int = 250
+    # 剩余时间不足时不再生成场景，直接使用预设剧情
+    scene_min_remaining: float = 4.0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'DeadlinePolicy':
+        """从config.json的turn_deadline配置创建"""
+        fields = cls.__dataclass_fields__
+        return cls(**{k: v for k, v in (config or {}).items() if k in fields})
+
+    def start(self, parent: Optional[CancelToken] = None) -> Optional[Deadline]:
+        """开始计时一个回合，未启用时返回None"""
+        return Deadline(self.seconds, parent) if self.enabled else None
+
+
+def check_cancelled(token: Optional[CancelToken]) -> None:
+    """令牌可为None的便捷检查"""
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+if __name__ == "__main__":
+    token = CancelToken()
+    fired = []
+    unregister = token.on_cancel(lambda: fired.append("a"))
+    token.on_cancel(lambda: fired.append("b"))
+    unregister()
+    print("取消:", token.cancel("测试"), token.cancel(), fired)
+    try:
+        check_cancelled(token)
+    except GenerationCancelled as e:
+        print("已取消:", e)
+    deadline = Deadline(0.05, parent=token)
+    print("上级已取消:", deadline.token.cancelled, deadline.expired)
+    deadline = Deadline(0.05)
+    print("到期:", deadline.token.wait(1), deadline.expired, deadline.token.reason)
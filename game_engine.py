@@ -1,10 +1,33 @@
 # 游戏主逻辑模块 
-from prompts.scene_prompt import ScenePrompt
-import random
+import time
+from collections import deque
+from models.branch_tree import BRANCH_FLAG, normalize_input, root_id
+from cancellation import Deadline, GenerationCancelled, check_cancelled
+from status_rules import DEFAULT_RULES_PATH, apply_status_effects, load_rules
+from story_graph import DEFAULT_STORY_PATH, load_story
+
+# 回合时间预算不足时的降级级别，依次为：完整生成、改用本地摘要、跳过事件推进、限制场景长度、使用预设剧情
+DEGRADATION_LEVELS = ("full", "summary_skipped", "event_skipped", "scene_capped", "fallback")
 
 class GameEngine:
-    def __init__(self):
-        self.scene_prompt = ScenePrompt()
+    def __init__(self, scene_prompt=None, story_path=None, rules_path=None):
+        # 首次需要AI生成时才创建ScenePrompt，预设剧情模式不加载LLM相关模块；
+        # 也可以传入接口相同的替代实现（如模拟器使用的桩模型）
+        self._scene_prompt = scene_prompt
+        # 预设剧情数据文件，默认为stories/preset_story.json
+        self.story_path = story_path
+        # 状态变化规则表，默认为stories/status_rules.json
+        self.rules_path = rules_path
+        # 最近若干回合由状态变化文本产生的效果
+        self.effect_log = deque(maxlen=100)
+        # 分支树缓存的命中统计
+        self.branch_stats = {'hits': 0, 'misses': 0, 'regenerated': 0}
+        # 模型后端熔断期间直接使用预设剧情的次数（开场与回合）
+        self.short_circuited = 0
+        # 每个AI回合的降级级别（DEGRADATION_LEVELS的下标）与耗时
+        self.turn_degradation = 0
+        self.degradation_log = deque(maxlen=100)
+        self.degradation_counts = {name: 0 for name in DEGRADATION_LEVELS}
         self.story_step = 0
         self.use_ai_generation = True  # 是否使用AI生成内容
         self.game_theme = "sci_fi"  # 游戏主题
@@ -27,20 +50,56 @@ class GameEngine:
             }
         }
     
-    def start_new_game(self, state_manager, theme="fantasy_adventure"):
-        """开始新游戏"""
+    @property
+    def scene_prompt(self):
+        """AI生成模块，首次访问时才导入并初始化"""
+        if self._scene_prompt is None:
+            from prompts.scene_prompt import ScenePrompt
+            self._scene_prompt = ScenePrompt()
+        return self._scene_prompt
+    
+    @property
+    def story_graph(self):
+        """编译后的预设剧情图，同一数据文件在进程内只编译一次"""
+        return load_story(self.story_path or DEFAULT_STORY_PATH)
+    
+    @property
+    def status_rules(self):
+        """编译后的状态变化规则表"""
+        return load_rules(self.rules_path or DEFAULT_RULES_PATH)
+    
+    def start_new_game(self, state_manager, theme="fantasy_adventure", cancel_token=None):
+        """开始新游戏；cancel_token被取消时放弃生成开场场景并抛出GenerationCancelled"""
         self.game_theme = theme
         self.story_step = 0
+        self.effect_log.clear()
         
         # 获取初始故事设定
         initial_story = self.initial_story_settings.get(theme, self.initial_story_settings["fantasy_adventure"])
         
         # 如果启用AI生成，使用AI优化初始场景
         if self.use_ai_generation:
+            # 新的一局游戏不沿用旧的会话上下文
+            game_id = state_manager.get_game_id()
+            self.scene_prompt.reset_session(game_id)
+            if self.scene_prompt.cassette is not None:
+                self.scene_prompt.cassette.record_game(
+                    game_id, state_manager.game_metadata.get('seed'), theme, state_manager.player.name
+                )
+            # 开场同样受回合时间预算约束，预算用完时使用默认场景
+            deadline = self.scene_prompt.turn_deadline.start(cancel_token)
             try:
+                if not self.scene_prompt.is_available(theme):
+                    # 模型后端熔断中：不等待预热也不发请求，直接使用默认场景
+                    self.short_circuited += 1
+                    raise RuntimeError("模型后端暂不可用")
+                # 模型仍在预热时先等待加载完成，而不是让首个请求超时
+                self.scene_prompt.wait_until_ready(deadline.remaining() if deadline else None)
                 ai_result = self.scene_prompt.generate_scene(
                     initial_story['context'], 
-                    scene_type=theme
+                    scene_type=theme,
+                    session_id=game_id,
+                    cancel_token=deadline.token if deadline else cancel_token
                 )
                 
                 # 使用AI生成的内容
@@ -54,6 +113,15 @@ class GameEngine:
                 state_manager.set_story_flag("story_theme", theme)
                 state_manager.set_story_flag("story_context", initial_story['context'])
                 
+            except GenerationCancelled as e:
+                if not (deadline and deadline.expired):
+                    raise
+                print(f"AI生成失败，使用默认场景: {e}")
+                state_manager.update_story(
+                    initial_story['scene_id'],
+                    initial_story['description'], 
+                    initial_story['options']
+                )
             except Exception as e:
                 print(f"AI生成失败，使用默认场景: {e}")
                 # 回退到预设场景
@@ -62,6 +130,9 @@ class GameEngine:
                     initial_story['description'], 
                     initial_story['options']
                 )
+            finally:
+                if deadline:
+                    deadline.finish()
         else:
             # 使用预设场景
             state_manager.update_story(
@@ -69,189 +140,342 @@ class GameEngine:
                 initial_story['description'], 
                 initial_story['options']
             )
+        state_manager.checkpoint(self.story_step)
     
-    def next_step(self, player_input, state_manager):
-        """处理玩家输入，生成下一步剧情"""
+    def apply_option_event(self, event_str, player):
+        """执行选项附带的结构化事件（heal/damage/add_item/remove_item/add_experience），返回提示信息"""
+        if not event_str or event_str == "none":
+            return None
+        try:
+            if event_str.startswith("heal:"):
+                amount = int(event_str.split(":")[1])
+                player.heal(amount)
+                return f"[事件] 你恢复了 {amount} 点生命值！"
+            elif event_str.startswith("damage:"):
+                amount = int(event_str.split(":")[1])
+                player.take_damage(amount)
+                return f"[事件] 你受到了 {amount} 点伤害！"
+            elif event_str.startswith("add_item:"):
+                item = event_str.split(":", 1)[1]
+                player.add_item(item)
+                return f"[事件] 你获得了物品：{item}"
+            elif event_str.startswith("remove_item:"):
+                item = event_str.split(":", 1)[1]
+                if player.remove_item(item):
+                    return f"[事件] 你失去了物品：{item}"
+            elif event_str.startswith("add_experience:"):
+                exp = int(event_str.split(":")[1])
+                player.add_experience(exp)
+                return f"[事件] 你获得了 {exp} 点经验！"
+            # 可扩展更多事件类型
+        except Exception as e:
+            return f"[事件处理异常] {e}"
+        return None
+    
+    def play_turn(self, player_input, state_manager, cancel_token=None, regenerate=False):
+        """执行一个普通回合：结算所选选项的事件，推进剧情并更新游戏状态
+        
+        返回 {'messages': 事件提示列表, 'next_state': 下一步剧情, 'ended': 是否结束, 'dead': 是否死亡,
+              'effects': 本回合由状态变化文本产生的效果, 'degradation': AI回合因时间预算降级的级别名}
+        cancel_token被取消时中止生成并抛出GenerationCancelled，此时这一局已被放弃，不再保证状态完整；
+        regenerate为True时不复用分支树中已生成的内容
+        """
+        current_state = state_manager.get_current_state()
+        options = current_state.get('options', [])
+        option_events = current_state.get('option_events', [])
+        messages = []
+        
+        # 判断是否为结构化选项
+        chosen_index = None
+        if options and player_input in options:
+            chosen_index = options.index(player_input)
+        elif options and player_input.isdigit():
+            idx = int(player_input) - 1
+            if 0 <= idx < len(options):
+                chosen_index = idx
+        
+        # 触发AI结构化事件
+        if chosen_index is not None and option_events and chosen_index < len(option_events):
+            message = self.apply_option_event(option_events[chosen_index], state_manager.player)
+            if message:
+                messages.append(message)
+        
+        # 录制/回放磁带按局记录玩家输入
+        cassette = self.scene_prompt.cassette if self.use_ai_generation else None
+        if cassette is not None:
+            cassette.record_turn(state_manager.get_game_id(), player_input)
+        
+        next_state = self.next_step(player_input, state_manager, cancel_token, regenerate)
+        ended = dead = False
+        if next_state:
+            state_manager.update_story(
+                next_state.get('scene_id', f"scene_{state_manager.story.current_scene_id}"),
+                next_state.get('description', ''),
+                next_state.get('options', []),
+                player_input,
+                next_state.get('option_events', [])
+            )
+            # 如果游戏结束，标记结束
+            if next_state.get('is_end', False):
+                state_manager.end_game(next_state.get('ending_type', 'normal'))
+                ended = True
+            if not state_manager.player.is_alive():
+                state_manager.end_game("dead")
+                ended = dead = True
+            if ended and cassette is not None:
+                cassette.record_end(state_manager.get_game_id(), state_manager)
+        state_manager.checkpoint(self.story_step)
+        effects = [e for entry in self.effect_log if entry['step'] == self.story_step for e in entry['effects']]
+        degradation = DEGRADATION_LEVELS[self.turn_degradation] if self.use_ai_generation else None
+        return {'messages': messages, 'next_state': next_state, 'ended': ended, 'dead': dead, 'effects': effects,
+                'degradation': degradation}
+    
+    def next_step(self, player_input, state_manager, cancel_token=None, regenerate=False):
+        """处理玩家输入，生成下一步剧情；走过的分支复用已生成的内容，regenerate为True时重新生成"""
+        check_cancelled(cancel_token)
         self.story_step += 1
+        self.turn_degradation = 0
+        # 撤销后重新进行的回合：丢弃被放弃的后续回合留下的效果记录
+        while self.effect_log and self.effect_log[-1]['step'] >= self.story_step:
+            self.effect_log.pop()
         
         # 如果启用AI生成
         if self.use_ai_generation:
-            return self.generate_ai_story(player_input, state_manager)
+            return self.generate_ai_story(player_input, state_manager, cancel_token, regenerate)
         else:
+            if state_manager.get_story_flag(BRANCH_FLAG) is not None:
+                state_manager.set_story_flag(BRANCH_FLAG, None)
             return self.generate_preset_story(player_input, state_manager)
     
-    def generate_ai_story(self, player_input, state_manager):
-        """使用AI生成故事内容"""
+    def generate_ai_story(self, player_input, state_manager, cancel_token=None, regenerate=False):
+        """使用AI生成故事内容；已探索过的分支直接复用分支树中缓存的内容，regenerate为True时重新生成并替换
+
+        每次模型调用都带上cancel_token，取消后不再回退到预设剧情；
+        启用回合时间预算时按剩余时间逐级降级，预算用完时回退到预设剧情，降级级别记录在degradation_log中
+        """
+        started = time.monotonic()
+        story = state_manager.story
+        parent_id = state_manager.get_story_flag(BRANCH_FLAG) or root_id(story.current_description)
+        key = normalize_input(player_input, story.current_options)
+        cached = None if regenerate else state_manager.branches.child(parent_id, key)
+        if cached is None and not self.scene_prompt.is_available(state_manager.get_story_flag("story_theme", "explore")):
+            # 模型后端熔断中：不发请求，直接走预设剧情；已探索过的分支仍从分支树复用
+            self.short_circuited += 1
+            self._degrade(len(DEGRADATION_LEVELS) - 1)
+            self._record_degradation(started)
+            state_manager.set_story_flag(BRANCH_FLAG, None)
+            return self.generate_preset_story(player_input, state_manager)
+        deadline = self.scene_prompt.turn_deadline.start(cancel_token) if cached is None else None
         try:
-            # 获取历史剧情摘要
-            history_text = "\n".join([node.description for node in state_manager.story.history])
-            summary = self.scene_prompt.summarize_history(history_text) if history_text else ""
-            # 获取当前故事上下文
-            story_context = state_manager.get_story_context()
-            theme = state_manager.get_story_flag("story_theme", "explore")
-            # 生成事件推进
-            previous_events = [node.description for node in state_manager.story.history[-3:]]
-            event_result = self.scene_prompt.generate_event_progression(
-                story_context, 
-                player_input, 
-                previous_events
-            )
-            # 处理状态变化
-            self.process_status_changes(event_result.get('status_changes', ''), state_manager)
-            # 生成新场景，拼接摘要+最新事件+玩家操作
-            updated_context = f"剧情摘要：{summary}\n" if summary else ""
-            updated_context += story_context + f"\n最新发生：{event_result['event_result']}"
-            # 动态选择剧情类型（可根据上下文/分支扩展）
-            scene_type = theme  # 这里可根据实际分支动态调整
-            scene_result = self.scene_prompt.generate_scene(
-                updated_context,
-                player_input,
-                scene_type
-            )
+            if cached is not None:
+                self.branch_stats['hits'] += 1
+                content = cached.payload
+                # 复用生成的文本，状态变化仍按规则重新结算
+                self.process_status_changes(content['status_changes'], state_manager)
+                node_id = cached.node_id
+            else:
+                self.branch_stats['regenerated' if regenerate else 'misses'] += 1
+                content = self._generate_turn_content(player_input, state_manager,
+                                                      deadline.token if deadline else cancel_token, deadline)
+                node_id = None
+                # 跳过了事件推进或缩短了场景的内容不缓存，再次走到该分支时重新完整生成
+                if self.turn_degradation < DEGRADATION_LEVELS.index("event_skipped"):
+                    node = state_manager.branches.add_child(parent_id, key, content)
+                    node_id = node.node_id if node is not None else None
+            state_manager.set_story_flag(BRANCH_FLAG, node_id)
             # 随机添加一些游戏性元素
             self.add_random_game_elements(state_manager)
             # 检查是否应该结束游戏
             should_end = self.check_ending_conditions(state_manager)
             return {
                 'scene_id': f'ai_scene_{self.story_step}',
-                'description': scene_result['description'],
-                'options': scene_result.get('options', []),
-                'option_events': scene_result.get('option_events', []),
+                'description': content['description'],
+                'options': content['options'],
+                'option_events': content['option_events'],
                 'is_end': should_end,
                 'ending_type': 'ai_generated' if should_end else None
             }
+        except GenerationCancelled as e:
+            # 玩家放弃的回合直接中止；只是时间预算用完时仍要按时给出剧情
+            if not (deadline and deadline.expired):
+                raise
+            print(f"AI生成故事超时，使用预设剧情: {e}")
+            return self._fallback_story(player_input, state_manager)
         except Exception as e:
             print(f"AI生成故事失败: {e}")
-            # 回退到预设逻辑
-            return self.generate_preset_story(player_input, state_manager)
+            return self._fallback_story(player_input, state_manager)
+        finally:
+            if deadline:
+                deadline.finish()
+            if not (cancel_token and cancel_token.cancelled):
+                self._record_degradation(started)
     
-    def generate_preset_story(self, player_input, state_manager):
-        """生成预设的故事内容（备用方案）"""
-        player = state_manager.player
-        if self.story_step == 1:
-            if "观察" in player_input or "环顾" in player_input:
-                # 事件效果：获得物品
-                player.add_item("古老钥匙")
-                return {
-                    'scene_id': f'scene_{self.story_step}',
-                    'description': '你仔细观察房间，发现这里有一张古老的书桌、一扇紧闭的门和一扇窗。书桌上放着一本厚厚的日记。你获得了一把古老钥匙。',
-                    'options': ['查看日记', '尝试开门', '走向窗户'],
-                    'is_end': False
-                }
-            elif "回忆" in player_input:
-                # 事件效果：恢复生命值
-                player.heal(10)
-                return {
-                    'scene_id': f'scene_{self.story_step}',
-                    'description': '你努力回想，模糊记得自己在寻找一个传说中的魔法宝物，但之后的记忆一片空白。头部隐隐作痛。你静下心来，感觉精神稍有恢复（生命+10）。',
-                    'options': ['继续回忆', '放弃回忆，探索房间', '检查身体状况'],
-                    'is_end': False
-                }
-            else:  # 寻找出口
-                # 事件效果：受到伤害
-                player.take_damage(15)
-                return {
-                    'scene_id': f'scene_{self.story_step}',
-                    'description': '你寻找出口，但发现房门被一道魔法屏障封锁。屏障散发着蓝色的光芒，似乎需要特殊的方法才能破解。你试图强行突破，结果受到魔法反噬（生命-15）。',
-                    'options': ['尝试触摸屏障', '寻找破解方法', '探索其他出路'],
-                    'is_end': False
-                }
-        
-        elif self.story_step == 2:
-            if "日记" in player_input:
-                player.add_item("神秘日记")
-                player.add_experience(15)
-                state_manager.set_story_flag("read_diary", True)
-                return {
-                    'scene_id': f'scene_{self.story_step}',
-                    'description': '日记记录着一位法师的研究笔记。最后几页提到了"星光之石"的传说，以及打开封印的咒语。你获得了重要线索和神秘日记（经验+15，获得物品）。',
-                    'options': ['尝试念出咒语', '继续探索房间', '保存日记，寻找其他线索'],
-                    'is_end': False
-                }
-            else:
-                # 事件效果：失去物品/受伤
-                if player.has_item("古老钥匙"):
-                    player.remove_item("古老钥匙")
-                    lost_item = "你不小心遗失了古老钥匙。"
-                else:
-                    lost_item = "你感到一阵眩晕，似乎受到了房间魔法的影响（生命-10）。"
-                    player.take_damage(10)
-                return {
-                    'scene_id': f'scene_{self.story_step}',
-                    'description': f'你的行动产生了意想不到的效果。房间中的魔法能量开始波动，一些隐藏的机关被激活了。{lost_item}',
-                    'options': ['观察魔法变化', '迅速寻找掩护', '尝试控制魔法能量'],
-                    'is_end': False
-                }
-        
-        elif self.story_step >= 3:
-            if state_manager.get_story_flag("read_diary", False):
-                player.add_experience(50)
-                return {
-                    'scene_id': 'ending_good',
-                    'description': '凭借日记中的知识，你成功破解了房间的封印。一道光芒闪过，你发现自己站在了一座宏伟的魔法图书馆中。真正的冒险现在才开始...',
-                    'options': [],
-                    'is_end': True,
-                    'ending_type': 'good'
-                }
+    def _fallback_story(self, player_input, state_manager):
+        self._degrade(len(DEGRADATION_LEVELS) - 1)
+        # 预设剧情不在分支树上，下一回合从新场景重新建立分支
+        state_manager.set_story_flag(BRANCH_FLAG, None)
+        # 回退到预设逻辑
+        return self.generate_preset_story(player_input, state_manager)
+    
+    def _degrade(self, level):
+        self.turn_degradation = max(self.turn_degradation, level)
+    
+    def _record_degradation(self, started):
+        level = DEGRADATION_LEVELS[self.turn_degradation]
+        self.degradation_counts[level] += 1
+        self.degradation_log.append({
+            'step': self.story_step,
+            'level': level,
+            'elapsed_ms': round((time.monotonic() - started) * 1000, 1)
+        })
+    
+    @staticmethod
+    def _within_budget(deadline, cancel_token, reserve, call):
+        """执行一个可以降级的阶段：回合剩余时间降到reserve秒时中止该阶段并返回None，玩家放弃时仍抛出GenerationCancelled"""
+        if deadline is None:
+            return call(cancel_token)
+        stage = Deadline(deadline.remaining() - reserve, parent=cancel_token)
+        try:
+            return call(stage.token)
+        except GenerationCancelled:
+            if not stage.expired:
+                raise
+            return None
+        finally:
+            stage.finish()
+    
+    def _generate_turn_content(self, player_input, state_manager, cancel_token=None, deadline=None):
+        """调用模型生成一个回合的事件与新场景，返回可以缓存到分支树中的内容
+
+        deadline为回合时间预算：剩余时间不足时依次改用本地摘要、跳过事件推进、限制场景长度，
+        模型摘要或事件推进超出其时间份额时中止并降级，此时剩余时间已低于下一阶段的阈值，下一阶段也随之降级；
+        连场景也来不及生成时让预算提前到期
+        """
+        policy = self.scene_prompt.turn_deadline
+        remaining = deadline.remaining if deadline else (lambda: float("inf"))
+        # 获取历史剧情摘要
+        history_text = "\n".join([node.description for node in state_manager.story.history])
+        # 物品与玩家名在摘要中优先保留
+        salient = [state_manager.player.name, *state_manager.player.inventory]
+        summary = ""
+        if history_text:
+            summarize = lambda token, local_only=False: self.scene_prompt.summarize_history(
+                history_text, cancel_token=token, salient=salient, local_only=local_only)
+            if remaining() >= policy.llm_summary_min_remaining or self.scene_prompt.summarizer.fits(history_text):
+                summary = self._within_budget(deadline, cancel_token, policy.event_min_remaining, summarize)
             else:
-                player.add_experience(20)
-                player.take_damage(20)
-                return {
-                    'scene_id': 'ending_neutral',
-                    'description': '经过一番努力，你找到了离开房间的方法，但你感觉错过了什么重要的东西。也许还有其他的秘密等待着被发现...（生命-20）',
-                    'options': [],
-                    'is_end': True,
-                    'ending_type': 'neutral'
-                }
-        
-        # 默认情况
+                summary = None
+            if summary is None:
+                self._degrade(DEGRADATION_LEVELS.index("summary_skipped"))
+                summary = summarize(cancel_token, local_only=True)
+        # 获取当前故事上下文
+        story_context = state_manager.get_story_context()
+        theme = state_manager.get_story_flag("story_theme", "explore")
+        # 生成事件推进
+        previous_events = [node.description for node in state_manager.story.history[-3:]]
+        event_result = None
+        if remaining() >= policy.event_min_remaining:
+            event_result = self._within_budget(
+                deadline, cancel_token, policy.full_scene_min_remaining,
+                lambda token: self.scene_prompt.generate_event_progression(
+                    story_context, 
+                    player_input, 
+                    previous_events,
+                    cancel_token=token
+                )
+            )
+        if event_result is None:
+            # 时间不够推进事件：只记录玩家的选择，不产生状态变化
+            self._degrade(DEGRADATION_LEVELS.index("event_skipped"))
+            event_result = {'event_result': f"你选择了{player_input}。", 'status_changes': ""}
+        # 处理状态变化
+        status_changes = event_result.get('status_changes', '')
+        self.process_status_changes(status_changes, state_manager)
+        # 生成新场景，拼接摘要+最新事件+玩家操作
+        updated_context = f"剧情摘要：{summary}\n" if summary else ""
+        updated_context += story_context + f"\n最新发生：{event_result['event_result']}"
+        # 动态选择剧情类型（可根据上下文/分支扩展）
+        scene_type = theme  # 这里可根据实际分支动态调整
+        max_output = None
+        if remaining() < policy.scene_min_remaining:
+            deadline.expire()
+            check_cancelled(cancel_token)
+        if remaining() < policy.full_scene_min_remaining:
+            self._degrade(DEGRADATION_LEVELS.index("scene_capped"))
+            max_output = policy.capped_scene_tokens
+        scene_result = self.scene_prompt.generate_scene(
+            updated_context,
+            player_input,
+            scene_type,
+            session_id=state_manager.get_game_id(),
+            session_anchor=state_manager.story.current_description,
+            latest_event=event_result['event_result'],
+            cancel_token=cancel_token,
+            max_output=max_output
+        )
         return {
-            'scene_id': 'default',
-            'description': '你的冒险还在继续，未知的挑战在前方等待着你...',
-            'options': ['继续探索', '仔细思考', '寻找线索'],
-            'is_end': False
+            'event_result': event_result['event_result'],
+            'status_changes': status_changes,
+            'description': scene_result['description'],
+            'options': scene_result.get('options', []),
+            'option_events': scene_result.get('option_events', [])
         }
     
+    def undo(self, state_manager, steps=1):
+        """撤销steps个回合，剧情步数随快照一起恢复"""
+        if not state_manager.go_back(steps):
+            return False
+        self._sync_step(state_manager)
+        return True
+    
+    def redo(self, state_manager, steps=1):
+        """重做之前撤销的steps个回合"""
+        if not state_manager.go_forward(steps):
+            return False
+        self._sync_step(state_manager)
+        return True
+    
+    def _sync_step(self, state_manager):
+        # 读档时的快照没有步数，保持当前值
+        if state_manager.current_step is not None:
+            self.story_step = state_manager.current_step
+    
+    def generate_preset_story(self, player_input, state_manager):
+        """按预设剧情图推进（备用方案，也可作为不依赖模型的高吞吐模式）"""
+        return self.story_graph.advance(player_input, state_manager)
+    
     def process_status_changes(self, status_changes, state_manager):
-        """处理AI生成的状态变化"""
-        player = state_manager.player
+        """按规则表把AI生成的状态变化转换为效果并批量执行，返回执行的效果列表"""
         if not status_changes:
-            return
+            return []
         try:
-            text = status_changes.lower()
-            if "获得" in text or "发现" in text:
-                items = ["古老钥匙", "魔法水晶", "神秘卷轴", "治疗药水", "银币"]
-                item = random.choice(items)
-                player.add_item(item)
-                print(f"[系统] 你获得了：{item}")
-            if "经验" in text or "学习" in text or "理解" in text:
-                exp = random.randint(10, 30)
-                player.add_experience(exp)
-                print(f"[系统] 你获得了 {exp} 点经验")
-            if "受伤" in text or "伤害" in text:
-                damage = random.randint(5, 15)
-                player.take_damage(damage)
-                print(f"[系统] 你受到了 {damage} 点伤害")
-            elif "治疗" in text or "恢复" in text:
-                healing = random.randint(10, 25)
-                player.heal(healing)
-                print(f"[系统] 你恢复了 {healing} 点生命值")
-            if "重要" in text or "关键" in text:
-                state_manager.set_story_flag(f"important_event_{self.story_step}", True)
+            effects = self.status_rules.extract(status_changes, state_manager.rng, self.story_step)
+            apply_status_effects(effects, state_manager)
         except Exception as e:
             print(f"处理状态变化时出错: {e}")
+            return []
+        for effect in effects:
+            if effect.message:
+                print(effect.message)
+        self.effect_log.append({
+            'step': self.story_step,
+            'status_changes': status_changes,
+            'effects': [effect.to_dict() for effect in effects]
+        })
+        return effects
     
     def add_random_game_elements(self, state_manager):
         """随机添加游戏性元素"""
-        if random.random() < 0.3:  # 30%概率
+        rng = state_manager.rng
+        if rng.random() < 0.3:  # 30%概率
             # 随机事件
             events = [
-                ("经验", random.randint(5, 15)),
-                ("物品", random.choice(["幸运符", "能量果实", "神秘石头"])),
-                ("治疗", random.randint(5, 10))
+                ("经验", rng.randint(5, 15)),
+                ("物品", rng.choice(["幸运符", "能量果实", "神秘石头"])),
+                ("治疗", rng.randint(5, 10))
             ]
             
-            event_type, value = random.choice(events)
+            event_type, value = rng.choice(events)
             
             if event_type == "经验":
                 state_manager.player_gain_experience(value)
@@ -279,6 +503,11 @@ class GameEngine:
         
         return False
     
+    def warm_up(self):
+        """进程启动时在后台预加载模型"""
+        if self.use_ai_generation:
+            self.scene_prompt.warm_up()
+    
     def toggle_ai_generation(self, enabled=None):
         """切换AI生成模式"""
         if enabled is None:
@@ -288,13 +517,41 @@ class GameEngine:
         
         return self.use_ai_generation
     
+    def get_deadline_stats(self):
+        """获取回合时间预算设置与各降级级别的回合数"""
+        policy = self.scene_prompt.turn_deadline if self._scene_prompt is not None else None
+        return {
+            'enabled': bool(policy and policy.enabled),
+            'seconds': policy.seconds if policy else None,
+            'levels': dict(self.degradation_counts),
+            'recent': list(self.degradation_log)[-10:]
+        }
+    
     def get_generation_status(self):
         """获取当前生成模式状态"""
-        return {
+        status = {
             'ai_enabled': self.use_ai_generation,
             'theme': self.game_theme,
-            'step': self.story_step
+            'step': self.story_step,
+            'model_status': {'state': 'cold', 'ready': False},
+            'branch_cache': dict(self.branch_stats),
+            'circuit': {'state': 'closed', 'pools': {}, 'short_circuited': self.short_circuited},
+            'deadline': self.get_deadline_stats()
         }
+        # 尚未用到AI生成时不为了查询状态而初始化LLM模块
+        if self._scene_prompt is not None:
+            status.update({
+                'model_status': self._scene_prompt.get_model_status(),
+                'backends': self._scene_prompt.get_backend_stats(),
+                'routes': self._scene_prompt.get_route_stats(),
+                'hedging': self._scene_prompt.get_hedging_stats(),
+                'parsing': self._scene_prompt.get_parse_stats(),
+                'session': self._scene_prompt.get_session_stats(),
+                'cancellation': self._scene_prompt.get_cancellation_stats(),
+                'summary': self._scene_prompt.get_summary_stats(),
+                'circuit': {**self._scene_prompt.get_circuit_status(), 'short_circuited': self.short_circuited}
+            })
+        return status
 
 # 测试GameEngine的AI集成功能
 if __name__ == "__main__":
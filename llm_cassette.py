@@ -0,0 +1,172 @@
+# 模型调用录制与回放：录制模式把每次模型请求/响应及耗时写入磁带文件，回放模式按原顺序返回，不需要真实模型
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from cancellation import GenerationCancelled
+
+# 当前正在进行的游戏，用于把同一进程中多局游戏交错的调用区分开
+_current_game = contextvars.ContextVar("cassette_game", default=None)
+
+
+class CassetteExhaustedError(Exception):
+    """回放时磁带中没有更多对应的录制结果"""
+
+
+class CassetteReplayError(Exception):
+    """回放录制时失败的模型调用"""
+
+
+def prompt_key(call_type: str, prompt: str) -> str:
+    """请求的指纹，回放时用于检测prompt构造是否发生变化"""
+    return hashlib.sha1(f"{call_type}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def set_current_game(game_id: Optional[str]) -> None:
+    """标记当前线程/上下文中进行的游戏"""
+    _current_game.set(game_id)
+
+
+class CassetteRecorder:
+    """录制模式：游戏开始、玩家输入、模型调用和游戏结束逐行追加到JSONL磁带文件"""
+
+    mode = "record"
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        entry['time'] = time.time()
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def record_game(self, game_id: str, seed: int, theme: str, player_name: str) -> None:
+        set_current_game(game_id)
+        self._write({'type': 'game', 'game_id': game_id, 'seed': seed, 'theme': theme, 'player_name': player_name})
+
+    def record_turn(self, game_id: str, player_input: str) -> None:
+        set_current_game(game_id)
+        self._write({'type': 'turn', 'game_id': game_id, 'input': player_input})
+
+    def record_end(self, game_id: str, state_manager) -> None:
+        player = state_manager.player
+        self._write({
+            'type': 'end',
+            'game_id': game_id,
+            'ending': state_manager.story.ending_type,
+            'health': player.health,
+            'experience': player.experience,
+            'inventory': list(player.inventory)
+        })
+
+    def invoke(self, call_type: str, prompt: str, params: Dict[str, Any], call: Callable[[], str]) -> str:
+        """执行真实调用并录制结果，失败的调用也会录制以便回放降级路径"""
+        start = time.monotonic()
+        entry = {
+            'type': 'llm',
+            'game_id': _current_game.get(),
+            'call_type': call_type,
+            'key': prompt_key(call_type, prompt),
+            'prompt': prompt,
+            'params': params
+        }
+        try:
+            response = call()
+        except GenerationCancelled:
+            # 被放弃的回合不会再继续，录制下来反而会打乱回放顺序
+            raise
+        except Exception as e:
+            entry.update({'error': str(e), 'latency': time.monotonic() - start})
+            self._write(entry)
+            raise
+        entry.update({'response': response, 'latency': time.monotonic() - start})
+        self._write(entry)
+        return response
+
+
+class CassettePlayer:
+    """回放模式：按录制顺序返回每局游戏的模型响应，latency_scale控制模拟耗时（1为原速，0为不等待）"""
+
+    mode = "replay"
+
+    def __init__(self, path: str, latency_scale: float = 1.0):
+        self.path = path
+        self.latency_scale = latency_scale
+        self.games: Dict[str, Dict[str, Any]] = {}
+        self.turns: Dict[str, List[str]] = defaultdict(list)
+        self.endings: Dict[str, Dict[str, Any]] = {}
+        self._calls: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+        self._positions: Dict[Any, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self.stats = {'served': 0, 'prompt_mismatches': 0, 'exhausted': 0, 'recorded_errors': 0}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._load_entry(json.loads(line))
+
+    def _load_entry(self, entry: Dict[str, Any]) -> None:
+        kind = entry.get('type')
+        game_id = entry.get('game_id')
+        if kind == 'game':
+            self.games[game_id] = entry
+        elif kind == 'turn':
+            self.turns[game_id].append(entry['input'])
+        elif kind == 'end':
+            self.endings[game_id] = entry
+        elif kind == 'llm':
+            self._calls[(game_id, entry['call_type'])].append(entry)
+
+    # 回放时游戏引擎同样会通知游戏开始/回合/结束，这里只切换当前游戏
+    def record_game(self, game_id: str, seed: int, theme: str, player_name: str) -> None:
+        set_current_game(game_id)
+
+    def record_turn(self, game_id: str, player_input: str) -> None:
+        set_current_game(game_id)
+
+    def record_end(self, game_id: str, state_manager) -> None:
+        pass
+
+    def invoke(self, call_type: str, prompt: str, params: Dict[str, Any], call: Callable[[], str] = None) -> str:
+        """返回当前游戏下一条同类型调用的录制结果，不会真正调用模型"""
+        slot = (_current_game.get(), call_type)
+        with self._lock:
+            position = self._positions[slot]
+            entries = self._calls.get(slot, [])
+            if position >= len(entries):
+                self.stats['exhausted'] += 1
+                raise CassetteExhaustedError(f"磁带中没有更多{call_type}调用的录制")
+            self._positions[slot] = position + 1
+            entry = entries[position]
+            self.stats['served'] += 1
+            if entry['key'] != prompt_key(call_type, prompt):
+                # prompt与录制时不同，说明prompt构造逻辑或上游状态发生了变化
+                self.stats['prompt_mismatches'] += 1
+        if self.latency_scale > 0:
+            time.sleep(entry.get('latency', 0) * self.latency_scale)
+        if 'error' in entry:
+            self.stats['recorded_errors'] += 1
+            raise CassetteReplayError(entry['error'])
+        return entry['response']
+
+
+def open_cassette(config: Optional[Dict[str, Any]]):
+    """根据config.json的cassette配置创建录制器或回放器，mode为off时返回None"""
+    config = config or {}
+    mode = config.get("mode", "off")
+    path = config.get("path", "cassettes/session.jsonl")
+    if mode == "record":
+        return CassetteRecorder(path)
+    if mode == "replay":
+        return CassettePlayer(path, config.get("latency_scale", 1.0))
+    return None
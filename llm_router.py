@@ -0,0 +1,1125 @@
+# 模型后端路由：多个Ollama实例的负载均衡、健康检查与故障转移
+import json
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from cancellation import CancelToken, GenerationCancelled
+from ollama_client import OllamaClient, RequestAbort
+from output_parser import JsonCompletionDetector
+
+
+class BackendUnavailableError(Exception):
+    """没有可用的模型后端"""
+
+
+class CircuitOpenError(BackendUnavailableError):
+    """熔断器打开期间被直接拒绝的调用，没有发出任何请求"""
+
+
+# LangChain流式读取线程与调用方之间的结束标记
+_STREAM_END = object()
+_STREAM_ABORTED = object()
+
+
+@dataclass
+class BackendStats:
+    """单个后端的调用统计"""
+    requests: int = 0
+    successes: int = 0
+    failures: int = 0
+    total_latency: float = 0.0
+    ewma_latency: Optional[float] = None
+    prompt_eval_tokens: int = 0
+    prompt_eval_seconds: float = 0.0
+    last_error: str = ""
+
+    def record_success(self, latency: float, alpha: float = 0.3) -> None:
+        """记录一次成功调用及其耗时"""
+        self.successes += 1
+        self.total_latency += latency
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = alpha * latency + (1 - alpha) * self.ewma_latency
+
+    def record_prompt_eval(self, metadata: Dict[str, Any]) -> None:
+        """记录后端返回的prompt评估耗时，用于观察前缀缓存/上下文复用的效果"""
+        self.prompt_eval_tokens += metadata.get("prompt_eval_count") or 0
+        self.prompt_eval_seconds += (metadata.get("prompt_eval_duration") or 0) / 1e9
+
+    def record_failure(self, error: Exception) -> None:
+        """记录一次失败调用"""
+        self.failures += 1
+        self.last_error = str(error)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式"""
+        return {
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'avg_latency': self.total_latency / self.successes if self.successes else None,
+            'ewma_latency': self.ewma_latency,
+            'prompt_eval_tokens': self.prompt_eval_tokens,
+            'prompt_eval_seconds': self.prompt_eval_seconds,
+            'last_error': self.last_error
+        }
+
+
+class LLMBackend:
+    """单个Ollama模型后端"""
+
+    # LangChain的Ollama封装无法回传context参数，只能依赖后端的前缀缓存
+    supports_context = False
+
+    def __init__(self, name: str, base_url: str, model_name: str):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.model_name = model_name
+        self._llm = None
+        self.healthy = True
+        self.outstanding = 0
+        self.stats = BackendStats()
+        self.last_failure_at: Optional[float] = None
+        self.last_health_check: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def llm(self):
+        """LangChain的Ollama封装，首次调用模型时才导入"""
+        if self._llm is None:
+            from langchain_community.llms import Ollama
+            self._llm = Ollama(model=self.model_name, base_url=self.base_url)
+        return self._llm
+
+    def invoke(self, prompt: str, **kwargs) -> str:
+        """调用模型生成文本"""
+        return self.llm.invoke(prompt, **kwargs)
+
+    def stream(self, prompt: str, metadata: Dict[str, Any] = None, abort: RequestAbort = None,
+               **kwargs) -> Iterator[str]:
+        """流式调用模型，逐个返回token；结束时把后端返回的统计信息写入metadata
+
+        LangChain封装拿不到底层连接，传入abort时在后台线程读取：中止后调用方立即返回，
+        读取线程在收到下一个token时关闭流，连接随之断开
+        """
+        if abort is None:
+            yield from self._read_stream(prompt, metadata, **kwargs)
+            return
+        items: 'queue.Queue' = queue.Queue()
+        # 调用方提前关闭流（检测到JSON闭合、中止）后读取线程不再继续读
+        stopped = threading.Event()
+
+        def pump() -> None:
+            try:
+                for text in self._read_stream(prompt, metadata, **kwargs):
+                    if stopped.is_set() or abort.aborted:
+                        break
+                    items.put(text)
+            except Exception as e:
+                items.put(e)
+            finally:
+                items.put(_STREAM_END)
+
+        threading.Thread(target=pump, name=f"langchain-stream-{self.name}", daemon=True).start()
+        abort.on_abort(lambda: items.put(_STREAM_ABORTED))
+        try:
+            while True:
+                item = items.get()
+                if item is _STREAM_END:
+                    return
+                if item is _STREAM_ABORTED:
+                    raise ConnectionAbortedError("请求已中止")
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+
+    def _read_stream(self, prompt: str, metadata: Dict[str, Any] = None, **kwargs) -> Iterator[str]:
+        for chunk in self.llm._stream(prompt, **kwargs):
+            if chunk.generation_info and metadata is not None:
+                metadata.update(chunk.generation_info)
+            yield chunk.text
+
+    def begin_request(self) -> None:
+        with self._lock:
+            self.outstanding += 1
+            self.stats.requests += 1
+
+    def end_request(self, latency: float = None, error: Exception = None, cancelled: bool = False,
+                    metadata: Dict[str, Any] = None) -> None:
+        with self._lock:
+            self.outstanding -= 1
+            if cancelled:
+                return
+            if error is None:
+                self.stats.record_success(latency)
+                if metadata:
+                    self.stats.record_prompt_eval(metadata)
+                self.healthy = True
+            else:
+                self.stats.record_failure(error)
+                self.healthy = False
+                self.last_failure_at = time.monotonic()
+
+    def health_check(self, timeout: float = 3.0) -> bool:
+        """探测后端是否存活，并确认已拉取配置的模型"""
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/api/tags", timeout=timeout) as resp:
+                data = json.loads(resp.read().decode("utf-8"))
+            names = set()
+            for model in data.get("models", []):
+                names.add(model.get("name"))
+                names.add(model.get("model"))
+            healthy = self.model_name in names or f"{self.model_name}:latest" in names
+            if not healthy:
+                self.stats.last_error = f"模型 {self.model_name} 未在后端加载列表中"
+        except Exception as e:
+            healthy = False
+            self.stats.last_error = str(e)
+        with self._lock:
+            self.healthy = healthy
+            if not healthy:
+                self.last_failure_at = time.monotonic()
+            self.last_health_check = time.time()
+        return healthy
+
+    def warm_up(self, keep_alive: Any = None, timeout: float = 120.0) -> bool:
+        """发送空prompt让后端把模型加载进内存"""
+        payload = {"model": self.model_name, "prompt": "", "stream": False}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        request = urllib.request.Request(
+            f"{self.base_url}/api/generate",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as resp:
+                resp.read()
+            return True
+        except Exception as e:
+            self.stats.last_error = f"预热失败: {e}"
+            return False
+
+    def is_model_loaded(self, timeout: float = 3.0) -> bool:
+        """通过/api/ps检查模型当前是否常驻内存"""
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/api/ps", timeout=timeout) as resp:
+                data = json.loads(resp.read().decode("utf-8"))
+        except Exception:
+            return False
+        names = {model.get("name") for model in data.get("models", [])}
+        names |= {model.get("model") for model in data.get("models", [])}
+        return self.model_name in names or f"{self.model_name}:latest" in names
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出后端状态与统计"""
+        return {
+            'name': self.name,
+            'base_url': self.base_url,
+            'model_name': self.model_name,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'last_health_check': self.last_health_check,
+            **self.stats.to_dict()
+        }
+
+
+class NativeOllamaBackend(LLMBackend):
+    """直接调用Ollama HTTP API的后端：复用持久连接，省去LangChain的对象构造与回调开销，并能回传context"""
+
+    supports_context = True
+
+    def __init__(self, name: str, base_url: str, model_name: str, timeout: Optional[float] = None):
+        super().__init__(name, base_url, model_name)
+        self.client = OllamaClient(self.base_url, model_name, timeout)
+
+    def invoke(self, prompt: str, **kwargs) -> str:
+        """调用模型生成文本"""
+        return self.client.generate(prompt, **kwargs)
+
+    def stream(self, prompt: str, metadata: Dict[str, Any] = None, abort: RequestAbort = None,
+               **kwargs) -> Iterator[str]:
+        """流式调用模型，逐个返回token；结束时把后端返回的统计信息写入metadata；abort可随时断开请求"""
+        for message in self.client.stream(prompt, abort=abort, **kwargs):
+            if message.get("done") and metadata is not None:
+                metadata.update(message)
+            yield message.get("response", "")
+
+
+# config.json中client字段对应的后端实现
+BACKEND_CLIENTS = {
+    "langchain": LLMBackend,
+    "native": NativeOllamaBackend
+}
+
+
+@dataclass
+class HedgingPolicy:
+    """对冲请求策略：首token迟迟未到时向另一个后端发送副本"""
+    enabled: bool = False
+    percentile: float = 0.95
+    max_extra_load: float = 0.1
+    min_samples: int = 20
+    min_delay: float = 0.5
+    window: int = 200
+    allow_same_backend: bool = True
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'HedgingPolicy':
+        """从config.json的hedging配置创建策略"""
+        fields = cls.__dataclass_fields__
+        return cls(**{k: v for k, v in (config or {}).items() if k in fields})
+
+
+class CircuitBreaker:
+    """后端池熔断器
+
+    连续failure_threshold次调用失败（所有后端都失败）后打开，打开期间的调用立即失败，不再等待连接错误或超时；
+    打开后每隔probe_interval秒在后台探测一次，后端恢复后自动关闭
+    """
+
+    def __init__(self, enabled: bool = True, failure_threshold: int = 3, probe_interval: float = 10.0):
+        self.enabled = enabled
+        self.failure_threshold = max(1, failure_threshold)
+        self.probe_interval = max(1.0, probe_interval)
+        # 探测函数，返回后端是否已恢复；由所属的后端池设置
+        self.probe: Optional[Callable[[], bool]] = None
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.short_circuited = 0
+        self.times_opened = 0
+        self.opened_at: Optional[float] = None
+        self.last_change: Optional[float] = None
+        self.last_error = ""
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'CircuitBreaker':
+        """从config.json的circuit_breaker配置创建"""
+        config = config or {}
+        return cls(
+            enabled=config.get("enabled", True),
+            failure_threshold=config.get("failure_threshold", 3),
+            probe_interval=config.get("probe_interval", 10.0)
+        )
+
+    @property
+    def closed(self) -> bool:
+        return not self.enabled or self.state == "closed"
+
+    def allow(self) -> bool:
+        """是否放行一次调用；打开期间拒绝并计数"""
+        if self.closed:
+            return True
+        with self._lock:
+            self.short_circuited += 1
+        return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self, error: Exception) -> None:
+        """记录一次调用失败，连续失败达到阈值时打开并开始后台探测"""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            if not self.enabled or self.state == "open" or self.consecutive_failures < self.failure_threshold:
+                return
+            self.state = "open"
+            self.times_opened += 1
+            self.opened_at = self.last_change = time.time()
+            self._stop_event.clear()
+        print(f"[系统] 模型后端连续失败 {self.consecutive_failures} 次，暂停调用并在后台探测: {error}")
+        threading.Thread(target=self._probe_loop, name="llm-circuit-probe", daemon=True).start()
+
+    def close(self) -> None:
+        """后端恢复后关闭熔断器"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.last_change = time.time()
+            self._stop_event.set()
+        print("[系统] 模型后端已恢复，重新启用AI生成")
+
+    def _probe_loop(self) -> None:
+        while not self._stop_event.wait(self.probe_interval):
+            try:
+                recovered = self.probe is not None and self.probe()
+            except Exception as e:
+                recovered = False
+                self.last_error = str(e)
+            if recovered:
+                self.close()
+                return
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'short_circuited': self.short_circuited,
+                'times_opened': self.times_opened,
+                'opened_at': self.opened_at,
+                'last_change': self.last_change,
+                'last_error': self.last_error
+            }
+
+
+@dataclass
+class HedgingStats:
+    """对冲请求统计"""
+    requests: int = 0
+    hedges_fired: int = 0
+    hedges_won: int = 0
+    extra_tokens: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式"""
+        return {
+            'requests': self.requests,
+            'hedges_fired': self.hedges_fired,
+            'hedges_won': self.hedges_won,
+            'extra_tokens': self.extra_tokens,
+            'extra_load': self.hedges_fired / self.requests if self.requests else 0.0
+        }
+
+
+@dataclass
+class CancellationStats:
+    """取消统计：被取消的请求以及因此释放的生成量"""
+    aborted_requests: int = 0
+    skipped_requests: int = 0
+    discarded_tokens: int = 0
+    reclaimed_tokens: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式；reclaimed_tokens按num_predict估算，是未生成token数的上限"""
+        return {
+            'aborted_requests': self.aborted_requests,
+            'skipped_requests': self.skipped_requests,
+            'discarded_tokens': self.discarded_tokens,
+            'reclaimed_tokens': self.reclaimed_tokens
+        }
+
+
+@dataclass
+class SessionContext:
+    """一局游戏的会话状态：固定路由到同一后端以命中前缀缓存，并保存后端返回的KV上下文"""
+    backend_name: Optional[str] = None
+    context: Optional[List[int]] = None
+    # 上下文对应的最后一个场景的指纹，与当前剧情不一致时（回退、读档等）上下文作废
+    anchor: Optional[str] = None
+    # 上下文所属的模型路由，换用其他模型时上下文作废
+    route: Optional[str] = None
+    last_used: float = field(default_factory=time.monotonic)
+
+    def reset(self) -> None:
+        """丢弃已缓存的上下文，下次请求发送完整prompt"""
+        self.context = None
+
+
+@dataclass
+class _Request:
+    prompt: str
+    kwargs: Dict[str, Any]
+    stop_after_json: bool = False
+    session: Optional[SessionContext] = None
+    # 会话上下文可用时只发送的增量prompt
+    delta_prompt: Optional[str] = None
+    cancel_token: Optional[CancelToken] = None
+
+
+class _Attempt:
+    """对单个后端的一次流式请求（主请求或对冲副本）"""
+
+    def __init__(self, backend: LLMBackend, prompt: str, kwargs: Dict[str, Any], is_hedge: bool = False,
+                 stop_after_json: bool = False, uses_context: bool = False, cancel_token: CancelToken = None):
+        self.backend = backend
+        self.cancel_token = cancel_token
+        self.abort = RequestAbort()
+        self.prompt = prompt
+        self.kwargs = kwargs
+        self.is_hedge = is_hedge
+        self.uses_context = uses_context
+        self.metadata: Dict[str, Any] = {}
+        self.json_detector = JsonCompletionDetector() if stop_after_json else None
+        self.chunks: List[str] = []
+        self.error: Optional[Exception] = None
+        self.first_token_latency: Optional[float] = None
+        # 收到首个token或请求结束时置位
+        self.first_token = threading.Event()
+        self.cancel_event = threading.Event()
+        self.finished = False
+        self.abandoned = False
+
+    @property
+    def cancelled(self) -> bool:
+        """请求所属的回合已被取消"""
+        return self.cancel_token is not None and self.cancel_token.cancelled
+
+    @property
+    def succeeded(self) -> bool:
+        return self.finished and self.error is None and not self.cancel_event.is_set()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+
+class _AttemptsFailed(Exception):
+    def __init__(self, errors: List[str], context_lost: bool = False, cancelled: bool = False):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+        self.context_lost = context_lost
+        self.cancelled = cancelled
+
+
+class BackendRouter:
+    """后端池：按策略挑选后端，失败时自动切换到其他节点重试"""
+
+    STRATEGIES = ("least_outstanding", "latency")
+
+    def __init__(self, backends: List[LLMBackend], strategy: str = "least_outstanding",
+                 max_attempts: int = None, health_check_interval: float = 30.0,
+                 failure_cooldown: float = 30.0, hedging: HedgingPolicy = None,
+                 breaker: CircuitBreaker = None):
+        if not backends:
+            raise ValueError("至少需要配置一个模型后端")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"未知的路由策略: {strategy}")
+        self.backends = backends
+        self.strategy = strategy
+        self.max_attempts = max_attempts or len(backends)
+        self.health_check_interval = health_check_interval
+        self.failure_cooldown = failure_cooldown
+        self.hedging = hedging or HedgingPolicy()
+        self.hedging_stats = HedgingStats()
+        self._first_token_latencies = deque(maxlen=self.hedging.window)
+        self._hedge_lock = threading.Lock()
+        self.session_stats = {'delta_requests': 0, 'full_requests': 0, 'context_resets': 0}
+        self.cancellation_stats = CancellationStats()
+        self.breaker = breaker or CircuitBreaker(enabled=False)
+        self.breaker.probe = lambda: any(self.check_health().values())
+        self._stop_event = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'BackendRouter':
+        """根据config.json创建后端池，未配置backends时退化为单个后端"""
+        default_model = config.get("model_name", "llama3")
+        backend_configs = config.get("backends") or [
+            {"name": "default", "base_url": config.get("base_url", "http://localhost:11434")}
+        ]
+        default_client = config.get("client", "langchain")
+        backends = [
+            BACKEND_CLIENTS[item.get("client", default_client)](
+                name=item.get("name", item["base_url"]),
+                base_url=item["base_url"],
+                model_name=item.get("model_name", default_model)
+            )
+            for item in backend_configs
+        ]
+        routing = config.get("routing", {})
+        return cls(
+            backends,
+            strategy=routing.get("strategy", "least_outstanding"),
+            max_attempts=routing.get("max_attempts"),
+            health_check_interval=routing.get("health_check_interval", 30.0),
+            failure_cooldown=routing.get("failure_cooldown", 30.0),
+            hedging=HedgingPolicy.from_config(config.get("hedging")),
+            breaker=CircuitBreaker.from_config(config.get("circuit_breaker"))
+        )
+
+    def _is_available(self, backend: LLMBackend, now: float) -> bool:
+        # 失败的后端冷却一段时间后允许重新尝试，避免健康检查关闭时永久摘除
+        if backend.healthy:
+            return True
+        return backend.last_failure_at is None or now - backend.last_failure_at >= self.failure_cooldown
+
+    def _candidates(self, session: SessionContext = None) -> List[LLMBackend]:
+        """按路由策略排序的候选后端，会话已绑定的后端可用时排在最前"""
+        now = time.monotonic()
+        available = [b for b in self.backends if self._is_available(b, now)]
+        # 全部不可用时仍按顺序尝试，避免探测误判导致完全无法生成
+        pool = available or list(self.backends)
+        if self.strategy == "latency":
+            key = lambda b: (b.stats.ewma_latency or 0.0, b.outstanding)
+        else:
+            key = lambda b: (b.outstanding, b.stats.ewma_latency or 0.0)
+        ordered = sorted(pool, key=key)
+        if session is not None and session.backend_name:
+            ordered.sort(key=lambda b: b.name != session.backend_name)
+        return ordered
+
+    def invoke(self, prompt: str, stop_after_json: bool = False, session: SessionContext = None,
+               delta_prompt: str = None, cancel_token: CancelToken = None, **kwargs) -> str:
+        """在后端池中调用模型，失败时切换节点重试，启用对冲时为慢请求发送副本
+
+        stop_after_json为True时，顶层JSON闭合后立即结束生成；
+        传入session时固定路由到同一后端，后端支持context时只发送delta_prompt；
+        cancel_token被取消时中止进行中的请求并抛出GenerationCancelled，不再重试；
+        熔断器打开时不发出请求，直接抛出CircuitOpenError；
+        其余参数透传给Ollama
+        """
+        if cancel_token is not None and cancel_token.cancelled:
+            with self._hedge_lock:
+                self.cancellation_stats.skipped_requests += 1
+                self.cancellation_stats.reclaimed_tokens += kwargs.get("num_predict") or 0
+            raise GenerationCancelled(cancel_token.reason)
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"模型后端暂不可用，等待恢复: {self.breaker.last_error}")
+        request = _Request(prompt, kwargs, stop_after_json, session, delta_prompt, cancel_token)
+        try:
+            result = self._invoke_candidates(request)
+        except BackendUnavailableError as e:
+            self.breaker.record_failure(e)
+            raise
+        self.breaker.record_success()
+        return result
+
+    def _invoke_candidates(self, request: _Request) -> str:
+        """按候选顺序尝试各后端，全部失败时抛出BackendUnavailableError"""
+        session, cancel_token = request.session, request.cancel_token
+        errors = []
+        candidates = self._candidates(session)[:self.max_attempts]
+        while candidates:
+            backend = candidates.pop(0)
+            try:
+                if self.hedging.enabled:
+                    return self._invoke_hedged(backend, candidates, request)
+                return self._invoke_single(backend, request)
+            except _AttemptsFailed as e:
+                if e.cancelled:
+                    raise GenerationCancelled(cancel_token.reason)
+                errors.extend(e.errors)
+                print(f"模型后端调用失败，尝试其他后端: {e}")
+                if e.context_lost:
+                    # 缓存的上下文失效，用完整prompt在同一后端重试一次
+                    candidates.insert(0, backend)
+        raise BackendUnavailableError("所有模型后端调用失败: " + "; ".join(errors))
+
+    def _make_attempt(self, backend: LLMBackend, request: _Request, is_hedge: bool = False) -> _Attempt:
+        session = request.session
+        stop_after_json = request.stop_after_json
+        if session is not None and backend.supports_context:
+            # 后端只在最后一条流式消息中返回context，会话请求需要读完整个流
+            stop_after_json = False
+        if (session is not None and session.context and request.delta_prompt
+                and backend.supports_context and backend.name == session.backend_name):
+            kwargs = {**request.kwargs, 'context': session.context}
+            return _Attempt(backend, request.delta_prompt, kwargs, is_hedge, stop_after_json, uses_context=True,
+                            cancel_token=request.cancel_token)
+        return _Attempt(backend, request.prompt, request.kwargs, is_hedge, stop_after_json,
+                        cancel_token=request.cancel_token)
+
+    def _finish_request(self, attempt: _Attempt, request: _Request) -> str:
+        """记录胜出请求的会话状态并返回文本"""
+        session = request.session
+        with self._hedge_lock:
+            self.session_stats['delta_requests' if attempt.uses_context else 'full_requests'] += 1
+        if session is not None:
+            session.backend_name = attempt.backend.name
+            session.context = attempt.metadata.get("context") if attempt.backend.supports_context else None
+            session.last_used = time.monotonic()
+        return attempt.text
+
+    def _failed(self, attempts: List[_Attempt], request: _Request) -> _AttemptsFailed:
+        if request.cancel_token is not None and request.cancel_token.cancelled:
+            # 取消导致的失败不影响会话上下文，也不切换后端重试
+            return _AttemptsFailed([], cancelled=True)
+        errors = [f"{a.backend.name}: {a.error}" for a in attempts]
+        context_lost = any(a.uses_context for a in attempts)
+        if context_lost:
+            request.session.reset()
+            with self._hedge_lock:
+                self.session_stats['context_resets'] += 1
+        return _AttemptsFailed(errors, context_lost)
+
+    def _invoke_single(self, backend: LLMBackend, request: _Request) -> str:
+        attempt = self._make_attempt(backend, request)
+        self._run_attempt(attempt)
+        if attempt.error is not None or attempt.cancelled:
+            raise self._failed([attempt], request)
+        return self._finish_request(attempt, request)
+
+    def _run_attempt(self, attempt: _Attempt, done_queue: 'queue.Queue' = None) -> None:
+        """执行一次流式请求，可在后台线程中运行"""
+        backend = attempt.backend
+        unregister = None
+        if attempt.cancel_token is not None:
+            unregister = attempt.cancel_token.on_cancel(lambda: self._abort_attempt(attempt))
+        backend.begin_request()
+        start = time.monotonic()
+        stream = None
+        try:
+            stream = backend.stream(attempt.prompt, metadata=attempt.metadata, abort=attempt.abort, **attempt.kwargs)
+            for chunk in stream:
+                if attempt.first_token_latency is None:
+                    attempt.first_token_latency = time.monotonic() - start
+                    attempt.first_token.set()
+                attempt.chunks.append(chunk)
+                if attempt.cancel_event.is_set():
+                    break
+                if attempt.json_detector is not None and attempt.json_detector.feed(chunk):
+                    if attempt.json_detector.overflow:
+                        attempt.chunks[-1] = chunk[:-attempt.json_detector.overflow]
+                    break
+        except Exception as e:
+            attempt.error = e
+        finally:
+            # 提前结束时关闭流，断开连接让后端停止生成
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            if unregister is not None:
+                unregister()
+        attempt.first_token.set()
+        if attempt.cancelled:
+            # 回合被取消：请求被主动断开，不算作后端故障
+            backend.end_request(cancelled=True)
+            self._record_cancelled(attempt)
+        elif attempt.cancel_event.is_set():
+            backend.end_request(cancelled=True)
+        elif attempt.error is not None:
+            backend.end_request(error=attempt.error)
+        else:
+            backend.end_request(latency=time.monotonic() - start, metadata=attempt.metadata)
+            if attempt.first_token_latency is not None:
+                self._first_token_latencies.append(attempt.first_token_latency)
+        with self._hedge_lock:
+            attempt.finished = True
+            if attempt.abandoned:
+                self.hedging_stats.extra_tokens += len(attempt.chunks)
+        if done_queue is not None:
+            done_queue.put(attempt)
+
+    def _abort_attempt(self, attempt: _Attempt) -> None:
+        """取消令牌的回调、对冲落败时：标记请求并断开连接"""
+        attempt.cancel_event.set()
+        attempt.abort.abort()
+
+    def _record_cancelled(self, attempt: _Attempt) -> None:
+        with self._hedge_lock:
+            stats = self.cancellation_stats
+            stats.aborted_requests += 1
+            stats.discarded_tokens += len(attempt.chunks)
+            stats.reclaimed_tokens += max(0, (attempt.kwargs.get("num_predict") or 0) - len(attempt.chunks))
+
+    def _start_attempt(self, attempt: _Attempt, done_queue: 'queue.Queue') -> None:
+        threading.Thread(
+            target=self._run_attempt, args=(attempt, done_queue),
+            name=f"llm-attempt-{attempt.backend.name}", daemon=True
+        ).start()
+
+    def hedge_delay(self) -> Optional[float]:
+        """按近期首token延迟的分位数计算对冲等待时间，样本不足时不对冲"""
+        samples = sorted(self._first_token_latencies)
+        if len(samples) < self.hedging.min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.hedging.percentile))
+        return max(self.hedging.min_delay, samples[index])
+
+    def _hedge_budget_available(self) -> bool:
+        stats = self.hedging_stats
+        return stats.hedges_fired + 1 <= stats.requests * self.hedging.max_extra_load
+
+    def _invoke_hedged(self, backend: LLMBackend, candidates: List[LLMBackend], request: _Request) -> str:
+        done_queue = queue.Queue()
+        primary = self._make_attempt(backend, request)
+        attempts = [primary]
+        with self._hedge_lock:
+            self.hedging_stats.requests += 1
+        self._start_attempt(primary, done_queue)
+
+        delay = self.hedge_delay()
+        if delay is not None and not primary.first_token.wait(delay) and not primary.cancelled:
+            # 对冲副本只借用下一个候选，不从故障转移列表中移除：主请求与副本都失败时仍会再试这个后端
+            hedge_backend = candidates[0] if candidates else (backend if self.hedging.allow_same_backend else None)
+            with self._hedge_lock:
+                fire = hedge_backend is not None and self._hedge_budget_available()
+                if fire:
+                    self.hedging_stats.hedges_fired += 1
+            if fire:
+                hedge = self._make_attempt(hedge_backend, request, is_hedge=True)
+                attempts.append(hedge)
+                self._start_attempt(hedge, done_queue)
+
+        failed = []
+        for _ in attempts:
+            attempt = done_queue.get()
+            if not attempt.succeeded:
+                failed.append(attempt)
+                continue
+            # 先完成者胜出，断开其余请求的连接，释放它们占用的后端容量
+            losers = []
+            with self._hedge_lock:
+                if attempt.is_hedge:
+                    self.hedging_stats.hedges_won += 1
+                for other in attempts:
+                    if other is attempt:
+                        continue
+                    if other.finished:
+                        if other.error is None:
+                            self.hedging_stats.extra_tokens += len(other.chunks)
+                    else:
+                        other.abandoned = True
+                        losers.append(other)
+            for other in losers:
+                self._abort_attempt(other)
+            return self._finish_request(attempt, request)
+        raise self._failed(failed, request)
+
+    def get_hedging_stats(self) -> Dict[str, Any]:
+        """获取对冲请求统计"""
+        return {
+            'enabled': self.hedging.enabled,
+            'hedge_delay': self.hedge_delay(),
+            **self.hedging_stats.to_dict()
+        }
+
+    def check_health(self) -> Dict[str, bool]:
+        """对所有后端执行一次健康探测"""
+        return {backend.name: backend.health_check() for backend in self.backends}
+
+    def _health_loop(self) -> None:
+        while not self._stop_event.wait(self.health_check_interval):
+            self.check_health()
+
+    def start_health_checks(self) -> None:
+        """启动后台周期健康探测"""
+        if self.health_check_interval <= 0:
+            return
+        if self._health_thread and self._health_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._health_thread = threading.Thread(target=self._health_loop, name="llm-health-check", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self) -> None:
+        """停止后台健康探测"""
+        self._stop_event.set()
+
+    def get_cancellation_stats(self) -> Dict[str, int]:
+        """获取取消统计"""
+        with self._hedge_lock:
+            return self.cancellation_stats.to_dict()
+
+    def get_session_stats(self) -> Dict[str, int]:
+        """获取会话上下文复用统计"""
+        return dict(self.session_stats)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """获取每个后端的状态与统计"""
+        return [backend.to_dict() for backend in self.backends]
+
+
+@dataclass
+class RouteMetrics:
+    """单个调用路由的延迟与质量统计"""
+    model_name: str = ""
+    calls: int = 0
+    successes: int = 0
+    failures: int = 0
+    cancelled: int = 0
+    total_latency: float = 0.0
+    output_chars: int = 0
+    # 输出质量：能直接使用的次数与需要修复补全或降级的次数
+    quality_ok: int = 0
+    quality_poor: int = 0
+    latencies: deque = field(default_factory=lambda: deque(maxlen=200), repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        rated = self.quality_ok + self.quality_poor
+        return {
+            'model_name': self.model_name,
+            'calls': self.calls,
+            'successes': self.successes,
+            'failures': self.failures,
+            'cancelled': self.cancelled,
+            'avg_latency': self.total_latency / self.successes if self.successes else None,
+            'p95_latency': ordered[int(0.95 * (len(ordered) - 1))] if ordered else None,
+            'avg_output_chars': self.output_chars / self.successes if self.successes else None,
+            'quality_rate': self.quality_ok / rated if rated else None
+        }
+
+
+class ModelRoutes:
+    """按调用类型选择模型与后端
+
+    model_routes配置把调用类型（summary/event/scene/options/dialogue）或“调用类型.路由”（如scene.battle）
+    映射到各自的model_name和后端，未配置的调用使用默认后端池；后端池在第一次用到时才创建，
+    模型和后端完全相同的路由共用同一个后端池
+    """
+
+    def __init__(self, config: Dict[str, Any], default_router: BackendRouter = None,
+                 on_create: Callable[[BackendRouter], None] = None):
+        self.config = config
+        self.routes: Dict[str, Dict[str, Any]] = dict(config.get("model_routes") or {})
+        self.default_router = default_router or BackendRouter.from_config(config)
+        self.on_create = on_create
+        self._routers: Dict[str, BackendRouter] = {self._signature(config): self.default_router}
+        self._labels: Dict[int, str] = {id(self.default_router): "default"}
+        self._route_routers: Dict[str, BackendRouter] = {"default": self.default_router}
+        self._metrics: Dict[str, RouteMetrics] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _backend_configs(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """展开后端配置，补全名称、客户端与模型"""
+        default_model = config.get("model_name", "llama3")
+        default_client = config.get("client", "langchain")
+        items = config.get("backends") or [
+            {"name": "default", "base_url": config.get("base_url", "http://localhost:11434")}
+        ]
+        return [{
+            "name": item.get("name", item["base_url"]),
+            "base_url": item["base_url"],
+            "client": item.get("client", default_client),
+            "model_name": item.get("model_name", default_model)
+        } for item in items]
+
+    @classmethod
+    def _signature(cls, config: Dict[str, Any]) -> str:
+        return json.dumps(cls._backend_configs(config), sort_keys=True)
+
+    def _route_config(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        """路由的后端池配置：只指定model_name时沿用默认后端地址，换成该模型"""
+        model = spec.get("model_name", self.config.get("model_name", "llama3"))
+        if spec.get("backends"):
+            backends = spec["backends"]
+        elif spec.get("base_url"):
+            backends = [{"name": spec.get("name", spec["base_url"]), "base_url": spec["base_url"]}]
+        else:
+            backends = [{**item, "model_name": model} for item in self._backend_configs(self.config)]
+        return {**self.config, "model_name": model, "backends": backends,
+                "client": spec.get("client", self.config.get("client", "langchain"))}
+
+    def resolve(self, call_type: str, route: str = None) -> str:
+        """调用使用的路由：调用类型.路由 → 调用类型 → default"""
+        if route and f"{call_type}.{route}" in self.routes:
+            return f"{call_type}.{route}"
+        return call_type if call_type in self.routes else "default"
+
+    def router(self, key: str) -> BackendRouter:
+        """路由对应的后端池，首次使用时创建"""
+        router = self._route_routers.get(key)
+        if router is not None:
+            return router
+        created = None
+        with self._lock:
+            router = self._route_routers.get(key)
+            if router is None:
+                config = self._route_config(self.routes[key])
+                signature = self._signature(config)
+                router = self._routers.get(signature)
+                if router is None:
+                    router = created = self._routers[signature] = BackendRouter.from_config(config)
+                    self._labels[id(router)] = key
+                self._route_routers[key] = router
+        if created is not None and self.on_create is not None:
+            self.on_create(created)
+        return router
+
+    def router_label(self, key: str) -> str:
+        """后端池的标识（创建它的路由名），用于判断两个路由是否共用后端池"""
+        return self._labels[id(self.router(key))]
+
+    def routers(self) -> List[BackendRouter]:
+        """已创建的全部后端池"""
+        with self._lock:
+            return list(self._routers.values())
+
+    def hedge_delays(self) -> Dict[str, Optional[float]]:
+        """各后端池当前的对冲等待时间，按后端池标识"""
+        with self._lock:
+            return {self._labels[id(router)]: router.hedge_delay() for router in self._routers.values()}
+
+    def circuit_status(self) -> Dict[str, Dict[str, Any]]:
+        """各后端池的熔断器状态，按后端池标识"""
+        with self._lock:
+            return {self._labels[id(router)]: router.breaker.get_status() for router in self._routers.values()}
+
+    def _call_metrics(self, call_type: str, route: str = None) -> RouteMetrics:
+        """按“调用类型.路由”统计，不论是否配置了单独的模型"""
+        name = f"{call_type}.{route}" if route else call_type
+        metrics = self._metrics.get(name)
+        if metrics is None:
+            spec = self.routes.get(self.resolve(call_type, route), {})
+            model = spec.get("model_name", self.config.get("model_name", "llama3"))
+            metrics = self._metrics[name] = RouteMetrics(model_name=model)
+        return metrics
+
+    def invoke(self, call_type: str, prompt: str, route: str = None, cancel_token: CancelToken = None,
+               **kwargs) -> str:
+        """通过调用对应的后端池调用模型，记录该调用路由的延迟与结果"""
+        router = self.router(self.resolve(call_type, route))
+        start = time.perf_counter()
+        try:
+            result = router.invoke(prompt, cancel_token=cancel_token, **kwargs)
+        except GenerationCancelled:
+            with self._lock:
+                metrics = self._call_metrics(call_type, route)
+                metrics.calls += 1
+                metrics.cancelled += 1
+            raise
+        except Exception:
+            with self._lock:
+                metrics = self._call_metrics(call_type, route)
+                metrics.calls += 1
+                metrics.failures += 1
+            raise
+        latency = time.perf_counter() - start
+        with self._lock:
+            metrics = self._call_metrics(call_type, route)
+            metrics.calls += 1
+            metrics.successes += 1
+            metrics.total_latency += latency
+            metrics.latencies.append(latency)
+            metrics.output_chars += len(result)
+        return result
+
+    def record_quality(self, call_type: str, ok: bool, route: str = None) -> None:
+        """记录一次输出质量：ok为输出可直接使用，否则为需要修复补全或降级"""
+        with self._lock:
+            metrics = self._call_metrics(call_type, route)
+            if ok:
+                metrics.quality_ok += 1
+            else:
+                metrics.quality_poor += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各调用路由的统计"""
+        with self._lock:
+            return {key: metrics.to_dict() for key, metrics in self._metrics.items()}
+
+
+class ModelResidency:
+    """模型预热与常驻管理：启动时预加载模型，会话活跃期间保持常驻，被卸载后在后台重新预热"""
+
+    # cold: 尚未预热；loading: 正在加载；ready: 至少一个后端已加载；unavailable: 预热全部失败
+    STATES = ("cold", "loading", "ready", "unavailable")
+
+    def __init__(self, router: BackendRouter, keep_alive: Any = "30m", check_interval: float = 60.0,
+                 idle_timeout: float = 1800.0, warm_up_timeout: float = 120.0):
+        self.router = router
+        # 按调用类型路由到其他模型时，各后端池的模型都需要预热与常驻
+        self.routers = [router]
+        self.keep_alive = keep_alive
+        self.check_interval = check_interval
+        self.idle_timeout = idle_timeout
+        self.warm_up_timeout = warm_up_timeout
+        self.state = "cold"
+        self.last_activity: Optional[float] = None
+        self.last_warm_up: Optional[float] = None
+        self._ready_event = threading.Event()
+        self._lock = threading.Lock()
+        self._warming = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, router: BackendRouter, config: Dict[str, Any]) -> 'ModelResidency':
+        """从config.json的residency配置创建"""
+        residency = config.get("residency", {})
+        return cls(
+            router,
+            keep_alive=residency.get("keep_alive", "30m"),
+            check_interval=residency.get("check_interval", 60.0),
+            idle_timeout=residency.get("idle_timeout", 1800.0),
+            warm_up_timeout=residency.get("warm_up_timeout", 120.0)
+        )
+
+    def add_router(self, router: BackendRouter) -> None:
+        """登记新创建的后端池，之后的预热与常驻检查包括它"""
+        with self._lock:
+            if router not in self.routers:
+                self.routers.append(router)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        if state == "loading":
+            self._ready_event.clear()
+        else:
+            self._ready_event.set()
+
+    def warm_up(self, background: bool = True) -> None:
+        """预加载所有后端池的模型，默认在后台线程中进行"""
+        with self._lock:
+            if self._warming:
+                return
+            self._warming = True
+            self._set_state("loading")
+        if background:
+            threading.Thread(target=self._warm_up_all, name="llm-warm-up", daemon=True).start()
+        else:
+            self._warm_up_all()
+
+    def _warm_up_all(self) -> None:
+        loaded = False
+        for router in list(self.routers):
+            for backend in router.backends:
+                loaded = backend.warm_up(self.keep_alive, self.warm_up_timeout) or loaded
+        with self._lock:
+            self._warming = False
+            self.last_warm_up = time.time()
+            self._set_state("ready" if loaded else "unavailable")
+
+    def wait_until_ready(self, timeout: float = None) -> bool:
+        """等待预热结束，返回模型是否就绪；从未预热过时立即返回"""
+        if self.state == "cold":
+            return False
+        self._ready_event.wait(self.warm_up_timeout if timeout is None else timeout)
+        return self.state == "ready"
+
+    def mark_activity(self, success: bool = False) -> None:
+        """记录一次模型调用；调用成功说明模型已加载"""
+        self.last_activity = time.monotonic()
+        if success and self.state != "ready" and not self._warming:
+            self._set_state("ready")
+
+    def _sessions_active(self) -> bool:
+        return self.last_activity is not None and time.monotonic() - self.last_activity < self.idle_timeout
+
+    def _loop(self) -> None:
+        while not self._stop_event.wait(self.check_interval):
+            # 只在有玩家活跃时保持常驻，空闲后让Ollama按keep_alive自然卸载
+            if not self._sessions_active() or self._warming:
+                continue
+            if not all(any(backend.is_model_loaded() for backend in router.backends) for router in list(self.routers)):
+                print("[系统] 检测到模型已被卸载，后台重新预热")
+                self.warm_up()
+
+    def start(self) -> None:
+        """启动后台常驻检查"""
+        if self.check_interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="llm-residency", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台常驻检查"""
+        self._stop_event.set()
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取模型就绪状态"""
+        return {
+            'state': self.state,
+            'ready': self.state == "ready",
+            'keep_alive': self.keep_alive,
+            'last_warm_up': self.last_warm_up
+        }
@@ -111,8 +111,12 @@ def game_loop(ui, engine, state_manager):
         
         # 显示选项
         options = current_state.get('options', [])
-        option_events = current_state.get('option_events', [])
-        special_options = ["保存游戏", "查看角色属性", "返回主菜单"]
+        special_options = ["保存游戏", "查看角色属性"]
+        if state_manager.can_go_back():
+            special_options.append("撤销")
+        if state_manager.can_go_forward():
+            special_options.append("重做")
+        special_options.append("返回主菜单")
         
         # 展示选项并获取输入
         if options:
@@ -150,6 +154,16 @@ def game_loop(ui, engine, state_manager):
                     print(f"  {k}: {v}")
             input("\n按回车键继续...")
             continue
+        elif player_input == "撤销":
+            max_steps = state_manager.timeline.position
+            steps = input(f"撤销几个回合？(1-{max_steps}，直接回车为1): ").strip()
+            steps = int(steps) if steps.isdigit() else 1
+            if not engine.undo(state_manager, steps):
+                print("无法撤销这么多回合。")
+            continue
+        elif player_input == "重做":
+            engine.redo(state_manager)
+            continue
         elif player_input == "返回主菜单":
             save_choice = input("是否保存当前进度？(y/n): ").strip().lower()
             if save_choice in ['y', 'yes', '是']:
@@ -159,61 +173,12 @@ def game_loop(ui, engine, state_manager):
             break
         
         # 处理正常游戏输入
-        # 判断是否为结构化选项
-        chosen_index = None
-        if options and player_input in options:
-            chosen_index = options.index(player_input)
-        elif options and player_input.isdigit():
-            idx = int(player_input) - 1
-            if 0 <= idx < len(options):
-                chosen_index = idx
-        
-        # 触发AI结构化事件
-        if chosen_index is not None and option_events and chosen_index < len(option_events):
-            event_str = option_events[chosen_index]
-            player = state_manager.player
-            if event_str and event_str != "none":
-                try:
-                    if event_str.startswith("heal:"):
-                        amount = int(event_str.split(":")[1])
-                        player.heal(amount)
-                        print(f"[事件] 你恢复了 {amount} 点生命值！")
-                    elif event_str.startswith("damage:"):
-                        amount = int(event_str.split(":")[1])
-                        player.take_damage(amount)
-                        print(f"[事件] 你受到了 {amount} 点伤害！")
-                    elif event_str.startswith("add_item:"):
-                        item = event_str.split(":", 1)[1]
-                        player.add_item(item)
-                        print(f"[事件] 你获得了物品：{item}")
-                    elif event_str.startswith("remove_item:"):
-                        item = event_str.split(":", 1)[1]
-                        if player.remove_item(item):
-                            print(f"[事件] 你失去了物品：{item}")
-                    elif event_str.startswith("add_experience:"):
-                        exp = int(event_str.split(":")[1])
-                        player.add_experience(exp)
-                        print(f"[事件] 你获得了 {exp} 点经验！")
-                    # 可扩展更多事件类型
-                except Exception as e:
-                    print(f"[事件处理异常] {e}")
-        
-        next_state = engine.next_step(player_input, state_manager)
-        # 更新游戏状态
-        if next_state:
-            state_manager.update_story(
-                next_state.get('scene_id', f"scene_{state_manager.story.current_scene_id}"),
-                next_state.get('description', ''),
-                next_state.get('options', []),
-                player_input
-            )
-            # 如果游戏结束，标记结束
-            if next_state.get('is_end', False):
-                state_manager.end_game(next_state.get('ending_type', 'normal'))
-            if not state_manager.player.is_alive():
-                print("\n你的生命值已降为0，游戏结束！")
-                state_manager.end_game("dead")
-                break
+        result = engine.play_turn(player_input, state_manager)
+        for message in result['messages']:
+            print(message)
+        if result['dead']:
+            print("\n你的生命值已降为0，游戏结束！")
+            break
 
 def main():
     print("欢迎来到文字冒险游戏！\n")
@@ -222,6 +187,8 @@ def main():
     ui = UserInterface()
     engine = GameEngine()
     state_manager = GameStateManager()
+    # 玩家浏览菜单时在后台预加载模型
+    engine.warm_up()
     
     # 主程序循环
     while True:
@@ -234,6 +201,8 @@ def main():
         elif menu_result in ["new_game", "continue_game"]:
             # 启动游戏引擎
             if menu_result == "new_game":
+                if engine.get_generation_status()['model_status']['state'] == "loading":
+                    print("模型加载中，请稍候...")
                 engine.start_new_game(state_manager)
             
             # 进入游戏循环
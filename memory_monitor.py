@@ -0,0 +1,323 @@
+# 内存监控（可选）：定期用tracemalloc做快照，按子系统、会话和对象类型拆分内存占用，把相邻快照的差异写入JSONL，供定位长时间运行时的内存增长
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+# 分配位置所在文件到子系统的映射，按调用栈从内到外取第一个能识别的文件
+_SUBSYSTEMS = [
+    (os.path.join(_ROOT, "models", "story_state.py"), "story_state"),
+    (os.path.join(_ROOT, "models", "player.py"), "player"),
+    (os.path.join(_ROOT, "state_manager.py"), "state_manager"),
+    (os.path.join(_ROOT, "game_engine.py"), "game_engine"),
+    (os.path.join(_ROOT, "story_graph.py"), "preset_story"),
+    (os.path.join(_ROOT, "status_rules.py"), "status_rules"),
+    (os.path.join(_ROOT, "prompts") + os.sep, "prompts"),
+    (os.path.join(_ROOT, "llm_router.py"), "llm_client"),
+    (os.path.join(_ROOT, "ollama_client.py"), "llm_client"),
+    (os.path.join(_ROOT, "langchain_chain.py"), "llm_client"),
+    (os.path.join(_ROOT, "output_parser.py"), "output_parser"),
+    (os.path.join(_ROOT, "llm_cassette.py"), "cassette"),
+    (os.path.join(_ROOT, "app.py"), "app"),
+    (os.path.abspath(__file__), "memory_monitor"),
+    (tracemalloc.__file__, "memory_monitor"),
+    (os.sep + "langchain", "langchain"),
+    (os.sep + "streamlit" + os.sep, "streamlit"),
+]
+# 按类名统计存活实例数的对象
+_TRACKED_TYPES = ("StoryNode", "StoryState", "Player", "GameStateManager", "GameEngine",
+                  "ScenePrompt", "BackendRouter", "LLMBackend", "NativeOllamaBackend", "OllamaClient")
+
+
+# 文件名到子系统的缓存，快照中的调用栈数量很多，逐帧匹配前缀开销太大
+_file_subsystems: Dict[str, Optional[str]] = {}
+
+
+def _file_subsystem(filename: str) -> Optional[str]:
+    name = _file_subsystems.get(filename, "")
+    if name == "":
+        name = None
+        for prefix, subsystem in _SUBSYSTEMS:
+            if filename.startswith(prefix) or (prefix.startswith(os.sep) and prefix in filename):
+                name = subsystem
+                break
+        _file_subsystems[filename] = name
+    return name
+
+
+def group_allocations(snapshot: tracemalloc.Snapshot) -> Dict[Tuple[str, str], List[int]]:
+    """一次遍历快照中的所有分配，按(子系统, 位置)汇总大小与数量；位置取调用栈中最内层能识别子系统的帧"""
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    attributed: Dict[int, Tuple[str, str]] = {}
+    cached = _file_subsystems.get
+    # Snapshot.traces逐条构造Trace/Traceback对象，几十万条分配时要数秒，
+    # 这里直接遍历底层的(domain, size, frames, nframe)元组，frames从最内层开始且相同调用栈共享同一个元组
+    for _, size, frames, _ in snapshot.traces._traces:
+        key = attributed.get(id(frames))
+        if key is None:
+            key = None
+            for filename, lineno in frames:
+                name = cached(filename, "")
+                if name == "":
+                    name = _file_subsystem(filename)
+                if name is not None:
+                    key = (name, f"{filename}:{lineno}")
+                    break
+            if key is None:
+                key = ("other", "%s:%s" % frames[0] if frames else "?")
+            attributed[id(frames)] = key
+        entry = groups.get(key)
+        if entry is None:
+            groups[key] = [size, 1]
+        else:
+            entry[0] += size
+            entry[1] += 1
+    return groups
+
+
+def deep_sizeof(obj: Any, seen: Optional[set] = None, depth: int = 8) -> int:
+    """估算对象及其引用的容器、字符串和实例属性的总大小（字节），共享对象只计一次"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or depth < 0:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_sizeof(key, seen, depth - 1) + deep_sizeof(value, seen, depth - 1)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        for item in obj:
+            size += deep_sizeof(item, seen, depth - 1)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen, depth - 1)
+    return size
+
+
+def session_breakdown(engine, state_manager) -> Dict[str, Any]:
+    """单个会话中各部分的对象数量与估算大小"""
+    story = state_manager.story
+    player = state_manager.player
+    flags = story.story_flags
+    live = set()
+    deep_sizeof(story, live)
+    deep_sizeof(player, live)
+    breakdown = {
+        'game_id': state_manager.game_metadata.get('game_id'),
+        'history_nodes': len(story.history),
+        'history_bytes': deep_sizeof(story.history),
+        'flags': len(flags),
+        'important_event_flags': sum(1 for name in flags if name.startswith("important_event_")),
+        'flags_bytes': deep_sizeof(flags),
+        'branch_count': len(story.branch_count),
+        'branch_count_bytes': deep_sizeof(story.branch_count),
+        'inventory': len(player.inventory),
+        'inventory_bytes': deep_sizeof(player.inventory),
+        'effect_log_bytes': deep_sizeof(getattr(engine, "effect_log", [])),
+        'branch_nodes': len(state_manager.branches),
+        'branch_bytes': deep_sizeof(state_manager.branches, live),
+        'snapshots': len(state_manager.timeline.snapshots),
+        # 快照与当前状态共享未改动的对象，这里只计算快照额外占用的部分
+        'snapshot_bytes': deep_sizeof(state_manager.timeline, live),
+        'scene_prompt': None
+    }
+    # 只看已经创建的ScenePrompt，不为了统计而初始化LLM模块
+    scene_prompt = getattr(engine, "_scene_prompt", None)
+    if scene_prompt is not None:
+        breakdown['scene_prompt'] = f"{type(scene_prompt).__name__}@{id(scene_prompt):x}"
+        breakdown['scene_prompt_bytes'] = deep_sizeof(scene_prompt, depth=4)
+    return breakdown
+
+
+def _deltas(current: Dict[str, int], previous: Dict[str, int]) -> Dict[str, int]:
+    """两次统计之间有变化的项及其变化量"""
+    deltas = {}
+    for name in set(current) | set(previous):
+        delta = current.get(name, 0) - previous.get(name, 0)
+        if delta:
+            deltas[name] = delta
+    return dict(sorted(deltas.items(), key=lambda item: -abs(item[1])))
+
+
+class MemoryMonitor:
+    """进程级内存监控：注册的会话以弱引用保存，会话结束后自动移除"""
+
+    def __init__(self, interval: float = 60.0, out: Optional[str] = "memory_snapshots.jsonl",
+                 frames: int = 10, top: int = 15, keep: int = 60):
+        self.interval = interval
+        self.out = out
+        self.frames = frames
+        self.top = top
+        self.records = deque(maxlen=keep)
+        self._sessions: Dict[str, Any] = {}
+        self._previous_groups: Dict[Tuple[str, str], List[int]] = {}
+        self._previous_record: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional['MemoryMonitor']:
+        """从config.json的memory_monitor配置创建，未开启时返回None"""
+        monitor = config.get("memory_monitor", {})
+        if not monitor.get("enabled", False):
+            return None
+        return cls(
+            interval=monitor.get("interval", 60.0),
+            out=monitor.get("out", "memory_snapshots.jsonl"),
+            frames=monitor.get("frames", 10),
+            top=monitor.get("top", 15),
+            keep=monitor.get("keep", 60)
+        )
+
+    def register_session(self, session_id: str, engine, state_manager) -> None:
+        """登记一个会话的引擎与状态管理器，可重复调用"""
+        with self._lock:
+            self._sessions[session_id] = (weakref.ref(engine), weakref.ref(state_manager))
+
+    def _live_sessions(self) -> Dict[str, Any]:
+        with self._lock:
+            alive = {}
+            for session_id, (engine_ref, state_ref) in list(self._sessions.items()):
+                engine, state_manager = engine_ref(), state_ref()
+                if engine is None or state_manager is None:
+                    del self._sessions[session_id]
+                else:
+                    alive[session_id] = (engine, state_manager)
+            return alive
+
+    def snapshot(self) -> Dict[str, Any]:
+        """立即做一次快照，返回与上一次快照的差异并追加写入输出文件"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        groups = group_allocations(tracemalloc.take_snapshot())
+        subsystems = Counter()
+        for (name, _), (size, _) in groups.items():
+            subsystems[name] += size
+        tracked = set(_TRACKED_TYPES)
+        instances = Counter(type(o).__name__ for o in gc.get_objects() if type(o).__name__ in tracked)
+        sessions = {sid: session_breakdown(*objs) for sid, objs in self._live_sessions().items()}
+
+        record = {
+            'time': time.time(),
+            'traced_bytes': tracemalloc.get_traced_memory()[0],
+            'subsystems': dict(subsystems.most_common()),
+            'instances': dict(instances),
+            'sessions': sessions
+        }
+        previous = self._previous_record
+        if previous is not None:
+            record['elapsed'] = round(record['time'] - previous['time'], 1)
+            record['traced_delta'] = record['traced_bytes'] - previous['traced_bytes']
+            record['subsystem_deltas'] = _deltas(record['subsystems'], previous['subsystems'])
+            record['instance_deltas'] = _deltas(record['instances'], previous['instances'])
+            record['session_deltas'] = {
+                sid: {
+                    key: value - previous['sessions'][sid].get(key, 0)
+                    for key, value in data.items()
+                    if isinstance(value, int) and value != previous['sessions'][sid].get(key, 0)
+                }
+                for sid, data in sessions.items() if sid in previous['sessions']
+            }
+            # 增长最多的分配位置
+            growth = []
+            for key, (size, count) in groups.items():
+                old_size, old_count = self._previous_groups.get(key, (0, 0))
+                if size > old_size:
+                    growth.append((size - old_size, count - old_count, key))
+            growth.sort(reverse=True)
+            record['top_growth'] = [
+                {'where': where, 'subsystem': name, 'size_delta': size_delta, 'count_delta': count_delta}
+                for size_delta, count_delta, (name, where) in growth[:self.top]
+            ]
+        # 只保留汇总结果用于下次比较，不持有整个快照
+        self._previous_groups = groups
+        self._previous_record = record
+        self.records.append(record)
+        if self.out:
+            with open(self.out, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return record
+
+    def _loop(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.snapshot()
+            except Exception as e:
+                print(f"[系统] 内存快照失败: {e}")
+
+    def start(self) -> None:
+        """开始跟踪内存并定期快照"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="memory-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止定期快照"""
+        self._stop_event.set()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'tracing': tracemalloc.is_tracing(),
+            'interval': self.interval,
+            'sessions': len(self._live_sessions()),
+            'snapshots': len(self.records),
+            'out': self.out
+        }
+
+
+_monitor: Optional[MemoryMonitor] = None
+_monitor_loaded = False
+_monitor_lock = threading.Lock()
+
+
+def get_monitor(config_path: str = "config.json") -> Optional[MemoryMonitor]:
+    """进程内共享的监控实例，第一次调用时按配置创建并启动；未开启时返回None"""
+    global _monitor, _monitor_loaded
+    with _monitor_lock:
+        if not _monitor_loaded:
+            _monitor_loaded = True
+            config = {}
+            if os.path.exists(config_path):
+                with open(config_path, "r", encoding="utf-8") as f:
+                    config = json.load(f)
+            _monitor = MemoryMonitor.from_config(config)
+            if _monitor is not None:
+                _monitor.start()
+        return _monitor
+
+
+if __name__ == "__main__":
+    from game_engine import GameEngine
+    from state_manager import GameStateManager
+
+    monitor = MemoryMonitor(interval=0, out=None)
+    monitor.start()
+    engine = GameEngine()
+    engine.toggle_ai_generation(False)
+    state_manager = GameStateManager()
+    state_manager.create_new_game("测试玩家")
+    engine.start_new_game(state_manager)
+    monitor.register_session("test", engine, state_manager)
+    monitor.snapshot()
+    # 模拟一个不断增长的会话
+    for i in range(2000):
+        state_manager.update_story(f"scene_{i}", "一段很长的剧情描述" * 20, ["继续"], "继续")
+        state_manager.set_story_flag(f"important_event_{i}", True)
+    record = monitor.snapshot()
+    print("子系统增长:", record['subsystem_deltas'])
+    print("会话增长:", record['session_deltas'])
+    print("增长最多的位置:", record['top_growth'][:3])
@@ -0,0 +1,149 @@
+# 剧情分支树：缓存AI生成的回合，回退或读档后再次做出同样的选择时直接复用，不再调用模型
+import hashlib
+import re
+import unicodedata
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# 记录当前所在分支节点的故事标记，随存档保存、随撤销恢复
+BRANCH_FLAG = "branch_node"
+_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_input(player_input: str, options: Optional[List[str]] = None) -> str:
+    """把玩家输入规整为分支键：选项编号换成选项文本，统一全半角与大小写，去掉空白和标点"""
+    text = (player_input or "").strip()
+    if options and text.isdigit() and 0 < int(text) <= len(options):
+        text = options[int(text) - 1]
+    return _PUNCTUATION.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def root_id(description: str) -> str:
+    """以场景描述作为根节点的标识，没有记录所在节点的旧存档也能接上"""
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class BranchNode:
+    """分支树上的一个场景；payload为生成该场景的回合内容，根节点没有payload"""
+    node_id: str
+    parent: Optional[str] = None
+    key: Optional[str] = None
+    payload: Optional[Dict[str, Any]] = None
+    children: Dict[str, str] = field(default_factory=dict)
+    # payload在存档块存储中的内容哈希
+    payload_ref: Optional[str] = field(default=None, repr=False, compare=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'id': self.node_id, 'parent': self.parent, 'key': self.key,
+                'payload': self.payload, 'children': self.children}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'BranchNode':
+        return cls(data['id'], data.get('parent'), data.get('key'), data.get('payload'), data.get('children', {}),
+                   data.get('payload_ref'))
+
+
+class BranchTree:
+    """一局游戏已生成的剧情树，按最近使用淘汰；淘汰节点时其子树一并移除（已无法到达）"""
+
+    def __init__(self, max_nodes: int = 200):
+        self.max_nodes = max_nodes
+        self.nodes: "OrderedDict[str, BranchNode]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def child(self, parent_id: str, key: str) -> Optional[BranchNode]:
+        """已探索过的分支，命中时刷新最近使用顺序"""
+        parent = self.nodes.get(parent_id)
+        child_id = parent.children.get(key) if parent is not None else None
+        node = self.nodes.get(child_id) if child_id else None
+        if node is not None:
+            self.nodes.move_to_end(parent_id)
+            self.nodes.move_to_end(child_id)
+        return node
+
+    def add_child(self, parent_id: str, key: str, payload: Dict[str, Any]) -> Optional[BranchNode]:
+        """登记新生成的分支；同一分支已存在时（重新生成）替换它，原来的子树作废"""
+        if self.max_nodes <= 0:
+            return None
+        parent = self.nodes.get(parent_id)
+        if parent is None:
+            parent = self.nodes[parent_id] = BranchNode(parent_id)
+        old = parent.children.get(key)
+        if old is not None:
+            self._remove(old)
+        node = BranchNode(uuid.uuid4().hex[:16], parent_id, key, payload)
+        parent.children[key] = node.node_id
+        self.nodes[node.node_id] = node
+        self.nodes.move_to_end(parent_id)
+        self.nodes.move_to_end(node.node_id)
+        while len(self.nodes) > self.max_nodes:
+            oldest = next(iter(self.nodes))
+            self.evicted += self._remove(oldest)
+        return node if node.node_id in self.nodes else None
+
+    def _remove(self, node_id: str) -> int:
+        """移除节点及其子树，返回移除的节点数"""
+        node = self.nodes.pop(node_id, None)
+        if node is None:
+            return 0
+        parent = self.nodes.get(node.parent) if node.parent else None
+        if parent is not None and parent.children.get(node.key) == node_id:
+            del parent.children[node.key]
+        removed = 1
+        for child_id in list(node.children.values()):
+            removed += self._remove(child_id)
+        return removed
+
+    def explored(self, parent_id: str) -> List[str]:
+        """该场景下已生成过的分支键"""
+        parent = self.nodes.get(parent_id)
+        return [key for key, child_id in parent.children.items() if child_id in self.nodes] if parent else []
+
+    def merge(self, other: 'BranchTree') -> None:
+        """并入同一局游戏的另一棵树（如读档前内存中已生成的分支），两边都有的节点合并子分支"""
+        for node_id, node in other.nodes.items():
+            mine = self.nodes.get(node_id)
+            if mine is None:
+                self.nodes[node_id] = BranchNode(node.node_id, node.parent, node.key, node.payload,
+                                                 dict(node.children), node.payload_ref)
+            else:
+                for key, child_id in node.children.items():
+                    mine.children.setdefault(key, child_id)
+                self.nodes.move_to_end(node_id)
+        while len(self.nodes) > self.max_nodes:
+            self.evicted += self._remove(next(iter(self.nodes)))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """按最近使用顺序导出，读档后淘汰顺序不变"""
+        return {'max_nodes': self.max_nodes, 'nodes': [node.to_dict() for node in self.nodes.values()]}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]], max_nodes: int = 200) -> 'BranchTree':
+        tree = cls(max_nodes)
+        for item in (data or {}).get('nodes', []):
+            node = BranchNode.from_dict(item)
+            tree.nodes[node.node_id] = node
+        while len(tree.nodes) > tree.max_nodes:
+            tree._remove(next(iter(tree.nodes)))
+        return tree
+
+
+if __name__ == "__main__":
+    tree = BranchTree(max_nodes=4)
+    root = root_id("起点")
+    print("规整:", normalize_input(" 推开 石门！"), normalize_input("2", ["a", "推开石门"]))
+    a = tree.add_child(root, "推开石门", {'description': "门后是走廊"})
+    tree.add_child(a.node_id, "前进", {'description': "尽头有光"})
+    print("命中:", tree.child(root, "推开石门").payload, tree.explored(root))
+    b = tree.add_child(root, "推开石门", {'description': "重新生成"})
+    print("重新生成后子树作废:", len(tree), tree.child(b.node_id, "前进"))
+    for i in range(5):
+        tree.add_child(root, f"选项{i}", {'description': str(i)})
+    print("淘汰:", len(tree), tree.evicted, tree.explored(root))
+    print("读档:", len(BranchTree.from_dict(tree.to_dict())))
@@ -1,8 +1,13 @@
 # 玩家数据模型 
 from dataclasses import dataclass, field
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
 import json
 
+# 回合快照包含的字段，顺序即快照元组的顺序
+_SNAPSHOT_FIELDS = ('name', 'level', 'health', 'max_health', 'experience', 'inventory', 'skills', 'attributes')
+# 与快照共享、修改前需要先复制的容器字段
+_SHARED_FIELDS = frozenset(('inventory', 'skills', 'attributes'))
+
 @dataclass
 class Player:
     """玩家数据模型"""
@@ -14,14 +19,35 @@ class Player:
     inventory: List[str] = field(default_factory=list)
     skills: Dict[str, int] = field(default_factory=dict)
     attributes: Dict[str, Any] = field(default_factory=dict)
+    # 当前仍与快照共享的容器字段
+    _shared: set = field(default_factory=set, init=False, repr=False, compare=False)
+    
+    def _own(self, name: str) -> None:
+        """写时复制：容器仍与快照共享时先复制一份，快照中的数据保持不变"""
+        if name in self._shared:
+            self._shared.discard(name)
+            setattr(self, name, getattr(self, name).copy())
+    
+    def snapshot(self) -> Tuple[Any, ...]:
+        """记录当前状态，不复制任何容器；之后的修改通过写时复制进行，因此快照的开销与背包大小无关"""
+        self._shared = set(_SHARED_FIELDS)
+        return tuple(getattr(self, name) for name in _SNAPSHOT_FIELDS)
+    
+    def restore(self, snapshot: Tuple[Any, ...]) -> None:
+        """恢复到快照时的状态，容器与快照共享"""
+        for name, value in zip(_SNAPSHOT_FIELDS, snapshot):
+            setattr(self, name, value)
+        self._shared = set(_SHARED_FIELDS)
     
     def add_item(self, item: str) -> None:
         """添加物品到背包"""
+        self._own('inventory')
         self.inventory.append(item)
     
     def remove_item(self, item: str) -> bool:
         """从背包移除物品"""
         if item in self.inventory:
+            self._own('inventory')
             self.inventory.remove(item)
             return True
         return False
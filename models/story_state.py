@@ -1,8 +1,14 @@
 # 剧情状态数据模型 
-from dataclasses import dataclass, field
-from typing import Dict, List, Any, Optional
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime
 
+# 回合快照包含的字段（history由TurnTimeline单独处理）
+_SNAPSHOT_FIELDS = ('current_scene_id', 'current_description', 'current_options', 'current_option_events',
+                    'story_flags', 'branch_count', 'is_ended', 'ending_type')
+# 与快照共享、修改前需要先复制的容器字段
+_SHARED_FIELDS = frozenset(('story_flags', 'branch_count'))
+
 @dataclass
 class StoryNode:
     """单个剧情节点"""
@@ -12,6 +18,8 @@ class StoryNode:
     option_events: List[str] = field(default_factory=list)
     player_choice: Optional[str] = None
     timestamp: datetime = field(default_factory=datetime.now)
+    # 存档块存储中的内容哈希；节点只会被整体替换，不会原地修改，因此可以缓存
+    chunk_ref: Optional[str] = field(default=None, init=False, repr=False, compare=False)
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典格式"""
@@ -48,6 +56,25 @@ class StoryState:
     branch_count: Dict[str, int] = field(default_factory=dict)
     is_ended: bool = False
     ending_type: Optional[str] = None
+    # 当前仍与快照共享的容器字段
+    _shared: set = field(default_factory=set, init=False, repr=False, compare=False)
+    
+    def _own(self, name: str) -> None:
+        """写时复制：容器仍与快照共享时先复制一份，快照中的数据保持不变"""
+        if name in self._shared:
+            self._shared.discard(name)
+            setattr(self, name, getattr(self, name).copy())
+    
+    def snapshot(self) -> Tuple[Any, ...]:
+        """记录除history外的当前状态，不复制任何容器"""
+        self._shared = set(_SHARED_FIELDS)
+        return tuple(getattr(self, name) for name in _SNAPSHOT_FIELDS)
+    
+    def restore(self, snapshot: Tuple[Any, ...]) -> None:
+        """恢复除history外的状态，容器与快照共享"""
+        for name, value in zip(_SNAPSHOT_FIELDS, snapshot):
+            setattr(self, name, value)
+        self._shared = set(_SHARED_FIELDS)
     
     def add_scene(self, scene_id: str, description: str, options: List[str], option_events: List[str] = None) -> None:
         """添加新场景到历史记录"""
@@ -67,9 +94,11 @@ class StoryState:
     def record_choice(self, choice: str) -> None:
         """记录玩家选择"""
         if self.history:
-            self.history[-1].player_choice = choice
+            # 历史节点可能被快照引用，替换为新节点而不是原地修改
+            self.history[-1] = replace(self.history[-1], player_choice=choice)
         
         # 统计分支选择次数
+        self._own('branch_count')
         if choice in self.branch_count:
             self.branch_count[choice] += 1
         else:
@@ -77,6 +106,7 @@ class StoryState:
     
     def set_flag(self, flag_name: str, value: Any) -> None:
         """设置故事标记"""
+        self._own('story_flags')
         self.story_flags[flag_name] = value
     
     def get_flag(self, flag_name: str, default: Any = None) -> Any:
@@ -130,19 +160,21 @@ class StoryState:
         
         return True
     
-    def to_dict(self) -> Dict[str, Any]:
-        """转换为字典格式"""
-        return {
+    def to_dict(self, include_history: bool = True) -> Dict[str, Any]:
+        """转换为字典格式；include_history为False时不导出历史节点（存档时单独按块保存）"""
+        data = {
             'current_scene_id': self.current_scene_id,
             'current_description': self.current_description,
             'current_options': self.current_options,
             'current_option_events': self.current_option_events,
-            'history': [node.to_dict() for node in self.history],
             'story_flags': self.story_flags,
             'branch_count': self.branch_count,
             'is_ended': self.is_ended,
             'ending_type': self.ending_type
         }
+        if include_history:
+            data['history'] = [node.to_dict() for node in self.history]
+        return data
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'StoryState':
@@ -0,0 +1,109 @@
+# 回合时间线：每回合结束时记录玩家与剧情状态的快照，支持多步撤销与重做
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.player import Player
+from models.story_state import StoryNode, StoryState
+
+
+@dataclass(frozen=True)
+class TurnSnapshot:
+    """一个回合结束时的状态
+
+    快照与前后回合共享所有未改动的容器，只有该回合修改过的背包、标记等才是新对象；
+    history只记录长度和末尾节点，节点本身保存在时间线中
+    """
+    player: Tuple[Any, ...]
+    story: Tuple[Any, ...]
+    history_len: int
+    tail: Optional[StoryNode]
+    step: Optional[int]
+    label: str
+
+
+class TurnTimeline:
+    """一局游戏的线性回合时间线；撤销后继续游戏会丢弃原来的后续回合"""
+
+    def __init__(self):
+        self.snapshots: List[TurnSnapshot] = []
+        self.position = -1
+        # 当前时间线上每个位置最终的历史节点（节点在成为非末尾节点后才会最终确定）
+        self._nodes: List[StoryNode] = []
+
+    def reset(self) -> None:
+        self.snapshots.clear()
+        self.position = -1
+        self._nodes = []
+
+    def checkpoint(self, player: Player, story: StoryState, step: Optional[int] = None) -> TurnSnapshot:
+        """记录当前状态为新的回合，只登记上一快照之后新增或替换的历史节点"""
+        del self.snapshots[self.position + 1:]
+        history = story.history
+        start = max(self.snapshots[-1].history_len - 1, 0) if self.snapshots else 0
+        self._nodes[start:] = history[start:]
+        snapshot = TurnSnapshot(
+            player=player.snapshot(),
+            story=story.snapshot(),
+            history_len=len(history),
+            tail=history[-1] if history else None,
+            step=step,
+            label=story.current_description[:20]
+        )
+        self.snapshots.append(snapshot)
+        self.position = len(self.snapshots) - 1
+        return snapshot
+
+    def can_undo(self, steps: int = 1) -> bool:
+        return steps > 0 and self.position - steps >= 0
+
+    def can_redo(self, steps: int = 1) -> bool:
+        return steps > 0 and 0 <= self.position + steps < len(self.snapshots)
+
+    def restore(self, position: int, player: Player, story: StoryState) -> TurnSnapshot:
+        """把玩家和剧情恢复到指定回合；玩家与标记只替换引用，history只截断或补回相差的节点"""
+        snapshot = self.snapshots[position]
+        player.restore(snapshot.player)
+        story.restore(snapshot.story)
+        history = story.history
+        length = snapshot.history_len
+        del history[length:]
+        keep = len(history)
+        if keep:
+            history[keep - 1] = self._nodes[keep - 1]
+        history.extend(self._nodes[keep:length])
+        if length:
+            history[length - 1] = snapshot.tail
+        self.position = position
+        return snapshot
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """各回合的摘要，供界面选择回退目标"""
+        return [
+            {'position': i, 'step': s.step, 'label': s.label, 'current': i == self.position}
+            for i, s in enumerate(self.snapshots)
+        ]
+
+
+if __name__ == "__main__":
+    player = Player(name="测试")
+    story = StoryState()
+    timeline = TurnTimeline()
+    story.add_scene("s0", "起点", ["a"])
+    timeline.checkpoint(player, story, 0)
+    for i in range(1, 4):
+        story.record_choice(f"选择{i}")
+        story.add_scene(f"s{i}", f"场景{i}", ["a"])
+        player.add_item(f"物品{i}")
+        player.take_damage(10)
+        story.set_flag(f"flag_{i}", True)
+        timeline.checkpoint(player, story, i)
+    timeline.restore(1, player, story)
+    print("撤销两步:", story.current_scene_id, player.inventory, player.health, sorted(story.story_flags),
+          [n.player_choice for n in story.history])
+    timeline.restore(3, player, story)
+    print("重做:", story.current_scene_id, player.inventory, player.health, [n.player_choice for n in story.history])
+    timeline.restore(1, player, story)
+    story.record_choice("新选择")
+    story.add_scene("b2", "分支", ["a"])
+    timeline.checkpoint(player, story, 2)
+    print("新分支:", len(timeline.snapshots), [n.scene_id for n in story.history], timeline.can_redo())
@@ -0,0 +1,174 @@
+# 原生Ollama客户端：直接调用HTTP API，复用keep-alive连接，不经过LangChain
+import http.client
+import json
+import socket
+import threading
+import urllib.parse
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# /api/generate的顶层参数，其余生成参数（temperature、num_predict、num_ctx、stop等）放入options
+_TOP_LEVEL_PARAMS = {"format", "keep_alive", "context", "system", "template", "raw", "images", "suffix"}
+# 服务端关闭了空闲连接时出现的异常，重连一次即可
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    ConnectionResetError,
+    BrokenPipeError
+)
+
+
+class OllamaError(Exception):
+    """Ollama返回的错误"""
+
+
+class RequestAbort:
+    """从其他线程中止一次请求：关闭socket，让阻塞在读取上的生成线程立即返回"""
+
+    def __init__(self):
+        self.aborted = False
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def attach(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._conn = conn
+            aborted = self.aborted
+        if aborted:
+            self._shutdown(conn)
+
+    def on_abort(self, callback: Callable[[], None]) -> None:
+        """注册中止时执行的回调（已中止时立即执行），供拿不到socket的客户端唤醒等待中的读取"""
+        with self._lock:
+            if not self.aborted:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def abort(self) -> None:
+        with self._lock:
+            self.aborted = True
+            conn = self._conn
+            callbacks, self._callbacks = self._callbacks, []
+        if conn is not None:
+            self._shutdown(conn)
+        for callback in callbacks:
+            callback()
+
+    @staticmethod
+    def _shutdown(conn: http.client.HTTPConnection) -> None:
+        sock = conn.sock
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class OllamaClient:
+    """基于http.client的Ollama客户端，每个线程持有一条持久连接"""
+
+    def __init__(self, base_url: str, model_name: str, timeout: Optional[float] = None):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port
+        self.use_https = parsed.scheme == "https"
+        self.base_path = parsed.path.rstrip("/")
+        self.model_name = model_name
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if self.use_https else http.client.HTTPConnection
+            conn = conn_class(self.host, self.port, timeout=self.timeout)
+            conn.connect()
+            # 关闭Nagle算法，避免小包与延迟ACK叠加造成每次请求数十毫秒的等待
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._local.conn = conn
+        return conn
+
+    def _discard(self, conn: http.client.HTTPConnection) -> None:
+        """关闭连接，下次请求重新建立"""
+        conn.close()
+        if getattr(self._local, "conn", None) is conn:
+            self._local.conn = None
+
+    def build_payload(self, prompt: str, stream: bool = True, **kwargs) -> Dict[str, Any]:
+        """构造/api/generate请求体，值为None的参数不发送"""
+        payload: Dict[str, Any] = {"model": self.model_name, "prompt": prompt, "stream": stream}
+        options = {}
+        for key, value in kwargs.items():
+            if value is None:
+                continue
+            if key in _TOP_LEVEL_PARAMS:
+                payload[key] = value
+            else:
+                options[key] = value
+        if options:
+            payload["options"] = options
+        return payload
+
+    def _post(self, path: str, payload: Dict[str, Any],
+              abort: Optional[RequestAbort] = None) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        for retry in (True, False):
+            conn = self._connection()
+            if abort is not None:
+                abort.attach(conn)
+            try:
+                conn.request("POST", self.base_path + path, body=body, headers=headers)
+                response = conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                self._discard(conn)
+                # 被主动中止的请求表现为连接断开，不能当作失效连接重发
+                if retry and not (abort is not None and abort.aborted):
+                    continue
+                raise
+            except Exception:
+                self._discard(conn)
+                raise
+            if response.status != 200:
+                detail = response.read().decode("utf-8", "replace")
+                self._discard(conn)
+                raise OllamaError(f"HTTP {response.status}: {detail}")
+            return conn, response
+
+    def stream(self, prompt: str, abort: Optional[RequestAbort] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        """流式生成，逐条返回Ollama的NDJSON消息
+
+        提前关闭生成器时断开连接，让后端停止生成；正常结束时连接留给下一次请求复用；
+        传入abort时其他线程可以随时中止请求，包括仍在等待首个token的阶段
+        """
+        conn, response = self._post("/api/generate", self.build_payload(prompt, True, **kwargs), abort)
+        finished = False
+        try:
+            for line in response:
+                if not line.strip():
+                    continue
+                message = json.loads(line)
+                if "error" in message:
+                    raise OllamaError(message["error"])
+                yield message
+                if message.get("done"):
+                    finished = True
+                    break
+        finally:
+            if finished:
+                # 读完chunked结尾，连接才能复用
+                response.read()
+            else:
+                self._discard(conn)
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        """非流式调用，返回完整文本"""
+        return "".join(message.get("response", "") for message in self.stream(prompt, **kwargs))
+
+    def close(self) -> None:
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._discard(conn)
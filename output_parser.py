@@ -1 +1,228 @@
-# 输出解析 
\ No newline at end of file
+# 输出解析：从大模型输出中提取并修复JSON结构
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+# 中文/全角引号在JSON结构位置上统一替换为ASCII引号
+_QUOTE_TRANSLATION = str.maketrans({'“': '"', '”': '"', '‘': "'", '’': "'"})
+_LITERALS = {"true", "false", "null"}
+
+
+def strip_code_fence(text: str) -> str:
+    """去除markdown代码块包裹"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```[a-zA-Z]*", "", text)
+        text = text.strip("`").strip()
+    return text
+
+
+def extract_json_block(text: str) -> Optional[str]:
+    """提取第一个JSON对象或数组；输出被截断时返回从起始括号到结尾的内容"""
+    text = strip_code_fence(text)
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        return None
+    start = min(starts)
+    depth = 0
+    in_string = False
+    quote = ""
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == quote:
+                in_string = False
+        elif ch in "\"'":
+            in_string = True
+            quote = ch
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _close(buffer: List[str], stack: List[str]) -> str:
+    text = "".join(buffer).rstrip()
+    while text.endswith(","):
+        text = text[:-1].rstrip()
+    return text + "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+
+def _last_significant(buffer: List[str]) -> str:
+    for piece in reversed(buffer):
+        piece = piece.rstrip()
+        if piece:
+            return piece[-1]
+    return ""
+
+
+def _repair_candidates(block: str) -> List[str]:
+    """逐字符扫描修复常见语法错误，返回若干候选修复结果（越靠前越完整）"""
+    block = block.translate(_QUOTE_TRANSLATION)
+    out: List[str] = []
+    stack: List[str] = []
+    # 每个完整值之后的安全截断点，用于处理截断输出
+    cut_points: List[Tuple[int, List[str]]] = []
+    in_string = False
+    quote = ""
+    escaped = False
+    i = 0
+    while i < len(block):
+        ch = block[i]
+        if in_string:
+            if escaped:
+                out.append(ch)
+                escaped = False
+            elif ch == "\\":
+                out.append(ch)
+                escaped = True
+            elif ch == quote:
+                out.append('"')
+                in_string = False
+            elif ch == '"':
+                # 单引号字符串中的双引号需要转义
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch == "\r":
+                pass
+            elif ch == "\t":
+                out.append("\\t")
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        last = _last_significant(out)
+        if ch in "\"'":
+            if last in ('"', "}", "]") or last.isdigit():
+                # 相邻的两个值之间缺少逗号
+                out.append(",")
+            in_string = True
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            if last in ('"', "}", "]"):
+                out.append(",")
+            stack.append(ch)
+            out.append(ch)
+        elif ch in "}]":
+            # 去掉结尾多余的逗号
+            while out and (out[-1].isspace() or out[-1] == ","):
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(ch)
+        elif ch == ",":
+            cut_points.append((len(out), list(stack)))
+            out.append(ch)
+        elif ch == "，":
+            cut_points.append((len(out), list(stack)))
+            out.append(",")
+        elif ch == "：":
+            out.append(":")
+        elif ch.isascii() and ch.isalpha():
+            # 裸单词：true/false/null保留，其余视为缺少引号的字符串
+            match = re.match(r"[A-Za-z_][A-Za-z0-9_:\-]*", block[i:])
+            word = match.group(0) if match else ch
+            out.append(word if word in _LITERALS else json.dumps(word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    candidates = []
+    if in_string:
+        candidates.append(_close(out + ['"'], stack))
+    else:
+        candidates.append(_close(out, stack))
+    for position, saved_stack in reversed(cut_points):
+        candidates.append(_close(out[:position], saved_stack))
+    return candidates
+
+
+def repair_json(text: str) -> Tuple[Optional[Any], bool]:
+    """解析模型输出中的JSON，必要时修复尾逗号、单引号、未转义换行、截断等问题
+
+    返回 (解析结果, 是否经过修复)，无法修复时解析结果为None
+    """
+    block = extract_json_block(text)
+    if block is None:
+        return None, False
+    try:
+        return json.loads(block), False
+    except ValueError:
+        pass
+    for candidate in _repair_candidates(block):
+        try:
+            return json.loads(candidate), True
+        except ValueError:
+            continue
+    return None, False
+
+
+def normalize_options(options: Any) -> Tuple[List[str], List[str]]:
+    """将options字段统一为(选项文本列表, 事件标签列表)"""
+    texts, events = [], []
+    if isinstance(options, dict):
+        options = options.get("options", [])
+    if not isinstance(options, list):
+        return texts, events
+    for opt in options:
+        if isinstance(opt, dict):
+            text = str(opt.get("text", "")).strip()
+            event = str(opt.get("event") or "none").strip()
+        else:
+            text, event = str(opt).strip(), "none"
+        if text:
+            texts.append(text)
+            events.append(event)
+    return texts, events
+
+
+class JsonCompletionDetector:
+    """在流式输出中检测顶层JSON结构是否已经闭合，用于在JSON结束后立即停止生成"""
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.quote = ""
+        self.escaped = False
+        # 闭合括号之后、同一段文本中多余的字符数
+        self.overflow = 0
+
+    def feed(self, chunk: str) -> bool:
+        """输入一段新生成的文本，顶层JSON闭合时返回True"""
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == self.quote:
+                    self.in_string = False
+            elif not self.started:
+                if ch in "{[":
+                    self.started = True
+                    self.depth = 1
+            elif ch in "\"'":
+                self.in_string = True
+                self.quote = ch
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.overflow = len(chunk) - i - 1
+                    return True
+        return False
@@ -0,0 +1,63 @@
+# 按调用类型配置的生成参数：输出长度上限、停止词、上下文窗口大小
+import math
+from typing import Any, Dict
+
+# 未在config.json中配置generation_profiles时使用的默认值
+DEFAULT_PROFILES = {
+    "default": {"temperature": 0.8},
+    "summary": {"num_predict": 200, "temperature": 0.3},
+    "event": {"num_predict": 400, "temperature": 0.7},
+    "scene": {"num_predict": 600, "stop_after_json": True},
+    "options": {"num_predict": 150, "temperature": 0.9, "stop_after_json": True},
+    "description": {"num_predict": 300},
+    "dialogue": {"num_predict": 200}
+}
+
+# num_ctx只取min到max之间的2的幂次档位，避免取值频繁变化导致Ollama反复重新加载模型
+DEFAULT_CONTEXT_SIZING = {
+    "enabled": True,
+    # 中文文本保守估计每个token约1个字符
+    "chars_per_token": 1.0,
+    "min": 1024,
+    "max": 8192,
+    "margin": 64
+}
+
+
+class GenerationProfiles:
+    """按调用类型（summary/event/scene/options/description/dialogue）解析Ollama生成参数"""
+
+    def __init__(self, profiles: Dict[str, Dict[str, Any]] = None, context_sizing: Dict[str, Any] = None):
+        self.profiles = {**DEFAULT_PROFILES, **(profiles or {})}
+        self.context_sizing = {**DEFAULT_CONTEXT_SIZING, **(context_sizing or {})}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'GenerationProfiles':
+        """从config.json的generation_profiles配置创建"""
+        section = dict(config.get("generation_profiles") or {})
+        context_sizing = section.pop("context_sizing", None)
+        return cls(section, context_sizing)
+
+    def estimate_num_ctx(self, prompt: str, num_predict: int = None, extra_tokens: int = 0) -> int:
+        """根据prompt长度和输出上限估算所需的上下文窗口，向上取到2的幂次
+
+        extra_tokens为随请求一起发送的已有上下文token数
+        """
+        sizing = self.context_sizing
+        prompt_tokens = math.ceil(len(prompt) / sizing["chars_per_token"])
+        needed = prompt_tokens + extra_tokens + (num_predict or 0) + sizing["margin"]
+        size = sizing["min"]
+        while size < needed and size < sizing["max"]:
+            size *= 2
+        return min(size, sizing["max"])
+
+    def resolve(self, call_type: str, prompt: str, route: str = None) -> Dict[str, Any]:
+        """合并 default → 调用类型 → 调用类型.路由 三级参数，并补充num_ctx"""
+        params: Dict[str, Any] = {}
+        params.update(self.profiles.get("default", {}))
+        params.update(self.profiles.get(call_type, {}))
+        if route:
+            params.update(self.profiles.get(f"{call_type}.{route}", {}))
+        if self.context_sizing["enabled"] and "num_ctx" not in params:
+            params["num_ctx"] = self.estimate_num_ctx(prompt, params.get("num_predict"))
+        return params
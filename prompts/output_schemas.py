@@ -0,0 +1,54 @@
+# 结构化输出Schema：配合Ollama的format参数做约束解码
+# 事件标签与main.py/app.py中的选项事件处理保持一致
+EVENT_TAG_PATTERN = r"^(none|heal:[0-9]+|damage:[0-9]+|add_experience:[0-9]+|add_item:.+|remove_item:.+)$"
+
+SCENE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "description": {"type": "string", "minLength": 20},
+        "options": {
+            "type": "array",
+            "minItems": 3,
+            "maxItems": 3,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "text": {"type": "string", "minLength": 2, "maxLength": 30},
+                    "event": {"type": "string", "pattern": EVENT_TAG_PATTERN}
+                },
+                "required": ["text", "event"]
+            }
+        }
+    },
+    "required": ["description", "options"]
+}
+
+EVENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "event_result": {"type": "string", "minLength": 20},
+        "status_changes": {"type": "string"}
+    },
+    "required": ["event_result", "status_changes"]
+}
+
+OPTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "options": {
+            "type": "array",
+            "minItems": 3,
+            "maxItems": 3,
+            "items": {"type": "string", "minLength": 2, "maxLength": 15}
+        }
+    },
+    "required": ["options"]
+}
+
+SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string", "maxLength": 150}
+    },
+    "required": ["summary"]
+}
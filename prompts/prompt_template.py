@@ -0,0 +1,22 @@
+# 延迟构建的Prompt模板：首次渲染时才导入LangChain，避免启动时加载整个LLM依赖栈
+from typing import List
+
+
+class LazyPromptTemplate:
+    """与LangChain PromptTemplate用法一致的模板，第一次format时才创建底层PromptTemplate"""
+
+    def __init__(self, input_variables: List[str], template: str, native: bool = False):
+        self.input_variables = input_variables
+        self.template = template
+        self.native = native
+        self._prompt = None
+
+    def format(self, **kwargs) -> str:
+        """渲染模板，底层PromptTemplate只构建一次"""
+        if self.native:
+            # 与f-string格式的PromptTemplate渲染结果一致
+            return self.template.format(**kwargs)
+        if self._prompt is None:
+            from langchain.prompts import PromptTemplate
+            self._prompt = PromptTemplate(input_variables=self.input_variables, template=self.template)
+        return self._prompt.format(**kwargs)
@@ -1,15 +1,31 @@
 # 场景Prompt模板 
 import os
 import json
-from langchain_community.llms import Ollama
 import re
+import hashlib
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Any, Optional
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnableSequence
+from cancellation import CancelToken, DeadlinePolicy, GenerationCancelled, check_cancelled
+from llm_router import BackendRouter, ModelResidency, ModelRoutes, SessionContext
+from llm_cassette import open_cassette
+from output_parser import repair_json, normalize_options, strip_code_fence
+from prompts.output_schemas import SCENE_SCHEMA, EVENT_SCHEMA, OPTIONS_SCHEMA, SUMMARY_SCHEMA
+from prompts.generation_profiles import GenerationProfiles
+from prompts.prompt_template import LazyPromptTemplate
+from summarizer import ExtractiveSummarizer
+
+def _sum_stats(items) -> Dict[str, Any]:
+    """合并多个后端池的计数统计"""
+    total: Dict[str, Any] = {}
+    for stats in items:
+        for key, value in stats.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
 
 class ScenePrompt:
-    def __init__(self, config_path="config.json"):
+    def __init__(self, config_path="config.json", cassette=None):
         if os.path.exists(config_path):
             with open(config_path, "r", encoding="utf-8") as f:
                 config = json.load(f)
@@ -18,9 +34,37 @@ class ScenePrompt:
                 "model_name": "llama3",
                 "base_url": "http://localhost:11434"
             }
-        self.llm = Ollama(model=config["model_name"], base_url=config["base_url"])
+        # 原生客户端模式下Prompt模板直接用str.format渲染，完全不经过LangChain
+        native_templates = config.get("client", "langchain") == "native"
+        # 模型后端池：支持多个Ollama实例的负载均衡与故障转移
+        self.router = BackendRouter.from_config(config)
+        # 模型调用录制/回放：回放模式下所有响应来自磁带文件，不访问模型后端
+        self.cassette = cassette if cassette is not None else open_cassette(config.get("cassette"))
+        # 模型预热与常驻：keep_alive随每次请求发送，模型被卸载后后台重新预热
+        self.residency = ModelResidency.from_config(self.router, config)
+        self._live = self.cassette is None or self.cassette.mode != "replay"
+        if self._live:
+            self.router.start_health_checks()
+            self.residency.start()
+        # 按调用类型路由到不同模型（如摘要、事件用小模型，场景用大模型），其他后端池在首次用到时创建
+        self.model_routes = ModelRoutes(config, self.router, on_create=self._on_router_created)
+        # 结构化输出模式：prompt为在提示词中要求JSON，schema为使用后端的约束解码（Ollama format参数）
+        self.structured_output = config.get("structured_output", "prompt")
+        # 按调用类型的生成参数（输出上限、停止条件、num_ctx）
+        self.generation_profiles = GenerationProfiles.from_config(config)
+        # 会话上下文复用：同一局游戏固定路由到同一后端，后端支持时只发送增量prompt
+        session_config = config.get("session_context", {})
+        self.session_context_enabled = session_config.get("enabled", False)
+        self.max_sessions = session_config.get("max_sessions", 256)
+        self.max_context_tokens = session_config.get("max_context_tokens", 4096)
+        self._sessions: "OrderedDict[str, SessionContext]" = OrderedDict()
+        self._sessions_lock = threading.Lock()
+        # 回合时间预算：由引擎按剩余时间逐级降级
+        self.turn_deadline = DeadlinePolicy.from_config(config.get("turn_deadline"))
+        # 本地抽取式摘要：历史不长时代替模型摘要，较长时先预压缩再交给模型，模型失败时作为回退
+        self.summarizer = ExtractiveSummarizer.from_config(config)
         # 剧情摘要链
-        self.summary_prompt = PromptTemplate(
+        self.summary_prompt = LazyPromptTemplate(
             input_variables=["history"],
             template="""
 你是一名文字冒险游戏的剧情总结助手。请将以下剧情历史内容进行高度精炼的总结，保留主线脉络、关键事件和重要角色，控制在150字以内：
@@ -29,19 +73,51 @@ class ScenePrompt:
 {history}
 
 剧情摘要：
-"""
+""",
+            native=native_templates
+        )
+        # 结构化输出缺字段时的补全Prompt：只请求缺失部分，避免整段重新生成
+        self.options_followup_prompt = LazyPromptTemplate(
+            input_variables=["context", "description"],
+            template="""
+你是一名文字冒险游戏的剧情生成AI。请为下面的场景补充3个玩家可执行的行动选项。
+
+剧情摘要：{context}
+当前场景：{description}
+
+只输出JSON数组，不要输出任何解释性文字：
+[{{"text": "具体行动1", "event": "none"}}, {{"text": "具体行动2", "event": "none"}}, {{"text": "具体行动3", "event": "none"}}]
+""",
+            native=native_templates
+        )
+        self.description_followup_prompt = LazyPromptTemplate(
+            input_variables=["context", "player_action"],
+            template="""
+你是一名文字冒险游戏的剧情生成AI。请根据剧情摘要和玩家操作，用100字以内生动描述当前场景。只输出场景描述本身。
+
+剧情摘要：{context}
+玩家操作：{player_action}
+
+场景描述：
+""",
+            native=native_templates
         )
-        self.summary_chain = self.summary_prompt | self.llm
+        # 结构化解析统计：修复率与局部补全率
+        self.parse_stats = {
+            'total': 0,
+            'clean': 0,
+            'repaired': 0,
+            'partial_regenerations': 0,
+            'partial_regeneration_failures': 0,
+            'fallbacks': 0
+        }
         # 各类型Prompt
         self.prompt_dict = {
-            "explore": PromptTemplate(
+            "explore": LazyPromptTemplate(
                 input_variables=["context", "player_action"],
                 template="""
 你是一名文字冒险游戏的剧情生成AI。请根据剧情摘要和玩家操作，生成一个探索场景。
 
-剧情摘要：{context}
-玩家操作：{player_action}
-
 请以如下JSON格式输出（不要输出任何解释性文字，只输出JSON）：
 示例：
 {{
@@ -67,16 +143,17 @@ class ScenePrompt:
 - 不要输出任何解释性文字或说明，只输出JSON。
 - 请严格输出标准JSON，所有属性名和字符串都必须用双引号。
 - **不要输出括号内容或占位符，必须生成具体、真实的选项。**
-"""
+
+剧情摘要：{context}
+玩家操作：{player_action}
+""",
+                native=native_templates
             ),
-            "battle": PromptTemplate(
+            "battle": LazyPromptTemplate(
                 input_variables=["context", "player_action"],
                 template="""
 你是一名文字冒险游戏的战斗场景生成AI。请根据剧情摘要和玩家操作，生成一个战斗场景。
 
-剧情摘要：{context}
-玩家操作：{player_action}
-
 请以如下JSON格式输出（不要输出任何解释性文字，只输出JSON）：
 示例：
 {{
@@ -102,16 +179,17 @@ class ScenePrompt:
 - 不要输出任何解释性文字或说明，只输出JSON。
 - 请严格输出标准JSON，所有属性名和字符串都必须用双引号。
 - **不要输出括号内容或占位符，必须生成具体、真实的选项。**
-"""
+
+剧情摘要：{context}
+玩家操作：{player_action}
+""",
+                native=native_templates
             ),
-            "dialogue": PromptTemplate(
+            "dialogue": LazyPromptTemplate(
                 input_variables=["context", "player_action"],
                 template="""
 你是一名文字冒险游戏的对话场景生成AI。请根据剧情摘要和玩家操作，生成一个对话场景。
 
-剧情摘要：{context}
-玩家操作：{player_action}
-
 请以如下JSON格式输出（不要输出任何解释性文字，只输出JSON）：
 示例：
 {{
@@ -137,14 +215,147 @@ class ScenePrompt:
 - 不要输出任何解释性文字或说明，只输出JSON。
 - 请严格输出标准JSON，所有属性名和字符串都必须用双引号。
 - **不要输出括号内容或占位符，必须生成具体、真实的选项。**
-"""
+
+剧情摘要：{context}
+玩家操作：{player_action}
+""",
+                native=native_templates
+            )
+        }
+        # 会话模式下只发送的增量prompt，之前的剧情和格式要求已包含在后端返回的上下文中
+        self.scene_delta_prompt = LazyPromptTemplate(
+            input_variables=["latest_event", "player_action"],
+            template="""
+最新发生：{latest_event}
+玩家操作：{player_action}
+
+请延续上面的剧情，按照同样的JSON格式输出下一个场景，只输出JSON。
+""",
+            native=native_templates
+        )
+        # schema模式的精简Prompt：输出格式由约束解码保证，不再需要格式说明和示例
+        self.schema_summary_prompt = LazyPromptTemplate(
+            input_variables=["history"],
+            template="""
+你是一名文字冒险游戏的剧情总结助手。请将以下剧情历史精炼为150字以内的摘要，保留主线脉络、关键事件和重要角色。
+
+剧情历史：
+{history}
+""",
+            native=native_templates
+        )
+        self.schema_prompt_dict = {
+            "explore": LazyPromptTemplate(
+                input_variables=["context", "player_action"],
+                template="""
+你是一名文字冒险游戏的剧情生成AI。请根据剧情摘要和玩家操作生成一个探索场景：description生动描述当前场景，options给出3个结合当前剧情的具体行动，event可用add_item:物品名、add_experience:数值或none。
+
+剧情摘要：{context}
+玩家操作：{player_action}
+""",
+                native=native_templates
+            ),
+            "battle": LazyPromptTemplate(
+                input_variables=["context", "player_action"],
+                template="""
+你是一名文字冒险游戏的战斗场景生成AI。请根据剧情摘要和玩家操作生成一个战斗场景：description生动描述当前战斗，options给出3个结合当前战斗的具体行动，event可用damage:数值、heal:数值或none。
+
+剧情摘要：{context}
+玩家操作：{player_action}
+""",
+                native=native_templates
+            ),
+            "dialogue": LazyPromptTemplate(
+                input_variables=["context", "player_action"],
+                template="""
+你是一名文字冒险游戏的对话场景生成AI。请根据剧情摘要和玩家操作生成一个对话场景：description生动描述当前对话，options给出3个结合当前对话的具体行动，event可用add_experience:数值、add_item:物品名或none。
+
+剧情摘要：{context}
+玩家操作：{player_action}
+""",
+                native=native_templates
             )
         }
-        # 直接用prompt | llm组合
-        self.scene_runnables = {
-            key: self.prompt_dict[key] | self.llm for key in self.prompt_dict
+    
+    @property
+    def use_schema(self) -> bool:
+        """是否启用schema约束解码"""
+        return self.structured_output == "schema"
+    
+    def _on_router_created(self, router: BackendRouter) -> None:
+        """按需创建的后端池同样做健康探测与预热常驻"""
+        self.residency.add_router(router)
+        if self._live:
+            router.start_health_checks()
+    
+    def _invoke(self, prompt: str, call_type: str, route: str = None, cancel_token: CancelToken = None,
+                **kwargs) -> str:
+        """通过调用类型对应的后端池调用模型，按调用类型附加生成参数；cancel_token被取消时中止调用并抛出GenerationCancelled"""
+        params = self.generation_profiles.resolve(call_type, prompt, route)
+        params.setdefault("keep_alive", self.residency.keep_alive)
+        params.update(kwargs)
+        if self.cassette is not None:
+            check_cancelled(cancel_token)
+            return self.cassette.invoke(call_type, prompt, params,
+                                        lambda: self._call_model(prompt, params, cancel_token, call_type, route))
+        return self._call_model(prompt, params, cancel_token, call_type, route)
+    
+    def _call_model(self, prompt: str, params: Dict[str, Any], cancel_token: CancelToken = None,
+                    call_type: str = "scene", route: str = None) -> str:
+        self.residency.mark_activity()
+        result = self.model_routes.invoke(call_type, prompt, route, cancel_token=cancel_token, **params)
+        self.residency.mark_activity(success=True)
+        return result
+    
+    def warm_up(self, background: bool = True) -> None:
+        """预加载模型，避免首个回合承担模型加载时间"""
+        self.residency.warm_up(background)
+    
+    def wait_until_ready(self, timeout: float = None) -> bool:
+        """等待模型预热完成"""
+        return self.residency.wait_until_ready(timeout)
+    
+    def get_model_status(self) -> Dict[str, Any]:
+        """获取模型就绪状态（cold/loading/ready/unavailable）"""
+        return self.residency.get_status()
+    
+    def get_backend_stats(self) -> List[Dict[str, Any]]:
+        """获取各模型后端的状态与统计（包括按调用类型路由创建的后端池）"""
+        return [stats for router in self.model_routes.routers() for stats in router.get_stats()]
+    
+    def is_available(self, scene_type: str = "explore") -> bool:
+        """生成一个回合所需的后端池（事件推进与场景）是否都未熔断；回放模式不访问后端，总是可用"""
+        if not self._live:
+            return True
+        keys = {self.model_routes.resolve("event"),
+                self.model_routes.resolve("scene", self._route_scene_type(scene_type))}
+        return all(self.model_routes.router(key).breaker.closed for key in keys)
+    
+    def get_circuit_status(self) -> Dict[str, Any]:
+        """熔断器状态：state为任一后端池打开时的open，pools为各后端池的详细状态"""
+        pools = self.model_routes.circuit_status()
+        state = "open" if any(pool['state'] == "open" for pool in pools.values()) else "closed"
+        return {'state': state, 'pools': pools}
+    
+    def get_route_stats(self) -> Dict[str, Dict[str, Any]]:
+        """获取各调用路由的模型、延迟与输出质量统计"""
+        return self.model_routes.get_stats()
+    
+    def get_hedging_stats(self) -> Dict[str, Any]:
+        """获取对冲请求统计（触发次数、胜出次数、额外消耗的token），合计所有后端池；hedge_delays为各后端池的对冲等待时间"""
+        stats = _sum_stats(router.hedging_stats.to_dict() for router in self.model_routes.routers())
+        stats['extra_load'] = stats['hedges_fired'] / stats['requests'] if stats.get('requests') else 0.0
+        return {
+            'enabled': self.router.hedging.enabled,
+            'hedge_delay': self.router.hedge_delay(),
+            'hedge_delays': self.model_routes.hedge_delays(),
+            **stats
         }
     
+    def get_cancellation_stats(self) -> Dict[str, Any]:
+        """获取取消统计（中止/跳过的请求数、丢弃与释放的token）"""
+        return _sum_stats(router.get_cancellation_stats() for router in self.model_routes.routers())
+    
     def build_scene_prompt(self, story_context: str, player_action: str = None, scene_type: str = "adventure") -> str:
         """构建场景描述提示词"""
         base_prompt = f"""你是一位专业的文字冒险游戏剧情作家。请根据当前故事背景和玩家行为，创作引人入胜的下一个场景。
@@ -206,8 +417,17 @@ class ScenePrompt:
 """
         return prompt
     
-    def build_options_prompt(self, current_situation: str, story_context: str, difficulty: str = "medium") -> str:
-        """构建选项生成提示词"""
+    def build_options_prompt(self, current_situation: str, story_context: str, difficulty: str = "medium", compact: bool = False) -> str:
+        """构建选项生成提示词，compact为True时省略输出格式说明"""
+        if compact:
+            return f"""请为当前游戏情况生成3个行动选项：行动派、策略派、创意派各一个，每个15字内，能引出不同的剧情走向。
+
+故事背景：{story_context}
+
+当前情况：{current_situation}
+
+难度设定：{difficulty}（easy=简单直接, medium=需要思考, hard=复杂多变）
+"""
         prompt = f"""请为当前游戏情况生成3个行动选项。
 
 故事背景：{story_context}
@@ -232,22 +452,15 @@ class ScenePrompt:
 """
         return prompt
     
-    def build_event_progression_prompt(self, story_context: str, player_choice: str, previous_events: List[str] = None) -> str:
-        """构建事件推进提示词"""
-        prompt = f"""你需要根据玩家的选择推进游戏剧情。
+    def build_event_progression_prompt(self, story_context: str, player_choice: str, previous_events: List[str] = None, compact: bool = False) -> str:
+        """构建事件推进提示词，compact为True时省略输出格式说明
 
-故事背景：{story_context}
-
-玩家选择：{player_choice}
-"""
-        
-        if previous_events:
-            prompt += f"\n之前发生的事件：\n"
-            for i, event in enumerate(previous_events[-3:], 1):  # 只取最近3个事件
-                prompt += f"{i}. {event}\n"
-        
-        prompt += """
-请描述玩家选择导致的结果和后续发展：
+        固定的说明放在最前面、剧情内容放在后面，使各回合的prompt前缀保持一致，便于后端复用前缀缓存
+        """
+        if compact:
+            prompt = "你需要根据玩家的选择推进游戏剧情：event_result用100-150字描述行动的后果、环境反应和新的线索；status_changes描述获得/失去的物品、生命值、经验等变化，没有则为空字符串。\n"
+        else:
+            prompt = """你需要根据玩家的选择推进游戏剧情。请描述玩家选择导致的结果和后续发展：
 
 事件结果：[100-150字描述：
 1. 玩家行动的直接后果
@@ -263,67 +476,216 @@ class ScenePrompt:
 
 格式要求：内容要与玩家选择逻辑相符，保持故事连贯性。
 """
+        prompt += f"""
+故事背景：{story_context}
+
+玩家选择：{player_choice}
+"""
+        
+        if previous_events:
+            prompt += f"\n之前发生的事件：\n"
+            for i, event in enumerate(previous_events[-3:], 1):  # 只取最近3个事件
+                prompt += f"{i}. {event}\n"
+        
         return prompt
     
     def _route_scene_type(self, scene_type: str) -> str:
         # 简单路由逻辑，可扩展
-        if scene_type in self.scene_runnables:
+        if scene_type in self.prompt_dict:
             return scene_type
         return "explore"
     
-    def generate_scene(self, story_context: str, player_action: str = None, scene_type: str = "explore") -> dict:
-        """根据剧情类型动态选择Prompt，生成结构化场景描述和选项"""
+    def generate_scene(self, story_context: str, player_action: str = None, scene_type: str = "explore",
+                       session_id: str = None, session_anchor: str = None, latest_event: str = None,
+                       cancel_token: CancelToken = None, max_output: int = None) -> dict:
+        """根据剧情类型动态选择Prompt，生成结构化场景描述和选项
+
+        传入session_id时启用会话模式：session_anchor为当前场景描述，用于判断缓存的上下文是否仍然有效；
+        latest_event为本回合最新发生的事件，上下文有效时只发送它和玩家操作；
+        max_output为回合时间不足时的输出token上限
+        """
         route = self._route_scene_type(scene_type)
-        chain_input = {"context": story_context, "player_action": player_action or ""}
-        response = self.scene_runnables[route].invoke(chain_input)
-        return self.parse_structured_scene_response(response)
+        templates = self.schema_prompt_dict if self.use_schema else self.prompt_dict
+        prompt = templates[route].format(context=story_context, player_action=player_action or "")
+        extra = {'format': SCENE_SCHEMA} if self.use_schema else {}
+        params = self.generation_profiles.resolve("scene", prompt, route)
+        if max_output:
+            num_predict = params.get("num_predict")
+            extra['num_predict'] = min(num_predict, max_output) if num_predict else max_output
+        session = self._get_session(session_id, session_anchor,
+                                    self.model_routes.router_label(self.model_routes.resolve("scene", route)))
+        if session is not None:
+            extra['session'] = session
+            if latest_event and session.context:
+                delta_prompt = self.scene_delta_prompt.format(latest_event=latest_event, player_action=player_action or "")
+                extra['delta_prompt'] = delta_prompt
+                # 关闭上下文估算且未配置num_ctx时沿用模型默认的上下文窗口
+                if params.get('num_ctx'):
+                    extra['num_ctx'] = max(params['num_ctx'], self.generation_profiles.estimate_num_ctx(
+                        delta_prompt, extra.get('num_predict', params.get('num_predict')),
+                        extra_tokens=len(session.context)))
+        try:
+            response = self._invoke(prompt, "scene", route, cancel_token, **extra)
+        except Exception:
+            if session is not None:
+                session.reset()
+            raise
+        result = self.parse_structured_scene_response(response, story_context, player_action or "", cancel_token,
+                                                      route)
+        if session is not None:
+            session.anchor = self._anchor(result['description'])
+        return result
+    
+    @staticmethod
+    def _anchor(description: str) -> str:
+        return hashlib.sha1(description.encode("utf-8")).hexdigest()
+    
+    def _get_session(self, session_id: Optional[str], session_anchor: Optional[str],
+                     route: str = "default") -> Optional[SessionContext]:
+        """取出会话状态；剧情与缓存的上下文对不上、上下文过长或换用了其他模型的后端池时丢弃上下文"""
+        if not self.session_context_enabled or not session_id:
+            return None
+        with self._sessions_lock:
+            session = self._sessions.pop(session_id, None) or SessionContext()
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        if session.route != route:
+            session.reset()
+            session.backend_name = None
+            session.route = route
+        if session.context is not None:
+            if session_anchor is None or session.anchor != self._anchor(session_anchor):
+                session.reset()
+            elif len(session.context) > self.max_context_tokens:
+                session.reset()
+        return session
+    
+    def reset_session(self, session_id: str) -> None:
+        """结束或重开一局游戏时丢弃其会话状态"""
+        with self._sessions_lock:
+            self._sessions.pop(session_id, None)
+    
+    def get_session_stats(self) -> Dict[str, Any]:
+        """获取会话上下文复用统计"""
+        return {
+            'enabled': self.session_context_enabled,
+            'active_sessions': len(self._sessions),
+            **_sum_stats(router.get_session_stats() for router in self.model_routes.routers())
+        }
     
-    def generate_character_dialogue(self, character_info: Dict[str, str], dialogue_context: str, player_speech: str = None) -> str:
+    def generate_character_dialogue(self, character_info: Dict[str, str], dialogue_context: str, player_speech: str = None,
+                                    cancel_token: CancelToken = None) -> str:
         """生成角色对话"""
         prompt = self.build_character_dialogue_prompt(character_info, dialogue_context, player_speech)
-        response = self.llm.invoke(prompt)
+        response = self._invoke(prompt, "dialogue", cancel_token=cancel_token)
         return response.strip()
     
-    def generate_options(self, current_situation: str, story_context: str, difficulty: str = "medium") -> List[str]:
+    def generate_options(self, current_situation: str, story_context: str, difficulty: str = "medium",
+                         cancel_token: CancelToken = None) -> List[str]:
         """生成行动选项"""
+        if self.use_schema:
+            prompt = self.build_options_prompt(current_situation, story_context, difficulty, compact=True)
+            data, _ = repair_json(self._invoke(prompt, "options", cancel_token=cancel_token, format=OPTIONS_SCHEMA))
+            options, _ = normalize_options(data)
+            self.model_routes.record_quality("options", bool(options))
+            return options[:3] if options else ["继续探索", "仔细观察", "寻找线索"]
         prompt = self.build_options_prompt(current_situation, story_context, difficulty)
-        response = self.llm.invoke(prompt)
+        response = self._invoke(prompt, "options", cancel_token=cancel_token, stop_after_json=False)
+        self.model_routes.record_quality("options", bool(re.search(r'\d+\.\s*\S', response)))
         return self.parse_options_response(response)
     
-    def generate_event_progression(self, story_context: str, player_choice: str, previous_events: List[str] = None) -> Dict[str, Any]:
+    def generate_event_progression(self, story_context: str, player_choice: str, previous_events: List[str] = None,
+                                   cancel_token: CancelToken = None) -> Dict[str, Any]:
         """生成事件推进"""
+        if self.use_schema:
+            prompt = self.build_event_progression_prompt(story_context, player_choice, previous_events, compact=True)
+            response = self._invoke(prompt, "event", cancel_token=cancel_token, format=EVENT_SCHEMA)
+            data, _ = repair_json(response)
+            valid = isinstance(data, dict) and bool(data.get("event_result"))
+            self.model_routes.record_quality("event", valid)
+            if valid:
+                return {
+                    'event_result': str(data["event_result"]).strip(),
+                    'status_changes': str(data.get("status_changes") or "").strip(),
+                    'raw_response': response
+                }
+            return self.parse_event_response(response)
         prompt = self.build_event_progression_prompt(story_context, player_choice, previous_events)
-        response = self.llm.invoke(prompt)
+        response = self._invoke(prompt, "event", cancel_token=cancel_token)
+        self.model_routes.record_quality("event", "事件结果：" in response)
         return self.parse_event_response(response)
     
-    def parse_structured_scene_response(self, response: str) -> dict:
-        """解析结构化JSON响应，增强健壮性"""
-        import re
-        import json
+    def parse_structured_scene_response(self, response: str, story_context: str = "", player_action: str = "",
+                                        cancel_token: CancelToken = None, route: str = None) -> dict:
+        """解析结构化JSON响应：先修复常见语法错误，缺失字段时只补全缺失部分
+
+        route为生成该响应的场景路由，需要降级或补全时计入该路由的输出质量
+        """
+        self.parse_stats['total'] += 1
+        response = strip_code_fence(response)
+        data, repaired = repair_json(response)
+        if not isinstance(data, dict):
+            print("结构化解析失败，降级为普通解析: 未找到合法JSON结构")
+            self.parse_stats['fallbacks'] += 1
+            self.model_routes.record_quality("scene", False, route)
+            return self.parse_scene_response(response)
+        self.parse_stats['repaired' if repaired else 'clean'] += 1
+
+        description = str(data.get("description") or "").strip()
+        options, option_events = normalize_options(data.get("options", []))
+        self.model_routes.record_quality("scene", bool(description and options), route)
+        if not description:
+            description = self._regenerate_description(story_context, player_action, cancel_token, route)
+        if not options:
+            options, option_events = self._regenerate_options(story_context, description, cancel_token)
+        return {
+            'description': description,
+            'options': options,
+            'option_events': option_events,
+            'raw_response': response
+        }
+    
+    def _regenerate_options(self, story_context: str, description: str, cancel_token: CancelToken = None):
+        """场景描述完整但缺少选项时，只请求补全选项"""
+        self.parse_stats['partial_regenerations'] += 1
         try:
-            # 去除markdown代码块包裹
-            response = response.strip()
-            if response.startswith("```"):
-                response = re.sub(r"^```[a-zA-Z]*", "", response)
-                response = response.strip("`").strip()
-            # 用正则提取第一个大括号包裹的内容
-            match = re.search(r'\{[\s\S]*\}', response)
-            if match:
-                json_str = match.group(0)
-                data = json.loads(json_str)
-                options = data.get("options", [])
-                return {
-                    'description': data.get("description", ""),
-                    'options': [opt.get("text", "") for opt in options],
-                    'option_events': [opt.get("event", "none") for opt in options],
-                    'raw_response': response
-                }
-            else:
-                raise ValueError("未找到合法JSON结构")
+            prompt = self.options_followup_prompt.format(context=story_context, description=description)
+            data, _ = repair_json(self._invoke(prompt, "options", cancel_token=cancel_token))
+            options, option_events = normalize_options(data)
+            if options:
+                return options[:3], option_events[:3]
+        except GenerationCancelled:
+            raise
         except Exception as e:
-            print(f"结构化解析失败，降级为普通解析: {e}")
-            # fallback到原有解析
-            return self.parse_scene_response(response)
+            print(f"补全选项失败: {e}")
+        self.parse_stats['partial_regeneration_failures'] += 1
+        return ["继续探索", "仔细观察", "寻找线索"], ["none", "none", "none"]
+    
+    def _regenerate_description(self, story_context: str, player_action: str, cancel_token: CancelToken = None,
+                                route: str = None) -> str:
+        """缺少场景描述时，只请求补全描述；补全的是纯文本，使用description调用类型而非场景的JSON生成参数"""
+        self.parse_stats['partial_regenerations'] += 1
+        try:
+            prompt = self.description_followup_prompt.format(context=story_context, player_action=player_action)
+            description = self._invoke(prompt, "description", route, cancel_token).strip()
+            if description:
+                return description
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            print(f"补全场景描述失败: {e}")
+        self.parse_stats['partial_regeneration_failures'] += 1
+        return "你的冒险还在继续，未知的挑战在前方等待着你..."
+    
+    def get_parse_stats(self) -> Dict[str, Any]:
+        """获取结构化解析统计（修复率、局部补全率、降级率）"""
+        stats = dict(self.parse_stats)
+        total = stats['total'] or 1
+        stats['repair_rate'] = stats['repaired'] / total
+        stats['partial_regeneration_rate'] = stats['partial_regenerations'] / total
+        stats['fallback_rate'] = stats['fallbacks'] / total
+        return stats
     
     def parse_scene_response(self, response: str) -> Dict[str, Any]:
         """解析场景生成的响应"""
@@ -386,14 +748,40 @@ class ScenePrompt:
                 'error': str(e)
             }
 
-    def summarize_history(self, history: str) -> str:
-        """对历史剧情进行摘要，返回精炼主线"""
+    def summarize_history(self, history: str, cancel_token: CancelToken = None, salient: List[str] = None,
+                          local_only: bool = False) -> str:
+        """对历史剧情进行摘要，返回精炼主线；salient为摘要中应优先保留的物品、人名
+
+        历史不超过本地预算或local_only为True（回合时间不足）时直接抽取关键句，不调用模型
+        """
+        salient = salient or []
+        if local_only or self.summarizer.fits(history):
+            self.summarizer.record('local')
+            return self.summarizer.summarize(history, salient=salient)
+        source = self.summarizer.compress(history, salient)
         try:
-            result = self.summary_chain.invoke({"history": history})
+            if self.use_schema:
+                data, _ = repair_json(self._invoke(self.schema_summary_prompt.format(history=source), "summary",
+                                                   cancel_token=cancel_token, format=SUMMARY_SCHEMA))
+                valid = isinstance(data, dict) and bool(data.get("summary"))
+                self.model_routes.record_quality("summary", valid)
+                if valid:
+                    self.summarizer.record('llm')
+                    return str(data["summary"]).strip()
+                raise ValueError("摘要输出缺少summary字段")
+            result = self._invoke(self.summary_prompt.format(history=source), "summary", cancel_token=cancel_token)
+            self.summarizer.record('llm')
             return result.strip()
+        except GenerationCancelled:
+            raise
         except Exception as e:
             print(f"剧情摘要失败: {e}")
-            return history[:150] + ("..." if len(history) > 150 else "")
+            self.summarizer.record('fallback')
+            return self.summarizer.summarize(source, salient=salient)
+    
+    def get_summary_stats(self) -> Dict[str, Any]:
+        """获取剧情摘要统计（本地/模型/回退次数与本地抽取耗时）"""
+        return self.summarizer.get_stats()
 
 # 测试和验证功能
 def test_scene_prompt():
@@ -0,0 +1,169 @@
+# 存档内容寻址存储：剧情节点与分支内容按哈希存为共享的块，存档文件只保存块的引用；引用计数为零的块随删除存档一起清理
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+# 存档目录下存放块的子目录
+OBJECTS_DIR = "objects"
+_INDEX_FILE = "refs.json"
+
+_stores: Dict[str, 'ChunkStore'] = {}
+_stores_lock = threading.Lock()
+
+
+def _canonical(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def chunk_digest(data: Any) -> str:
+    """块的内容哈希"""
+    return hashlib.sha1(_canonical(data)).hexdigest()
+
+
+def manifest_refs(save_data: Dict[str, Any]) -> Set[str]:
+    """存档文件引用的全部块"""
+    refs = set(save_data.get('story', {}).get('history_refs', []))
+    for node in (save_data.get('branches') or {}).get('nodes', []):
+        if node.get('payload_ref'):
+            refs.add(node['payload_ref'])
+    return refs
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class ChunkStore:
+    """一个存档目录共享的块存储
+
+    refs.json记录每个块被多少个存档引用，进程内的所有GameStateManager通过open_store共用同一个实例和锁；
+    多个进程同时写同一目录时引用计数可能不准，可以用tools.save_gc按存档文件重建
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._refs: Optional[Dict[str, int]] = None
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest[2:] + ".json")
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, _INDEX_FILE)
+
+    def _load_refs(self) -> Dict[str, int]:
+        if self._refs is None:
+            try:
+                with open(self._index_path, "r", encoding="utf-8") as f:
+                    self._refs = json.load(f)
+            except FileNotFoundError:
+                self._refs = {}
+        return self._refs
+
+    def _save_refs(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        _write_atomic(self._index_path, json.dumps(self._refs, separators=(",", ":")).encode("utf-8"))
+
+    def retain(self, chunks: Dict[str, Callable[[], Any]]) -> int:
+        """为一个新存档增加引用；chunks为块哈希到块内容的延迟取值，只有存储中还没有的块才会取值并写入
+
+        返回新写入的块数
+        """
+        written = 0
+        with self._lock:
+            refs = self._load_refs()
+            for digest, make in chunks.items():
+                if digest not in refs:
+                    path = self._path(digest)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    _write_atomic(path, _canonical(make()))
+                    written += 1
+                refs[digest] = refs.get(digest, 0) + 1
+            self._save_refs()
+        return written
+
+    def release(self, digests: Iterable[str]) -> int:
+        """删除或覆盖存档时减少引用，删除不再被引用的块，返回删除的块数"""
+        removed = 0
+        with self._lock:
+            refs = self._load_refs()
+            for digest in digests:
+                count = refs.get(digest, 0) - 1
+                if count > 0:
+                    refs[digest] = count
+                    continue
+                refs.pop(digest, None)
+                try:
+                    os.remove(self._path(digest))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            self._save_refs()
+        return removed
+
+    def read(self, digest: str) -> Any:
+        with open(self._path(digest), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _chunk_files(self) -> Dict[str, str]:
+        files = {}
+        if not os.path.isdir(self.directory):
+            return files
+        for prefix in os.listdir(self.directory):
+            folder = os.path.join(self.directory, prefix)
+            if len(prefix) != 2 or not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if name.endswith(".json"):
+                    files[prefix + name[:-5]] = os.path.join(folder, name)
+        return files
+
+    def gc(self, live: Dict[str, int], dry_run: bool = False) -> Dict[str, Any]:
+        """按存档文件统计出的引用重建引用计数，删除没有任何存档引用的块
+
+        live为块哈希到引用它的存档数；返回删除的块数与字节数，以及存档引用了但已丢失的块
+        """
+        with self._lock:
+            files = self._chunk_files()
+            garbage = [digest for digest in files if digest not in live]
+            freed = sum(os.path.getsize(files[digest]) for digest in garbage)
+            missing = sorted(digest for digest in live if digest not in files)
+            if not dry_run:
+                for digest in garbage:
+                    os.remove(files[digest])
+                self._refs = {digest: count for digest, count in live.items() if digest in files}
+                self._save_refs()
+        return {'chunks': len(files), 'removed': len(garbage), 'freed_bytes': freed, 'missing': missing}
+
+    def usage(self) -> Dict[str, int]:
+        """块的数量与占用的字节数"""
+        files = self._chunk_files()
+        return {'chunks': len(files), 'bytes': sum(os.path.getsize(path) for path in files.values())}
+
+
+def open_store(save_directory: str) -> ChunkStore:
+    """取得存档目录对应的块存储，同一目录在进程内共用一个实例"""
+    directory = os.path.abspath(os.path.join(save_directory, OBJECTS_DIR))
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = _stores[directory] = ChunkStore(directory)
+        return store
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as save_directory:
+        store = open_store(save_directory)
+        a, b = {'description': "城堡"}, {'description': "森林"}
+        print("写入:", store.retain({chunk_digest(a): lambda: a, chunk_digest(b): lambda: b}),
+              store.retain({chunk_digest(a): lambda: a}), store.usage())
+        print("释放:", store.release([chunk_digest(a), chunk_digest(b)]), store.usage())
+        print("回收:", store.gc({}, dry_run=True), store.gc({}), store.usage())
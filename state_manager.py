@@ -2,24 +2,41 @@
 
 import json
 import os
+import random
+import uuid
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+from models.branch_tree import BranchTree
 from models.player import Player
-from models.story_state import StoryState
+from models.story_state import StoryNode, StoryState
+from models.timeline import TurnTimeline
+from save_store import chunk_digest, manifest_refs, open_store
 
 class GameStateManager:
     """游戏状态管理器"""
     
-    def __init__(self, save_directory: str = "saves"):
+    def __init__(self, save_directory: str = "saves", branch_cache_size: int = 200):
         self.save_directory = save_directory
+        # 每局游戏的剧情分支树最多缓存的场景数，0为不缓存
+        self.branch_cache_size = branch_cache_size
+        self.branches = BranchTree(branch_cache_size)
         self.player: Player = Player()
         self.story: StoryState = StoryState()
+        seed = random.randrange(2 ** 32)
         self.game_metadata: Dict[str, Any] = {
             'created_at': datetime.now().isoformat(),
             'last_updated': datetime.now().isoformat(),
             'play_time': 0,  # 游戏时间（秒）
-            'version': '1.0'
+            'version': '1.0',
+            'game_id': uuid.uuid4().hex,
+            'seed': seed
         }
+        # 每局游戏独立的随机数生成器，随机事件全部从这里取值，保证同一种子的对局可以复现
+        self.rng = random.Random(seed)
+        # 每回合结束时的状态快照，用于多步撤销/重做
+        self.timeline = TurnTimeline()
+        # 同一存档目录下所有存档共享的剧情节点块存储
+        self.store = open_store(save_directory)
         
         # 确保存档目录存在
         if not os.path.exists(self.save_directory):
@@ -29,16 +46,23 @@ class GameStateManager:
         """更新游戏元数据"""
         self.game_metadata['last_updated'] = datetime.now().isoformat()
     
-    def create_new_game(self, player_name: str = "冒险者") -> None:
-        """创建新游戏"""
+    def create_new_game(self, player_name: str = "冒险者", seed: Optional[int] = None) -> None:
+        """创建新游戏，未指定种子时随机生成"""
+        if seed is None:
+            seed = random.randrange(2 ** 32)
         self.player = Player(name=player_name)
         self.story = StoryState()
         self.game_metadata = {
             'created_at': datetime.now().isoformat(),
             'last_updated': datetime.now().isoformat(),
             'play_time': 0,
-            'version': '1.0'
+            'version': '1.0',
+            'game_id': uuid.uuid4().hex,
+            'seed': seed
         }
+        self.rng = random.Random(seed)
+        self.timeline.reset()
+        self.branches = BranchTree(self.branch_cache_size)
     
     def update_story(self, scene_id: str, description: str, options: list, player_choice: str = None, option_events: list = None) -> None:
         """更新剧情状态"""
@@ -47,6 +71,12 @@ class GameStateManager:
         self.story.add_scene(scene_id, description, options, option_events)
         self.update_metadata()
     
+    def get_game_id(self) -> str:
+        """获取当前这局游戏的唯一标识（旧存档没有时补上）"""
+        if not self.game_metadata.get('game_id'):
+            self.game_metadata['game_id'] = uuid.uuid4().hex
+        return self.game_metadata['game_id']
+    
     def set_story_flag(self, flag_name: str, value: Any) -> None:
         """设置故事标记"""
         self.story.set_flag(flag_name, value)
@@ -97,16 +127,44 @@ class GameStateManager:
         """获取故事上下文"""
         return self.story.get_story_context()
     
-    def can_go_back(self) -> bool:
-        """检查是否可以回退"""
-        return self.story.can_go_back()
+    def checkpoint(self, step: Optional[int] = None) -> None:
+        """回合结束时记录快照，step为引擎的剧情步数，撤销时一并恢复"""
+        self.timeline.checkpoint(self.player, self.story, step)
     
-    def go_back(self) -> bool:
-        """回退到上一个场景"""
-        if self.story.go_back():
-            self.update_metadata()
-            return True
-        return False
+    @property
+    def current_step(self) -> Optional[int]:
+        """当前所在快照记录的剧情步数"""
+        if self.timeline.position < 0:
+            return None
+        return self.timeline.snapshots[self.timeline.position].step
+    
+    def can_go_back(self, steps: int = 1) -> bool:
+        """检查是否可以回退steps个回合"""
+        return self.timeline.can_undo(steps)
+    
+    def can_go_forward(self, steps: int = 1) -> bool:
+        """检查是否可以重做steps个回合"""
+        return self.timeline.can_redo(steps)
+    
+    def go_back(self, steps: int = 1) -> bool:
+        """回退steps个回合，恢复场景、选项、玩家属性与故事标记；随机数序列不回退"""
+        if not self.timeline.can_undo(steps):
+            return False
+        self.timeline.restore(self.timeline.position - steps, self.player, self.story)
+        self.update_metadata()
+        return True
+    
+    def go_forward(self, steps: int = 1) -> bool:
+        """重做之前撤销的steps个回合"""
+        if not self.timeline.can_redo(steps):
+            return False
+        self.timeline.restore(self.timeline.position + steps, self.player, self.story)
+        self.update_metadata()
+        return True
+    
+    def get_turn_history(self) -> List[Dict[str, Any]]:
+        """时间线上各回合的摘要"""
+        return self.timeline.entries()
     
     def end_game(self, ending_type: str = "normal") -> None:
         """结束游戏"""
@@ -114,27 +172,74 @@ class GameStateManager:
         self.update_metadata()
     
     def save_game(self, save_name: str) -> bool:
-        """保存游戏"""
+        """保存游戏
+
+        剧情历史节点和分支内容按内容哈希写入共享的块存储，存档文件只记录块的哈希；
+        节点的哈希会缓存在节点上，每次存档只需序列化并写入新产生的节点
+        """
         try:
+            # 保存随机数生成器的当前状态，读档后继续同一随机序列
+            self.game_metadata['rng_state'] = self.rng.getstate()
+            chunks = {}
+            story_data = self.story.to_dict(include_history=False)
+            story_data['history_refs'] = [self._node_ref(node, chunks) for node in self.story.history]
             save_data = {
                 'player': self.player.to_dict(),
-                'story': self.story.to_dict(),
-                'metadata': self.game_metadata
+                'story': story_data,
+                'metadata': self.game_metadata,
+                'branches': self._branches_manifest(chunks)
             }
             
             save_path = os.path.join(self.save_directory, f"{save_name}.json")
-            with open(save_path, 'w', encoding='utf-8') as f:
+            # 覆盖同名存档时，先登记新存档的引用再释放旧存档的引用，两者共有的块不会被删除
+            old_refs = self._read_manifest_refs(save_path)
+            written = self.store.retain(chunks)
+            tmp_path = f"{save_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump(save_data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, save_path)
+            self.store.release(old_refs)
             
-            print(f"游戏已保存到: {save_path}")
+            print(f"游戏已保存到: {save_path}（新增 {written}/{len(chunks)} 个内容块）")
             return True
         
         except Exception as e:
             print(f"保存游戏失败: {e}")
             return False
     
+    def _node_ref(self, node: StoryNode, chunks: Dict[str, Any]) -> str:
+        """历史节点的块哈希，登记到本次存档引用的块中"""
+        if node.chunk_ref is None:
+            data = node.to_dict()
+            node.chunk_ref = chunk_digest(data)
+            chunks[node.chunk_ref] = lambda: data
+        else:
+            chunks[node.chunk_ref] = node.to_dict
+        return node.chunk_ref
+    
+    def _branches_manifest(self, chunks: Dict[str, Any]) -> Dict[str, Any]:
+        """分支树的存档数据，各节点的payload改为块哈希"""
+        data = self.branches.to_dict()
+        for item, node in zip(data['nodes'], self.branches.nodes.values()):
+            if node.payload is None:
+                continue
+            if node.payload_ref is None:
+                node.payload_ref = chunk_digest(node.payload)
+            chunks[node.payload_ref] = lambda payload=node.payload: payload
+            item['payload'] = None
+            item['payload_ref'] = node.payload_ref
+        return data
+    
+    def _read_manifest_refs(self, save_path: str) -> set:
+        """已有存档文件引用的块，文件不存在或无法解析时为空"""
+        try:
+            with open(save_path, 'r', encoding='utf-8') as f:
+                return manifest_refs(json.load(f))
+        except (OSError, ValueError):
+            return set()
+    
     def load_game(self, save_name: str) -> bool:
-        """读取游戏"""
+        """读取游戏，兼容历史节点直接写在存档文件中的旧存档"""
         try:
             save_path = os.path.join(self.save_directory, f"{save_name}.json")
             
@@ -149,10 +254,30 @@ class GameStateManager:
             self.player = Player.from_dict(save_data['player'])
             
             # 恢复剧情状态
-            self.story = StoryState.from_dict(save_data['story'])
+            story_data = save_data['story']
+            refs = story_data.get('history_refs')
+            if refs is not None:
+                story_data['history'] = [self.store.read(ref) for ref in refs]
+            self.story = StoryState.from_dict(story_data)
+            for node, ref in zip(self.story.history, refs or []):
+                node.chunk_ref = ref
             
             # 恢复元数据
+            previous_game_id = self.game_metadata.get('game_id')
             self.game_metadata = save_data.get('metadata', {})
+            self._restore_rng()
+            branches_data = save_data.get('branches') or {}
+            for item in branches_data.get('nodes', []):
+                if item.get('payload_ref'):
+                    item['payload'] = self.store.read(item['payload_ref'])
+            branches = BranchTree.from_dict(branches_data, self.branch_cache_size)
+            if previous_game_id and previous_game_id == self.game_metadata.get('game_id'):
+                # 读取同一局更早的存档时保留存档之后已生成的分支，重玩时可以直接复用
+                branches.merge(self.branches)
+            self.branches = branches
+            # 撤销最多回到读档时的状态
+            self.timeline.reset()
+            self.checkpoint()
             
             print(f"游戏已从 {save_path} 读取")
             return True
@@ -161,6 +286,16 @@ class GameStateManager:
             print(f"读取游戏失败: {e}")
             return False
     
+    def _restore_rng(self) -> None:
+        """按存档中的随机数状态恢复生成器，旧存档没有种子时补上"""
+        if 'seed' not in self.game_metadata:
+            self.game_metadata['seed'] = random.randrange(2 ** 32)
+        self.rng = random.Random(self.game_metadata['seed'])
+        state = self.game_metadata.get('rng_state')
+        if state:
+            version, internal_state, gauss_next = state
+            self.rng.setstate((version, tuple(internal_state), gauss_next))
+    
     def list_saves(self) -> list:
         """列出所有存档"""
         saves = []
@@ -193,8 +328,11 @@ class GameStateManager:
         try:
             save_path = os.path.join(self.save_directory, f"{save_name}.json")
             if os.path.exists(save_path):
+                refs = self._read_manifest_refs(save_path)
                 os.remove(save_path)
-                print(f"存档 {save_name} 已删除")
+                # 不再被任何存档引用的块随之删除
+                removed = self.store.release(refs)
+                print(f"存档 {save_name} 已删除（清理 {removed} 个内容块）")
                 return True
             else:
                 print(f"存档 {save_name} 不存在")
@@ -232,6 +370,30 @@ class GameStateManager:
         except Exception as e:
             print(f"获取存档信息失败: {e}")
             return None
+    
+    def collect_garbage(self, dry_run: bool = False) -> Dict[str, Any]:
+        """按存档目录中现有的存档文件重建块的引用计数，删除未被引用的块
+
+        用于多进程共用存档目录、手动删除存档文件或异常中断导致引用计数不准的情况
+        """
+        live: Dict[str, int] = {}
+        legacy = []
+        saves = self.list_saves()
+        for save in saves:
+            try:
+                with open(save['path'], 'r', encoding='utf-8') as f:
+                    save_data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"读取存档 {save['name']} 失败: {e}")
+                continue
+            if 'history_refs' not in save_data.get('story', {}):
+                legacy.append(save['name'])
+            for ref in manifest_refs(save_data):
+                live[ref] = live.get(ref, 0) + 1
+        result = self.store.gc(live, dry_run=dry_run)
+        result['saves'] = len(saves)
+        result['legacy_saves'] = legacy
+        return result
 
 
 # 测试代码
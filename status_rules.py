@@ -0,0 +1,142 @@
+# 状态变化规则表：把模型返回的状态变化文本转换为类型化的效果列表，关键词用同一个自动机一次扫描，只对命中的规则运行提取正则
+import json
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+from story_graph import IntentMatcher, apply_effects
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stories", "status_rules.json")
+_NUMERIC_EFFECTS = {"heal", "damage", "add_experience"}
+_EFFECTS = _NUMERIC_EFFECTS | {"add_item", "remove_item", "set_flag", "clear_flag"}
+
+
+@dataclass(frozen=True)
+class StatusEffect:
+    """一条待执行的效果；source为extracted（从文本中提取）、random（未提取到时随机取值）或fixed（规则固定值）"""
+    kind: str
+    value: Any
+    rule: str
+    source: str
+    message: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'value': self.value, 'rule': self.rule, 'source': self.source}
+
+
+@dataclass
+class StatusRule:
+    """编译后的规则"""
+    name: str
+    effect: str
+    patterns: Tuple[Pattern, ...] = ()
+    choices: Tuple[str, ...] = ()
+    value_range: Optional[Tuple[int, int]] = None
+    max_value: Optional[int] = None
+    value: Optional[str] = None
+    group: Optional[str] = None
+    message: Optional[str] = None
+
+    def extract(self, text: str, ignore_values: Tuple[str, ...]) -> Optional[Any]:
+        """按顺序尝试提取正则，返回第一个可用的数量或名称"""
+        for pattern in self.patterns:
+            for match in pattern.finditer(text):
+                value = match.group("value").strip()
+                if self.effect in _NUMERIC_EFFECTS:
+                    amount = int(value)
+                    if amount > 0:
+                        return min(amount, self.max_value) if self.max_value else amount
+                elif value and not any(word in value for word in ignore_values):
+                    return value
+        return None
+
+    def resolve(self, text: str, rng, step: int, ignore_values: Tuple[str, ...]) -> Optional[StatusEffect]:
+        """生成这条规则对应的效果，提取不到具体值时从候选或数值范围中随机取值"""
+        if self.value is not None:
+            value, source = self.value.format(step=step), "fixed"
+        else:
+            value, source = self.extract(text, ignore_values), "extracted"
+            if value is None:
+                source = "random"
+                if self.choices:
+                    value = rng.choice(self.choices)
+                elif self.value_range:
+                    value = rng.randint(*self.value_range)
+                else:
+                    return None
+        message = self.message.format(value=value) if self.message else None
+        return StatusEffect(self.effect, value, self.name, source, message)
+
+
+class StatusRuleTable:
+    """状态变化规则表：同一group中只执行表中最靠前的命中规则（如受伤与治疗互斥）"""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.ignore_values = tuple(data.get("ignore_values", []))
+        self.rules: Dict[str, StatusRule] = {}
+        keywords: Dict[str, List[str]] = {}
+        for raw in data["rules"]:
+            name = raw["name"]
+            if name in self.rules:
+                raise ValueError(f"规则名重复: {name}")
+            if raw["effect"] not in _EFFECTS:
+                raise ValueError(f"规则{name}使用了未知的效果: {raw['effect']}")
+            if "value" not in raw and not raw.get("choices") and not raw.get("range") and not raw.get("patterns"):
+                raise ValueError(f"规则{name}无法确定效果的取值")
+            self.rules[name] = StatusRule(
+                name=name,
+                effect=raw["effect"],
+                patterns=tuple(re.compile(p) for p in raw.get("patterns", [])),
+                choices=tuple(raw.get("choices", [])),
+                value_range=tuple(raw["range"]) if raw.get("range") else None,
+                max_value=raw.get("max"),
+                value=raw.get("value"),
+                group=raw.get("group"),
+                message=raw.get("message")
+            )
+            keywords[name] = raw["keywords"]
+        # 规则在表中的位置决定执行顺序和互斥优先级
+        self._order = {name: i for i, name in enumerate(self.rules)}
+        self.matcher = IntentMatcher(keywords)
+
+    def extract(self, status_changes: str, rng, step: int = 0) -> List[StatusEffect]:
+        """把状态变化文本转换为效果列表，不修改游戏状态"""
+        # 关键词不区分大小写，提取时保留原文
+        hits = sorted(self.matcher.match(status_changes.lower()), key=self._order.__getitem__)
+        effects = []
+        used_groups = set()
+        for name in hits:
+            rule = self.rules[name]
+            if rule.group is not None:
+                if rule.group in used_groups:
+                    continue
+                used_groups.add(rule.group)
+            effect = rule.resolve(status_changes, rng, step, self.ignore_values)
+            if effect is not None:
+                effects.append(effect)
+        return effects
+
+
+def apply_status_effects(effects: List[StatusEffect], state_manager) -> None:
+    """一次性把效果批量应用到玩家与故事标记"""
+    apply_effects([(e.kind, e.value) for e in effects], state_manager)
+    state_manager.update_metadata()
+
+
+@lru_cache(maxsize=None)
+def load_rules(path: str = DEFAULT_RULES_PATH) -> StatusRuleTable:
+    """加载并编译规则表，同一文件只编译一次"""
+    with open(path, "r", encoding="utf-8") as f:
+        return StatusRuleTable(json.load(f))
+
+
+if __name__ == "__main__":
+    import random
+
+    table = load_rules()
+    rng = random.Random(0)
+    for text in ["你获得了「星光之石」，并得到30点经验", "你受到了12点伤害，但发现了关键线索",
+                 "得到治疗，生命+20", "你受伤了，生命减少40", "你受伤了，生命少40", "获得了一件物品", "无事发生"]:
+        print(text, "->", [e.to_dict() for e in table.extract(text, rng, step=3)])
@@ -0,0 +1,223 @@
+# 预设剧情图：从数据文件加载剧情节点、意图关键词、跳转规则和效果，编译为带索引的状态机，玩家输入用多模式自动机一次扫描匹配意图
+import json
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+DEFAULT_STORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stories", "preset_story.json")
+# 当前所在的剧情节点保存在故事标记中，随存档一起保存和读取
+NODE_FLAG = "preset_node"
+_INT_EFFECTS = {"heal", "damage", "add_experience"}
+_STR_EFFECTS = {"add_item", "remove_item", "set_flag", "clear_flag"}
+
+
+class IntentMatcher:
+    """Aho-Corasick多模式匹配：所有意图的关键词编进同一个自动机，扫描一遍输入即可得到命中的全部意图"""
+
+    def __init__(self, intents: Dict[str, List[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[FrozenSet[str]] = [frozenset()]
+        for intent, keywords in intents.items():
+            for keyword in keywords:
+                if keyword:
+                    self._add(keyword, intent)
+        self._build()
+
+    def _add(self, keyword: str, intent: str) -> None:
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(frozenset())
+            state = nxt
+        self._output[state] = self._output[state] | {intent}
+
+    def _build(self) -> None:
+        """按广度优先计算失败指针，并把失败链上的输出合并到每个状态"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                # 根节点的子状态失败时回到根
+                self._fail[nxt] = self._goto[fail].get(ch, 0) if state else 0
+                self._output[nxt] = self._output[nxt] | self._output[self._fail[nxt]]
+
+    def match(self, text: str) -> FrozenSet[str]:
+        """返回输入中出现的所有意图"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        found: FrozenSet[str] = frozenset()
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                found = found | output[state]
+        return found
+
+
+@dataclass(frozen=True)
+class Transition:
+    """跳转规则：意图、物品、标记条件都满足时跳到目标节点，没有条件的规则作为默认分支"""
+    to: str
+    intent: Optional[str] = None
+    if_item: Optional[str] = None
+    if_flag: Optional[str] = None
+
+    def accepts(self, intents: FrozenSet[str], state_manager) -> bool:
+        if self.intent is not None and self.intent not in intents:
+            return False
+        if self.if_item is not None and not state_manager.player.has_item(self.if_item):
+            return False
+        if self.if_flag is not None and not state_manager.get_story_flag(self.if_flag, False):
+            return False
+        return True
+
+
+@dataclass
+class StoryNodeSpec:
+    """编译后的剧情节点"""
+    node_id: str
+    scene_id: str
+    description: str
+    options: List[str]
+    effects: Tuple[Tuple[str, Any], ...] = ()
+    transitions: Tuple[Transition, ...] = ()
+    ending_type: Optional[str] = None
+    option_events: List[str] = field(default_factory=list)
+
+    @property
+    def is_end(self) -> bool:
+        return self.ending_type is not None
+
+
+def parse_effect(effect: str) -> Tuple[str, Any]:
+    """把 kind:value 形式的效果解析为类型化的元组，格式与选项事件标签一致"""
+    kind, sep, value = effect.partition(":")
+    if kind in _INT_EFFECTS and sep:
+        return kind, int(value)
+    if kind in _STR_EFFECTS and value:
+        return kind, value
+    raise ValueError(f"无法识别的效果: {effect}")
+
+
+def apply_effects(effects: Tuple[Tuple[str, Any], ...], state_manager) -> None:
+    """依次执行节点效果"""
+    player = state_manager.player
+    for kind, value in effects:
+        if kind == "add_item":
+            player.add_item(value)
+        elif kind == "remove_item":
+            player.remove_item(value)
+        elif kind == "heal":
+            player.heal(value)
+        elif kind == "damage":
+            player.take_damage(value)
+        elif kind == "add_experience":
+            player.add_experience(value)
+        elif kind == "set_flag":
+            state_manager.set_story_flag(value, True)
+        elif kind == "clear_flag":
+            state_manager.set_story_flag(value, False)
+
+
+class StoryGraph:
+    """编译后的剧情状态机"""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.name = data.get("name", "")
+        self.matcher = IntentMatcher(data.get("intents", {}))
+        intents = set(data.get("intents", {}))
+        groups = data.get("transition_groups", {})
+        raw_nodes = data["nodes"]
+        self.nodes: Dict[str, StoryNodeSpec] = {}
+        for node_id, raw in raw_nodes.items():
+            transitions = raw.get("transitions", [])
+            if isinstance(transitions, str):
+                if transitions not in groups:
+                    raise ValueError(f"节点{node_id}引用了不存在的跳转组: {transitions}")
+                transitions = groups[transitions]
+            compiled = []
+            for rule in transitions:
+                if rule["to"] not in raw_nodes:
+                    raise ValueError(f"节点{node_id}跳转到不存在的节点: {rule['to']}")
+                if rule.get("intent") is not None and rule["intent"] not in intents:
+                    raise ValueError(f"节点{node_id}引用了未定义的意图: {rule['intent']}")
+                compiled.append(Transition(rule["to"], rule.get("intent"), rule.get("if_item"), rule.get("if_flag")))
+            self.nodes[node_id] = StoryNodeSpec(
+                node_id=node_id,
+                scene_id=raw.get("scene_id", node_id),
+                description=raw.get("description", ""),
+                options=list(raw.get("options", [])),
+                effects=tuple(parse_effect(e) for e in raw.get("effects", [])),
+                transitions=tuple(compiled),
+                ending_type=raw.get("ending_type"),
+                option_events=list(raw.get("option_events", []))
+            )
+        self.start = data.get("start", "start")
+        self.default_node = data.get("default_node")
+        for node_id in (self.start, self.default_node):
+            if node_id is not None and node_id not in self.nodes:
+                raise ValueError(f"剧情图中不存在节点: {node_id}")
+
+    def next_node(self, node_id: Optional[str], player_input: str, state_manager) -> Optional[StoryNodeSpec]:
+        """按玩家输入和当前状态选择下一个节点，没有可用跳转时返回默认节点"""
+        node = self.nodes.get(node_id or self.start) or self.nodes[self.start]
+        if node.transitions:
+            intents = self.matcher.match(player_input or "")
+            for transition in node.transitions:
+                if transition.accepts(intents, state_manager):
+                    return self.nodes[transition.to]
+        return self.nodes.get(self.default_node) if self.default_node else None
+
+    def advance(self, player_input: str, state_manager) -> Optional[Dict[str, Any]]:
+        """推进一步：跳转到下一个节点、执行其效果并返回GameEngine使用的剧情字典"""
+        node = self.next_node(state_manager.get_story_flag(NODE_FLAG), player_input, state_manager)
+        if node is None:
+            return None
+        apply_effects(node.effects, state_manager)
+        # 随后的update_story会刷新存档元数据，这里直接写标记
+        state_manager.story.set_flag(NODE_FLAG, node.node_id)
+        return {
+            'scene_id': node.scene_id,
+            'description': node.description,
+            'options': list(node.options),
+            'option_events': list(node.option_events),
+            'is_end': node.is_end,
+            'ending_type': node.ending_type
+        }
+
+
+@lru_cache(maxsize=None)
+def load_story(path: str = DEFAULT_STORY_PATH) -> StoryGraph:
+    """加载并编译剧情数据文件，同一文件只编译一次"""
+    with open(path, "r", encoding="utf-8") as f:
+        return StoryGraph(json.load(f))
+
+
+if __name__ == "__main__":
+    from state_manager import GameStateManager
+
+    matcher = IntentMatcher({"observe": ["观察", "环顾"], "she": ["she", "he", "hers"]})
+    print("意图匹配:", matcher.match("我想仔细观察一下"), matcher.match("ushers"))
+
+    graph = load_story()
+    print(f"剧情《{graph.name}》共 {len(graph.nodes)} 个节点")
+    for inputs in (["仔细观察房间", "查看日记", "念出咒语"], ["寻找出口", "探索其他出路", "离开"]):
+        state_manager = GameStateManager()
+        state_manager.create_new_game("测试玩家", seed=1)
+        for player_input in inputs:
+            result = graph.advance(player_input, state_manager)
+            print(f"{player_input} -> {result['scene_id']} 结束={result['is_end']} 生命={state_manager.player.health}")
+        print("背包:", state_manager.player.inventory)
@@ -0,0 +1,159 @@
+# 本地抽取式剧情摘要：在进程内按句子打分挑选关键句，毫秒级完成，历史不长时代替模型摘要，模型失败时作为回退
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+_SENTENCE = re.compile(r"[^。！？!?\n]+(?:[。！？!?]+[”」』\"]?)?")
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+# 引号、书名号中的内容多为人名、地名和物品名
+_QUOTED = re.compile(r"[“「『《]([^”」』》]{1,12})[”」』》]")
+
+DEFAULT_SUMMARIZER = {
+    "max_chars": 150,           # 摘要长度上限（字）
+    "local_budget": 2000,       # 历史不超过该长度时直接使用本地摘要，不调用模型；0为总是调用模型
+    "precompress_chars": 600,   # 历史超过local_budget时，先抽取到该长度再交给模型摘要；0为不预压缩
+    "window": 80,               # 只对最近的若干句打分
+    "recency_decay": 0.95,      # 每早一句的时间权重衰减
+    "recency_floor": 0.3,       # 时间权重下限，较早的关键句仍可入选
+    "salience_weight": 0.5,     # 每命中一个物品/人名的加权
+    "redundancy": 0.7           # 与已选句子的相似度超过该值时跳过
+}
+
+
+def split_sentences(text: str) -> List[str]:
+    """按“。！？”和换行切分句子，保留句末标点"""
+    return [s.strip() for s in _SENTENCE.findall(text) if len(s.strip()) > 1]
+
+
+def _terms(sentence: str) -> Counter:
+    """中文没有分词器时以字二元组作为词项"""
+    chars = _NON_WORD.sub("", sentence.lower())
+    if len(chars) < 2:
+        return Counter(chars)
+    return Counter(chars[i:i + 2] for i in range(len(chars) - 1))
+
+
+def _cosine(a: Dict[str, float], b: Dict[str, float], norm_a: float, norm_b: float) -> float:
+    if not norm_a or not norm_b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b[t] for t, w in a.items() if t in b) / (norm_a * norm_b)
+
+
+class ExtractiveSummarizer:
+    """TF-IDF加权的TextRank抽取式摘要，按时间远近和物品、人名命中调整句子得分"""
+
+    def __init__(self, **options: Any):
+        self.options = {**DEFAULT_SUMMARIZER, **options}
+        self._lock = threading.Lock()
+        # local/llm/fallback为各来源的摘要次数，runs与local_ms为本地抽取的次数与总耗时
+        self.stats = {'local': 0, 'llm': 0, 'fallback': 0, 'precompressed': 0, 'runs': 0, 'local_ms': 0.0}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'ExtractiveSummarizer':
+        """从config.json的summarizer配置创建"""
+        return cls(**(config.get("summarizer") or {}))
+
+    def fits(self, history: str) -> bool:
+        """历史足够短，直接使用本地摘要"""
+        return len(history) <= self.options["local_budget"]
+
+    def summarize(self, text: str, max_chars: Optional[int] = None, salient: Iterable[str] = ()) -> str:
+        """抽取不超过max_chars字的关键句，按原文顺序拼接"""
+        start = time.perf_counter()
+        max_chars = max_chars or self.options["max_chars"]
+        result = text.strip() if len(text.strip()) <= max_chars else self._extract(text, max_chars, salient)
+        with self._lock:
+            self.stats['runs'] += 1
+            self.stats['local_ms'] += (time.perf_counter() - start) * 1000
+        return result
+
+    def compress(self, text: str, salient: Iterable[str] = ()) -> str:
+        """模型摘要前的预压缩，未开启或文本不长时原样返回"""
+        limit = self.options["precompress_chars"]
+        if not limit or len(text) <= limit:
+            return text
+        self.record('precompressed')
+        return self.summarize(text, limit, salient)
+
+    def record(self, kind: str) -> None:
+        """记录一次摘要的来源：local/llm/fallback/precompressed"""
+        with self._lock:
+            self.stats[kind] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['avg_local_ms'] = round(stats['local_ms'] / stats['runs'], 3) if stats['runs'] else 0.0
+        stats['local_ms'] = round(stats['local_ms'], 2)
+        return stats
+
+    def _scores(self, sentences: List[str], vectors: List[Dict[str, float]], norms: List[float],
+                salient: List[str]) -> List[float]:
+        n = len(sentences)
+        similarity = [[0.0] * n for _ in range(n)]
+        for i in range(n):
+            for j in range(i + 1, n):
+                similarity[i][j] = similarity[j][i] = _cosine(vectors[i], vectors[j], norms[i], norms[j])
+        # TextRank：按句子间相似度迭代传播重要性
+        out_weight = [sum(row) for row in similarity]
+        # 只保留有相似度的边，每条边的权重预先除以出度
+        edges = [[(j, similarity[j][i] / out_weight[j]) for j in range(n) if similarity[j][i]] for i in range(n)]
+        rank = [1.0] * n
+        for _ in range(20):
+            rank = [0.15 + 0.85 * sum(w * rank[j] for j, w in incoming) for incoming in edges]
+        decay, floor, weight = (self.options["recency_decay"], self.options["recency_floor"],
+                                self.options["salience_weight"])
+        scores = []
+        for i, sentence in enumerate(sentences):
+            recency = floor + (1 - floor) * decay ** (n - 1 - i)
+            hits = sum(1 for term in salient if term in sentence)
+            scores.append(rank[i] * recency * (1 + weight * min(hits, 3)))
+        return scores
+
+    def _extract(self, text: str, max_chars: int, salient: Iterable[str]) -> str:
+        sentences = split_sentences(text)[-self.options["window"]:]
+        if not sentences:
+            return text.strip()[-max_chars:]
+        salient = [term for term in {*salient, *_QUOTED.findall(text)} if term]
+        counts = [_terms(s) for s in sentences]
+        df = Counter(term for c in counts for term in c)
+        idf = {term: math.log((len(sentences) + 1) / (freq + 1)) + 1 for term, freq in df.items()}
+        vectors = [{term: tf * idf[term] for term, tf in c.items()} for c in counts]
+        norms = [math.sqrt(sum(w * w for w in v.values())) for v in vectors]
+        scores = self._scores(sentences, vectors, norms, salient)
+
+        chosen: List[int] = []
+        remaining = max_chars
+        for i in sorted(range(len(sentences)), key=lambda k: scores[k], reverse=True):
+            if len(sentences[i]) > remaining:
+                continue
+            if any(_cosine(vectors[i], vectors[j], norms[i], norms[j]) > self.options["redundancy"] for j in chosen):
+                continue
+            chosen.append(i)
+            remaining -= len(sentences[i])
+        if not chosen:
+            best = max(range(len(sentences)), key=lambda k: scores[k])
+            return sentences[best][:max_chars - 1] + "…"
+        return "".join(sentences[i] for i in sorted(chosen))
+
+
+if __name__ == "__main__":
+    history = "\n".join([
+        "你站在迷雾森林的入口，老猎人“格林”警告你不要在夜里深入。",
+        "你在林间小屋找到一把生锈的铜钥匙。屋里空无一人！",
+        "一条岔路出现在眼前，左边传来流水声，右边隐约有火光。",
+        "你沿着流水声走到地下湖边，湖面倒映着洞顶的晶石。",
+        "格林从暗处现身，他说湖底沉睡着古老的守护者。你必须用铜钥匙打开湖心祭坛？",
+        "守护者苏醒了，湖水开始翻涌。你握紧铜钥匙，准备迎接战斗。"
+    ] * 15)
+    summarizer = ExtractiveSummarizer()
+    start = time.perf_counter()
+    summary = summarizer.summarize(history, salient=["铜钥匙"])
+    print(f"{(time.perf_counter() - start) * 1000:.1f}ms", len(history), "->", len(summary))
+    print(summary)
+    print(summarizer.get_stats())
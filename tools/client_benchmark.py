@@ -0,0 +1,140 @@
+# 模型客户端微基准：对比LangChain与原生客户端的单次调用开销和内存占用，并校验两者输出一致
+# 使用本地模拟的Ollama服务，不需要真实模型
+# 用法：python -m tools.client_benchmark [--calls 200] [--chunks 64]
+import argparse
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_RESPONSE_TEXT = json.dumps({
+    "description": "你站在一座古老的石门前，门上刻满了神秘符号，周围弥漫着淡淡的蓝色光芒。",
+    "options": [
+        {"text": "推开石门", "event": "none"},
+        {"text": "研究符号", "event": "add_experience:10"},
+        {"text": "原路返回", "event": "none"}
+    ]
+}, ensure_ascii=False)
+
+
+def _make_handler(chunks: int, requests_log: list):
+    size = max(1, len(_RESPONSE_TEXT) // chunks)
+    pieces = [_RESPONSE_TEXT[i:i + size] for i in range(0, len(_RESPONSE_TEXT), size)]
+
+    class FakeOllamaHandler(BaseHTTPRequestHandler):
+        """模拟Ollama /api/generate的NDJSON流式响应"""
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            # 与Ollama（Go标准库默认开启TCP_NODELAY）保持一致，避免测出的是Nagle算法的延迟
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def _write_chunk(self, data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            requests_log.append(json.loads(self.rfile.read(length)))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for piece in pieces:
+                self._write_chunk((json.dumps({"response": piece, "done": False}, ensure_ascii=False) + "\n").encode("utf-8"))
+            self._write_chunk((json.dumps({"response": "", "done": True, "context": [1, 2, 3], "eval_count": len(pieces)}) + "\n").encode("utf-8"))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return FakeOllamaHandler
+
+
+# 在独立子进程中运行，保证导入开销和内存互不影响
+_WORKER = """
+import json, resource, statistics, sys, time, tracemalloc
+client, base_url, calls = sys.argv[1], sys.argv[2], int(sys.argv[3])
+params = {"temperature": 0.8, "num_predict": 600, "num_ctx": 2048, "keep_alive": "30m"}
+prompt = "剧情摘要：测试\\n玩家操作：开门"
+tracemalloc.start()
+start = time.perf_counter()
+from llm_router import BACKEND_CLIENTS
+backend = BACKEND_CLIENTS[client]("bench", base_url, "llama3")
+text = "".join(backend.stream(prompt, metadata={}, **params))
+setup_ms = (time.perf_counter() - start) * 1000
+setup_kb = tracemalloc.get_traced_memory()[0] / 1024
+samples, peaks = [], []
+for _ in range(calls):
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    call_start = time.perf_counter()
+    "".join(backend.stream(prompt, metadata={}, **params))
+    samples.append((time.perf_counter() - call_start) * 1000)
+    peaks.append((tracemalloc.get_traced_memory()[1] - base) / 1024)
+print(json.dumps({
+    "text": text,
+    "setup_ms": setup_ms,
+    "setup_kb": setup_kb,
+    "call_ms": statistics.mean(samples),
+    "call_p50_ms": statistics.median(samples),
+    "call_peak_kb": statistics.mean(peaks),
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+}))
+"""
+
+
+def run_worker(client: str, base_url: str, calls: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", _WORKER, client, base_url, str(calls)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="对比LangChain与原生Ollama客户端的调用开销")
+    parser.add_argument("--calls", type=int, default=200, help="每个客户端的调用次数")
+    parser.add_argument("--chunks", type=int, default=64, help="每次响应的流式消息数")
+    args = parser.parse_args()
+
+    requests_log: list = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(args.chunks, requests_log))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    results = {}
+    payloads = {}
+    for client in ("langchain", "native"):
+        requests_log.clear()
+        results[client] = run_worker(client, base_url, args.calls)
+        payloads[client] = requests_log[0]
+    server.shutdown()
+
+    print(f"{'客户端':<10}{'初始化ms':>10}{'初始化KB':>10}{'单次ms':>9}{'中位数ms':>10}{'单次峰值KB':>12}{'RSS MB':>9}")
+    for client, r in results.items():
+        print(f"{client:<12}{r['setup_ms']:>10.1f}{r['setup_kb']:>10.0f}{r['call_ms']:>10.3f}"
+              f"{r['call_p50_ms']:>10.3f}{r['call_peak_kb']:>12.1f}{r['max_rss_mb']:>9.1f}")
+
+    # 输出一致性：生成文本相同，发给Ollama的有效参数相同（LangChain会额外发送值为null的参数，且不显式发送stream）
+    def effective(payload: dict) -> dict:
+        options = {k: v for k, v in (payload.get("options") or {}).items() if v is not None}
+        top = {k: v for k, v in payload.items() if v is not None and k != "options"}
+        top.setdefault("stream", True)
+        return {**top, "options": options}
+
+    same_text = results["langchain"]["text"] == results["native"]["text"]
+    same_payload = effective(payloads["langchain"]) == effective(payloads["native"])
+    print(f"\n输出一致：{'是' if same_text else '否'}；请求参数一致：{'是' if same_payload else '否'}")
+    if not same_payload:
+        print("langchain:", effective(payloads["langchain"]))
+        print("native:   ", effective(payloads["native"]))
+    return 0 if same_text and same_payload else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
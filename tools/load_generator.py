@@ -0,0 +1,350 @@
+# 并发玩家压测：模拟N个玩家按比例进行回合、存档、读档、回退，统计吞吐、延迟分位数、错误率和内存，可选通过Streamlit AppTest驱动web页面
+# 用法：python -m tools.load_generator --players 50 --duration 60 --engine stub --stub-latency 0.5
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+from game_engine import GameEngine
+from state_manager import GameStateManager
+from tools.stub_model import StubScenePrompt
+
+DEFAULT_MIX = "turn=0.85,save=0.05,load=0.05,back=0.05"
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """解析动作比例，如 turn=0.85,save=0.05"""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(len(ordered) * pct))
+    return ordered[index]
+
+
+class LoadStats:
+    """各类动作的耗时、错误与回退计数，多线程共享"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.error_samples: List[str] = []
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def record(self, action: str, latency: float, error: Exception = None, fallback: bool = False) -> None:
+        with self._lock:
+            self.latencies[action].append(latency)
+            if error is not None:
+                self.errors[action] += 1
+                if len(self.error_samples) < 10:
+                    self.error_samples.append(f"{action}: {error!r}")
+            if fallback:
+                self.fallbacks += 1
+
+    def dump(self) -> Dict[str, Any]:
+        """导出原始统计，用于跨进程汇总"""
+        with self._lock:
+            return {
+                'latencies': dict(self.latencies),
+                'errors': dict(self.errors),
+                'error_samples': list(self.error_samples),
+                'fallbacks': self.fallbacks
+            }
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        """合并其他进程导出的统计"""
+        with self._lock:
+            for action, samples in data['latencies'].items():
+                self.latencies[action].extend(samples)
+            self.errors.update(data['errors'])
+            self.error_samples.extend(data['error_samples'][:max(0, 10 - len(self.error_samples))])
+            self.fallbacks += data['fallbacks']
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(len(v) for v in self.latencies.values())
+            turns = len(self.latencies.get("turn", []))
+            actions = {}
+            for action, samples in sorted(self.latencies.items()):
+                actions[action] = {
+                    'count': len(samples),
+                    'errors': self.errors[action],
+                    'p50_ms': round(percentile(samples, 0.5) * 1000, 1),
+                    'p95_ms': round(percentile(samples, 0.95) * 1000, 1),
+                    'p99_ms': round(percentile(samples, 0.99) * 1000, 1),
+                    'max_ms': round(max(samples) * 1000, 1)
+                }
+            return {
+                'elapsed': round(elapsed, 2),
+                'actions_per_second': round(total / elapsed, 2),
+                'turns_per_second': round(turns / elapsed, 2),
+                'error_rate': round(sum(self.errors.values()) / total, 4) if total else 0.0,
+                'fallback_rate': round(self.fallbacks / turns, 4) if turns else 0.0,
+                'actions': actions,
+                'error_samples': list(self.error_samples)
+            }
+
+
+class EnginePlayer:
+    """直接调用GameEngine/GameStateManager的虚拟玩家，每个玩家持有自己的引擎，与web端每个会话一个引擎一致"""
+
+    def __init__(self, index: int, engine_factory: Callable[[], GameEngine], save_directory: str, rng: random.Random):
+        self.name = f"player_{index}"
+        self.engine = engine_factory()
+        self.state_manager = GameStateManager(save_directory=save_directory)
+        self.rng = rng
+        self.has_save = False
+
+    def new_game(self) -> bool:
+        self.state_manager.create_new_game(self.name, seed=self.rng.randrange(2 ** 32))
+        self.engine.start_new_game(self.state_manager)
+        return False
+
+    def turn(self) -> bool:
+        """进行一个回合，返回是否回退到了预设剧情"""
+        if self.state_manager.story.is_ended or not self.state_manager.story.current_options:
+            self.new_game()
+        option = self.rng.choice(self.state_manager.story.current_options)
+        result = self.engine.play_turn(option, self.state_manager)
+        next_state = result['next_state'] or {}
+        # AI模式下生成失败会回退到预设剧情，场景id不再以ai_scene_开头
+        return self.engine.use_ai_generation and not str(next_state.get('scene_id', '')).startswith('ai_scene_')
+
+    def save(self) -> bool:
+        if not self.state_manager.save_game(self.name):
+            raise RuntimeError("存档失败")
+        self.has_save = True
+        return False
+
+    def load(self) -> bool:
+        if not self.has_save:
+            return self.save()
+        if not self.state_manager.load_game(self.name):
+            raise RuntimeError("读档失败")
+        return False
+
+    def back(self) -> bool:
+        self.engine.undo(self.state_manager)
+        return False
+
+
+class WebPlayer:
+    """通过Streamlit AppTest驱动app.py的虚拟玩家，只支持页面上存在的操作（新游戏、选项、存档）"""
+
+    def __init__(self, index: int, engine_factory: Callable[[], GameEngine], save_directory: str, rng: random.Random,
+                 app_path: str = "app.py", timeout: float = 120.0):
+        from streamlit.testing.v1 import AppTest
+        self.name = f"player_{index}"
+        self.rng = rng
+        self.at = AppTest.from_file(os.path.abspath(app_path), default_timeout=timeout)
+        self.at.session_state["engine"] = engine_factory()
+        self.at.session_state["state_manager"] = GameStateManager(save_directory=save_directory)
+        self.at.run()
+
+    def _click(self, label: str = None, key: str = None) -> None:
+        button = next(b for b in self.at.button if (key and b.key == key) or (label and b.label == label))
+        button.click().run()
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+
+    def _wait_for_turn(self) -> None:
+        # 回合在后台线程中生成，页面轮询直到结果出现
+        while self.at.session_state["turn_pending"]:
+            time.sleep(0.005)
+            self.at.run()
+
+    def new_game(self) -> bool:
+        self.at.session_state["menu_mode"] = "new_game"
+        self.at.run()
+        self.at.text_input[0].input(self.name)
+        self._click(label="开始冒险")
+        self._wait_for_turn()
+        return False
+
+    def turn(self) -> bool:
+        state_manager = self.at.session_state["state_manager"]
+        if not self.at.session_state["game_started"] or not state_manager.story.current_options:
+            self.new_game()
+            state_manager = self.at.session_state["state_manager"]
+        self._click(key=f"opt_{self.rng.randrange(len(state_manager.story.current_options))}")
+        self._wait_for_turn()
+        engine = self.at.session_state["engine"]
+        return engine.use_ai_generation and not state_manager.story.current_scene_id.startswith('ai_scene_')
+
+    def save(self) -> bool:
+        if not self.at.session_state["game_started"]:
+            return self.turn()
+        self._click(label="保存游戏")
+        self.at.text_input(key="save_name").input(self.name)
+        self._click(label="确认保存")
+        return False
+
+
+def make_engine(kind: str, stub_latency: float) -> GameEngine:
+    """按压测模式创建引擎：preset为预设剧情，stub为桩模型，ai为真实模型"""
+    if kind == "stub":
+        return GameEngine(scene_prompt=StubScenePrompt(latency=stub_latency))
+    engine = GameEngine()
+    engine.toggle_ai_generation(kind == "ai")
+    return engine
+
+
+def run_player(player_factory: Callable[[], Any], mix: Dict[str, float], stats: LoadStats, deadline: float,
+               think_time: float, rng: random.Random, stop_event: threading.Event) -> None:
+    """单个虚拟玩家的主循环：新游戏后按动作比例执行，动作之间有思考时间"""
+    try:
+        player = player_factory()
+        start = time.perf_counter()
+        player.new_game()
+        stats.record("new_game", time.perf_counter() - start)
+    except Exception as e:
+        stats.record("new_game", 0.0, error=e)
+        return
+    actions = [a for a in mix if hasattr(player, a)]
+    weights = [mix[a] for a in actions]
+    while not stop_event.is_set() and time.time() < deadline:
+        action = rng.choices(actions, weights)[0]
+        start = time.perf_counter()
+        try:
+            fallback = getattr(player, action)()
+            stats.record(action, time.perf_counter() - start, fallback=bool(fallback))
+        except Exception as e:
+            stats.record(action, time.perf_counter() - start, error=e)
+        if think_time > 0:
+            # 思考时间在平均值的0.5到1.5倍之间随机
+            stop_event.wait(think_time * rng.uniform(0.5, 1.5))
+
+
+def _web_worker(index: int, engine_kind: str, stub_latency: float, save_directory: str, seed: int,
+                mix: Dict[str, float], start_at: float, deadline: float, think_time: float) -> Dict[str, Any]:
+    """在独立进程中运行一个web虚拟玩家（AppTest不能在同一进程的多个线程中同时运行），返回原始统计"""
+    stats = LoadStats()
+    rng = random.Random(seed)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        time.sleep(max(0.0, start_at - time.time()))
+        factory = lambda: WebPlayer(index, lambda: make_engine(engine_kind, stub_latency), save_directory, rng)
+        run_player(factory, mix, stats, deadline, think_time, rng, threading.Event())
+    return stats.dump()
+
+
+def memory_usage_mb(children: bool = False) -> Dict[str, float]:
+    usage = {'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if children:
+        # web模式下每个玩家一个进程，这里是其中最大的常驻内存
+        usage['max_child_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    if tracemalloc.is_tracing():
+        usage['traced_mb'] = round(tracemalloc.get_traced_memory()[0] / 1024 / 1024, 2)
+    return usage
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="模拟多个并发玩家，测量单机可支撑的玩家数量")
+    parser.add_argument("--players", type=int, default=20, help="并发玩家数")
+    parser.add_argument("--duration", type=float, default=60.0, help="压测时长（秒，包含爬坡时间）")
+    parser.add_argument("--ramp-up", type=float, default=10.0, help="所有玩家在这段时间内依次加入（秒）")
+    parser.add_argument("--think-time", type=float, default=2.0, help="两次操作之间的平均思考时间（秒）")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="动作比例，可选turn/save/load/back（web模式只支持turn/save）")
+    parser.add_argument("--engine", choices=["preset", "stub", "ai"], default="stub",
+                        help="preset为预设剧情，stub为桩模型，ai为config.json中配置的真实模型")
+    parser.add_argument("--stub-latency", type=float, default=0.5, help="桩模型每次调用的模拟耗时（秒）")
+    parser.add_argument("--web", action="store_true", help="通过Streamlit AppTest驱动app.py，每个玩家一个进程（需要安装streamlit）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="中间结果输出间隔（秒，web模式只输出最终结果）")
+    parser.add_argument("--tracemalloc", action="store_true", help="用tracemalloc统计Python堆内存（有额外开销）")
+    parser.add_argument("--out", help="把中间与最终结果以JSONL追加写入该文件")
+    args = parser.parse_args(argv)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    mix = parse_mix(args.mix)
+    stats = LoadStats()
+    stop_event = threading.Event()
+    memory_before = memory_usage_mb()
+    real_stdout = sys.stdout
+    out = open(args.out, "a", encoding="utf-8") if args.out else None
+
+    def emit(record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        print(line, file=real_stdout)
+        if out:
+            out.write(line + "\n")
+            out.flush()
+
+    started = time.time()
+    deadline = started + args.duration
+    with tempfile.TemporaryDirectory() as save_directory:
+        if args.web:
+            with ProcessPoolExecutor(max_workers=args.players) as executor:
+                futures = [
+                    executor.submit(
+                        _web_worker, i, args.engine, args.stub_latency, save_directory, args.seed * 100003 + i,
+                        mix, started + args.ramp_up * i / max(1, args.players), deadline, args.think_time
+                    )
+                    for i in range(args.players)
+                ]
+                for future in as_completed(futures):
+                    try:
+                        stats.merge(future.result())
+                    except Exception as e:
+                        stats.record("new_game", 0.0, error=e)
+        else:
+            # 引擎与存档会打印提示信息，压测时丢弃
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                threads = []
+                try:
+                    for i in range(args.players):
+                        rng = random.Random(args.seed * 100003 + i)
+                        factory = (lambda i=i, rng=rng: EnginePlayer(
+                            i, lambda: make_engine(args.engine, args.stub_latency), save_directory, rng))
+                        thread = threading.Thread(
+                            target=run_player,
+                            args=(factory, mix, stats, deadline, args.think_time, rng, stop_event),
+                            name=f"load-player-{i}", daemon=True
+                        )
+                        # 爬坡：玩家按固定间隔依次加入
+                        delay = started + args.ramp_up * i / max(1, args.players) - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+                        thread.start()
+                        threads.append(thread)
+                    next_report = started + args.report_interval
+                    while any(t.is_alive() for t in threads):
+                        for t in threads:
+                            t.join(timeout=0.2)
+                        if time.time() >= next_report and any(t.is_alive() for t in threads):
+                            next_report += args.report_interval
+                            emit({'interim': True, 'active_players': sum(t.is_alive() for t in threads),
+                                  **stats.report(time.time() - started), **memory_usage_mb()})
+                except KeyboardInterrupt:
+                    stop_event.set()
+    emit({
+        'players': args.players,
+        'engine': args.engine,
+        'web': args.web,
+        **stats.report(time.time() - started),
+        'memory_before': memory_before,
+        'memory_after': memory_usage_mb(children=args.web)
+    })
+    if out:
+        out.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# 会话回放：把录制的真实对局（模型响应、玩家输入、随机种子）重新送入GameEngine，不需要模型即可复现和分析性能
+# 用法：python -m tools.replay_session cassettes/session.jsonl [--game GAME_ID] [--latency-scale 0]
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from game_engine import GameEngine
+from llm_cassette import CassettePlayer
+from prompts.scene_prompt import ScenePrompt
+from state_manager import GameStateManager
+
+
+def replay_game(engine: GameEngine, player: CassettePlayer, game_id: str, save_directory: str) -> Dict[str, Any]:
+    """按录制的种子与输入重放一局游戏，返回每回合耗时以及与录制结果的比对"""
+    game = player.games[game_id]
+    state_manager = GameStateManager(save_directory=save_directory)
+    state_manager.create_new_game(game['player_name'], seed=game['seed'])
+    state_manager.game_metadata['game_id'] = game_id
+
+    start = time.perf_counter()
+    engine.start_new_game(state_manager, theme=game['theme'])
+    turn_times = [time.perf_counter() - start]
+    for player_input in player.turns[game_id]:
+        start = time.perf_counter()
+        engine.play_turn(player_input, state_manager)
+        turn_times.append(time.perf_counter() - start)
+
+    result = {
+        'game_id': game_id,
+        'turns': len(player.turns[game_id]),
+        'total_ms': round(sum(turn_times) * 1000, 1),
+        'median_turn_ms': round(statistics.median(turn_times) * 1000, 1),
+        'max_turn_ms': round(max(turn_times) * 1000, 1),
+        'ending': state_manager.story.ending_type
+    }
+    recorded = player.endings.get(game_id)
+    if recorded:
+        final = state_manager.player
+        result['matches_recording'] = (
+            recorded['ending'] == state_manager.story.ending_type
+            and recorded['health'] == final.health
+            and recorded['experience'] == final.experience
+            and recorded['inventory'] == list(final.inventory)
+        )
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="回放录制的对局")
+    parser.add_argument("cassette", help="录制得到的磁带文件")
+    parser.add_argument("--game", help="只回放指定game_id的对局")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="模型耗时缩放：1为原速，0为不等待")
+    parser.add_argument("--config", default="config.json", help="与录制时一致的配置文件")
+    parser.add_argument("--quiet", action="store_true", help="不显示引擎打印的事件提示")
+    args = parser.parse_args(argv)
+
+    player = CassettePlayer(args.cassette, args.latency_scale)
+    engine = GameEngine(scene_prompt=ScenePrompt(args.config, cassette=player))
+    game_ids = [args.game] if args.game else list(player.games)
+
+    mismatched = 0
+    with tempfile.TemporaryDirectory() as save_directory, open(os.devnull, "w") as devnull:
+        for game_id in game_ids:
+            with contextlib.redirect_stdout(devnull) if args.quiet else contextlib.nullcontext():
+                result = replay_game(engine, player, game_id, save_directory)
+            if result.get('matches_recording') is False:
+                mismatched += 1
+            print(json.dumps(result, ensure_ascii=False))
+    print(json.dumps({'games': len(game_ids), 'mismatched_games': mismatched, **player.stats}, ensure_ascii=False))
+    return 1 if mismatched or player.stats['prompt_mismatches'] or player.stats['exhausted'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+# 存档垃圾回收：按存档目录中的存档文件重建内容块的引用计数，删除不再被任何存档引用的块
+# 用法：python -m tools.save_gc [--dir saves] [--dry-run] [--migrate]
+import argparse
+import contextlib
+import json
+import os
+import sys
+from typing import List, Optional
+
+from state_manager import GameStateManager
+
+
+def migrate_legacy(state_manager: GameStateManager, names: List[str]) -> int:
+    """把历史节点直接写在存档文件中的旧存档重新保存为块存储格式，返回成功的数量"""
+    migrated = 0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name in names:
+            if state_manager.load_game(name) and state_manager.save_game(name):
+                migrated += 1
+    return migrated
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="清理存档目录中未被引用的内容块")
+    parser.add_argument("--dir", default="saves", help="存档目录")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不删除")
+    parser.add_argument("--migrate", action="store_true", help="先把旧格式存档转换为块存储格式")
+    args = parser.parse_args(argv)
+
+    state_manager = GameStateManager(save_directory=args.dir)
+    before = state_manager.store.usage()
+    result = state_manager.collect_garbage(dry_run=True)
+    if args.migrate and result['legacy_saves'] and not args.dry_run:
+        result['migrated'] = migrate_legacy(state_manager, result['legacy_saves'])
+    if not args.dry_run:
+        result.update(state_manager.collect_garbage())
+    result['before'] = before
+    result['after'] = state_manager.store.usage()
+    print(json.dumps(result, ensure_ascii=False))
+    return 1 if result['missing'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+# 无界面游戏模拟器：用可替换的玩家策略在预设剧情或桩模型上批量对局，多进程并行，汇总统计持续写入JSONL
+# 用法：python -m tools.simulator --games 100000 --engine preset --policy random --out sim_stats.jsonl
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+from game_engine import GameEngine
+from state_manager import GameStateManager
+from tools.stub_model import StubScenePrompt
+
+# 贪心策略对选项事件的即时收益估计
+_EVENT_SCORES = {"heal": 1.0, "damage": -1.5, "add_item": 8.0, "remove_item": -8.0, "add_experience": 0.5}
+# 预设剧情中没有事件标签，按关键词估计收益（与generate_preset_story的分支一致）
+_KEYWORD_SCORES = {"观察": 10.0, "环顾": 10.0, "日记": 15.0, "回忆": 5.0, "出口": -15.0}
+
+
+class RandomPolicy:
+    """随机选择一个选项"""
+
+    def choose(self, state: Dict[str, Any], turn: int, rng: random.Random) -> str:
+        return rng.choice(state['options'])
+
+
+class GreedyPolicy:
+    """选择即时收益最高的选项，生命值低时优先治疗"""
+
+    def score(self, option: str, event: str, health: int) -> float:
+        score = sum(value for keyword, value in _KEYWORD_SCORES.items() if keyword in option)
+        kind, _, value = (event or "none").partition(":")
+        if kind in ("heal", "damage", "add_experience"):
+            amount = int(value) if value.isdigit() else 0
+            weight = 3.0 if kind == "heal" and health < 40 else 1.0
+            score += _EVENT_SCORES[kind] * amount * weight
+        elif kind in _EVENT_SCORES:
+            score += _EVENT_SCORES[kind]
+        return score
+
+    def choose(self, state: Dict[str, Any], turn: int, rng: random.Random) -> str:
+        options = state['options']
+        events = state.get('option_events') or []
+        health = state['player_status']['health']
+        scores = [self.score(opt, events[i] if i < len(events) else "none", health) for i, opt in enumerate(options)]
+        best = max(scores)
+        return rng.choice([opt for opt, score in zip(options, scores) if score == best])
+
+
+class ScriptedPolicy:
+    """按脚本依次输入；脚本项是某个选项的子串时选该选项，否则原样作为自由输入，脚本用完后选第一个选项"""
+
+    def __init__(self, script: List[str]):
+        self.script = script
+
+    def choose(self, state: Dict[str, Any], turn: int, rng: random.Random) -> str:
+        if turn >= len(self.script):
+            return state['options'][0]
+        step = self.script[turn]
+        return next((opt for opt in state['options'] if step in opt), step)
+
+
+def make_policy(name: str, script: List[str] = None):
+    if name == "random":
+        return RandomPolicy()
+    if name == "greedy":
+        return GreedyPolicy()
+    if name == "scripted":
+        return ScriptedPolicy(script or [])
+    raise ValueError(f"未知策略: {name}")
+
+
+def play_game(engine_kind: str, policy, seed: int, max_turns: int, save_directory: str) -> Dict[str, Any]:
+    """完整进行一局游戏，返回结局、步数、生命值曲线和物品"""
+    # 策略与引擎的随机事件分别使用独立的生成器，按局设置种子保证可复现
+    rng = random.Random(seed)
+    if engine_kind == "stub":
+        engine = GameEngine(scene_prompt=StubScenePrompt(random.Random(~seed)))
+    else:
+        engine = GameEngine()
+        engine.toggle_ai_generation(False)
+    state_manager = GameStateManager(save_directory=save_directory)
+    state_manager.create_new_game(seed=seed)
+    engine.start_new_game(state_manager)
+
+    health_curve = [state_manager.player.health]
+    turns = 0
+    while not state_manager.story.is_ended and turns < max_turns:
+        state = state_manager.get_current_state()
+        if not state['options']:
+            break
+        engine.play_turn(policy.choose(state, turns, rng), state_manager)
+        turns += 1
+        health_curve.append(state_manager.player.health)
+
+    player = state_manager.player
+    return {
+        'ending': state_manager.story.ending_type if state_manager.story.is_ended else "unfinished",
+        'turns': turns,
+        'health_curve': health_curve,
+        'items': list(player.inventory),
+        'level': player.level,
+        'experience': player.experience
+    }
+
+
+def new_stats() -> Dict[str, Any]:
+    return {
+        'games': 0,
+        'endings': Counter(),
+        'turns': Counter(),
+        'health_sum': [],
+        'health_count': [],
+        'inventory_sizes': Counter(),
+        'items': Counter(),
+        'levels': Counter(),
+        'experience_sum': 0
+    }
+
+
+def add_game(stats: Dict[str, Any], result: Dict[str, Any]) -> None:
+    stats['games'] += 1
+    stats['endings'][result['ending']] += 1
+    stats['turns'][result['turns']] += 1
+    for i, health in enumerate(result['health_curve']):
+        if i == len(stats['health_sum']):
+            stats['health_sum'].append(0)
+            stats['health_count'].append(0)
+        stats['health_sum'][i] += health
+        stats['health_count'][i] += 1
+    stats['inventory_sizes'][len(result['items'])] += 1
+    stats['items'].update(result['items'])
+    stats['levels'][result['level']] += 1
+    stats['experience_sum'] += result['experience']
+
+
+def merge_stats(total: Dict[str, Any], part: Dict[str, Any]) -> None:
+    total['games'] += part['games']
+    total['experience_sum'] += part['experience_sum']
+    for key in ('endings', 'turns', 'inventory_sizes', 'items', 'levels'):
+        total[key].update(part[key])
+    for i, (health, count) in enumerate(zip(part['health_sum'], part['health_count'])):
+        if i == len(total['health_sum']):
+            total['health_sum'].append(0)
+            total['health_count'].append(0)
+        total['health_sum'][i] += health
+        total['health_count'][i] += count
+
+
+def summarize(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """把累计统计转换为可读的分布与均值"""
+    games = stats['games'] or 1
+    return {
+        'games': stats['games'],
+        'ending_rates': {k: round(v / games, 4) for k, v in stats['endings'].most_common()},
+        'death_rate': round(stats['endings'].get("dead", 0) / games, 4),
+        'mean_turns': round(sum(t * n for t, n in stats['turns'].items()) / games, 3),
+        'turns_histogram': dict(sorted(stats['turns'].items())),
+        'mean_health_by_turn': [round(h / c, 2) for h, c in zip(stats['health_sum'], stats['health_count'])],
+        'mean_inventory_size': round(sum(s * n for s, n in stats['inventory_sizes'].items()) / games, 3),
+        'top_items': dict(stats['items'].most_common(10)),
+        'level_distribution': dict(sorted(stats['levels'].items())),
+        'mean_experience': round(stats['experience_sum'] / games, 2)
+    }
+
+
+def run_chunk(engine_kind: str, policy_name: str, script: List[str], seeds: range, max_turns: int) -> Dict[str, Any]:
+    """在工作进程中连续模拟一批对局，只返回汇总结果以减少进程间传输"""
+    stats = new_stats()
+    policy = make_policy(policy_name, script)
+    with tempfile.TemporaryDirectory() as save_directory, open(os.devnull, "w") as devnull:
+        # 引擎会打印事件提示，模拟时丢弃
+        with contextlib.redirect_stdout(devnull):
+            for seed in seeds:
+                add_game(stats, play_game(engine_kind, policy, seed, max_turns, save_directory))
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="无界面批量模拟对局并统计剧情平衡性")
+    parser.add_argument("--games", type=int, default=10000, help="对局总数")
+    parser.add_argument("--engine", choices=["preset", "stub"], default="preset", help="预设剧情或桩模型驱动的AI剧情路径")
+    parser.add_argument("--policy", choices=["random", "greedy", "scripted"], default="random", help="玩家策略")
+    parser.add_argument("--script", default="", help="scripted策略的输入序列，用逗号分隔")
+    parser.add_argument("--seed", type=int, default=0, help="起始种子，第i局使用seed+i")
+    parser.add_argument("--max-turns", type=int, default=50, help="单局最多回合数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="工作进程数")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="每个任务包含的对局数")
+    parser.add_argument("--out", default="sim_stats.jsonl", help="统计输出文件，每完成一个任务追加一行累计结果")
+    args = parser.parse_args(argv)
+
+    script = [s for s in args.script.split(",") if s]
+    chunks = [
+        range(start, min(start + args.chunk_size, args.seed + args.games))
+        for start in range(args.seed, args.seed + args.games, args.chunk_size)
+    ]
+    total = new_stats()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor, open(args.out, "a", encoding="utf-8") as out:
+        futures = [
+            executor.submit(run_chunk, args.engine, args.policy, script, seeds, args.max_turns)
+            for seeds in chunks
+        ]
+        for future in as_completed(futures):
+            merge_stats(total, future.result())
+            elapsed = time.perf_counter() - started
+            record = {
+                'engine': args.engine,
+                'policy': args.policy,
+                'elapsed': round(elapsed, 2),
+                'games_per_second': round(total['games'] / elapsed, 1),
+                **summarize(total)
+            }
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            print(f"\r已完成 {total['games']}/{args.games} 局，{record['games_per_second']} 局/秒", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    print(json.dumps(record, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# 启动耗时基准：测量CLI和web入口的导入与初始化时间，超出预算或提前加载LangChain时返回非零退出码
+# 用法：python -m tools.startup_benchmark [--budget-ms 300] [--runs 5]
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# 在子进程中执行，保证每次测量都是冷启动
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "ms": elapsed * 1000,
+    "langchain_loaded": any(name == "langchain" or name.startswith(("langchain.", "langchain_")) for name in sys.modules)
+}}))
+"""
+
+# 各场景的启动代码；均不访问网络，也不会触发AI生成
+SCENARIOS = {
+    "import_main": "import main",
+    "preset_engine": (
+        "from game_engine import GameEngine\n"
+        "from state_manager import GameStateManager\n"
+        "engine = GameEngine()\n"
+        "engine.toggle_ai_generation(False)\n"
+        "engine.get_generation_status()\n"
+        "GameStateManager()"
+    ),
+    "ai_engine_init": (
+        "from game_engine import GameEngine\n"
+        "engine = GameEngine()\n"
+        "engine.scene_prompt"
+    ),
+}
+
+
+def measure(body: str, runs: int) -> dict:
+    """多次冷启动子进程，返回耗时中位数与是否加载了LangChain"""
+    samples = []
+    langchain_loaded = False
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(body=body)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        samples.append(result["ms"])
+        langchain_loaded = langchain_loaded or result["langchain_loaded"]
+    return {
+        "median_ms": round(statistics.median(samples), 1),
+        "max_ms": round(max(samples), 1),
+        "langchain_loaded": langchain_loaded
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="测量游戏启动耗时")
+    parser.add_argument("--budget-ms", type=float, default=300.0, help="每个场景导入与初始化耗时中位数的上限")
+    parser.add_argument("--runs", type=int, default=5, help="每个场景的冷启动次数")
+    args = parser.parse_args()
+
+    failed = False
+    for name, body in SCENARIOS.items():
+        result = measure(body, args.runs)
+        problems = []
+        if result["median_ms"] > args.budget_ms:
+            problems.append(f"超出预算{args.budget_ms:.0f}ms")
+        # 启动阶段任何场景都不应该导入LangChain，它只在第一次调用模型时加载
+        if result["langchain_loaded"]:
+            problems.append("启动时加载了LangChain")
+        failed = failed or bool(problems)
+        status = "；".join(problems) if problems else "通过"
+        print(f"{name:<16} 中位数 {result['median_ms']:>8.1f}ms  最大 {result['max_ms']:>8.1f}ms  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
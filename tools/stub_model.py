@@ -0,0 +1,141 @@
+# 桩模型：与ScenePrompt接口一致，用随机但合法的结构化结果代替真实模型，供模拟器和压测工具在没有模型时走完整的AI剧情路径
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from cancellation import CancelToken, DeadlinePolicy, GenerationCancelled, check_cancelled
+from summarizer import ExtractiveSummarizer
+
+_DESCRIPTIONS = [
+    "你穿过一条潮湿的石廊，墙上的火把忽明忽暗，远处传来低沉的回声。",
+    "一座坍塌的祭坛出现在眼前，碎石间散落着发光的符文碎片。",
+    "密林深处有一间废弃的小屋，门半掩着，屋内似乎有人刚刚离开。",
+    "你来到地下湖边，湖面平静如镜，倒映着洞顶闪烁的晶石。",
+    "一名披着斗篷的旅人拦住了你的去路，目光在你的背包上停留了片刻。"
+]
+_OPTION_TEXTS = [
+    "仔细观察四周", "推开石门", "跟上脚步声", "检查地上的痕迹", "与旅人交谈",
+    "绕路前进", "拾起符文碎片", "原地休息", "点燃火把", "潜入水中"
+]
+# (事件标签模板, 权重)，数值在生成时随机填入
+_EVENT_TAGS = [
+    ("none", 6),
+    ("heal:{n}", 2),
+    ("damage:{n}", 3),
+    ("add_item:{item}", 2),
+    ("add_experience:{n}", 3)
+]
+_ITEMS = ["火把", "铜钥匙", "符文碎片", "治疗药水", "旧地图"]
+# 包含stories/status_rules.json中规则的关键词
+_STATUS_CHANGES = [
+    "",
+    "获得了一件物品",
+    "获得经验，对这里有了新的理解",
+    "受伤，损失了一些生命值",
+    "得到治疗，体力恢复",
+    "发现了关键线索，这是一个重要的转折"
+]
+
+
+class StubScenePrompt:
+    """ScenePrompt的桩实现，latency为每次模型调用模拟的耗时（秒）"""
+
+    cassette = None
+    # 模拟的场景输出长度（token），限制输出长度时按比例缩短模拟耗时
+    scene_tokens = 600
+
+    def __init__(self, rng: Optional[random.Random] = None, latency: float = 0.0,
+                 turn_deadline: Optional[DeadlinePolicy] = None):
+        self.rng = rng or random.Random()
+        self.latency = latency
+        self.turn_deadline = turn_deadline or DeadlinePolicy()
+        self.calls = 0
+        self.cancelled = 0
+        # 与ScenePrompt相同的摘要策略：历史不长时用本地摘要，不模拟模型调用
+        self.summarizer = ExtractiveSummarizer()
+
+    def _call(self, cancel_token: CancelToken = None, scale: float = 1.0) -> None:
+        check_cancelled(cancel_token)
+        self.calls += 1
+        latency = self.latency * scale
+        if not latency:
+            return
+        if cancel_token is None:
+            time.sleep(latency)
+        elif cancel_token.wait(latency):
+            # 模拟的请求在等待期间被取消
+            self.cancelled += 1
+            raise GenerationCancelled(cancel_token.reason)
+
+    def _event_tag(self) -> str:
+        tags, weights = zip(*_EVENT_TAGS)
+        tag = self.rng.choices(tags, weights)[0]
+        return tag.format(n=self.rng.randint(5, 25), item=self.rng.choice(_ITEMS))
+
+    def reset_session(self, session_id: str) -> None:
+        pass
+
+    def warm_up(self, background: bool = True) -> None:
+        pass
+
+    def wait_until_ready(self, timeout: float = None) -> bool:
+        return True
+
+    def generate_scene(self, story_context: str, player_action: str = None, scene_type: str = "explore",
+                       session_id: str = None, session_anchor: str = None, latest_event: str = None,
+                       cancel_token: CancelToken = None, max_output: int = None) -> Dict[str, Any]:
+        self._call(cancel_token, min(max_output, self.scene_tokens) / self.scene_tokens if max_output else 1.0)
+        options = self.rng.sample(_OPTION_TEXTS, 3)
+        return {
+            'description': self.rng.choice(_DESCRIPTIONS),
+            'options': options,
+            'option_events': [self._event_tag() for _ in options]
+        }
+
+    def generate_event_progression(self, story_context: str, player_choice: str,
+                                   previous_events: List[str] = None,
+                                   cancel_token: CancelToken = None) -> Dict[str, Any]:
+        self._call(cancel_token)
+        return {
+            'event_result': f"你选择了{player_choice}，局势随之发生了变化。",
+            'status_changes': self.rng.choice(_STATUS_CHANGES)
+        }
+
+    def summarize_history(self, history: str, cancel_token: CancelToken = None, salient: List[str] = None,
+                          local_only: bool = False) -> str:
+        if local_only or self.summarizer.fits(history):
+            self.summarizer.record('local')
+            return self.summarizer.summarize(history, salient=salient or [])
+        self._call(cancel_token)
+        self.summarizer.record('llm')
+        return self.summarizer.compress(history, salient or [])[-150:]
+
+    def is_available(self, scene_type: str = "explore") -> bool:
+        return True
+
+    def get_circuit_status(self) -> Dict[str, Any]:
+        return {'state': 'closed', 'pools': {}}
+
+    def get_model_status(self) -> Dict[str, Any]:
+        return {'state': 'ready', 'ready': True}
+
+    def get_backend_stats(self) -> List[Dict[str, Any]]:
+        return []
+
+    def get_route_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {}
+
+    def get_hedging_stats(self) -> Dict[str, Any]:
+        return {}
+
+    def get_parse_stats(self) -> Dict[str, Any]:
+        return {}
+
+    def get_session_stats(self) -> Dict[str, Any]:
+        return {}
+
+    def get_summary_stats(self) -> Dict[str, Any]:
+        return self.summarizer.get_stats()
+
+    def get_cancellation_stats(self) -> Dict[str, Any]:
+        return {'aborted_requests': self.cancelled}
@@ -0,0 +1,367 @@
+# 后台回合生成：web页面把回合交给线程池执行，页面轮询进度；按局登记引擎与状态，刷新页面后可以重新接上正在进行的对局；
+# 返回主菜单、开始新对局或页面关闭后不再轮询时取消正在生成的回合，释放模型后端
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Set
+
+from cancellation import CancelToken, GenerationCancelled
+
+
+class TurnJob:
+    """一次后台回合生成；turn为提交时该局已完成的回合数，用于识别重复提交"""
+
+    def __init__(self, play_id: str, turn: int, description: str):
+        self.play_id = play_id
+        self.turn = turn
+        self.description = description
+        self.status = "pending"  # pending / running / done / failed / cancelled
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.collected = False
+        self.cancel_token = CancelToken()
+        self.done_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.submitted_at
+
+
+def snapshot_view(state_manager) -> Dict[str, Any]:
+    """页面渲染所需的对局状态副本"""
+    story, player = state_manager.story, state_manager.player
+    return {
+        'description': story.current_description,
+        'options': list(story.current_options),
+        'is_ended': story.is_ended,
+        'player': {
+            'name': player.name,
+            'level': player.level,
+            'experience': getattr(player, 'experience', 0),
+            'health': player.health,
+            'max_health': player.max_health,
+            'inventory': list(player.inventory),
+            'skills': dict(getattr(player, 'skills', {}) or {}),
+            'attributes': dict(getattr(player, 'attributes', {}) or {})
+        },
+        'can_go_back': state_manager.can_go_back(),
+        'can_go_forward': state_manager.can_go_forward(),
+        'can_jump': state_manager.can_go_back(2) or state_manager.can_go_forward(2),
+        'turn_history': state_manager.get_turn_history(),
+        'position': state_manager.timeline.position
+    }
+
+
+class GameEntry:
+    """登记的一局游戏：会话使用的引擎、状态管理器以及最近一次回合任务
+
+    后台回合在lock内修改state_manager，结束时发布view；页面只按view渲染，修改对局状态时同样持有lock
+    """
+
+    def __init__(self, play_id: str, engine, state_manager):
+        self.play_id = play_id
+        self.engine = engine
+        self.state_manager = state_manager
+        self.turns = 0
+        self.job: Optional[TurnJob] = None
+        self.last_access = time.monotonic()
+        self.lock = threading.RLock()
+        self.view: Dict[str, Any] = {}
+        # 显示这一局的web会话
+        self.sessions: Set[str] = set()
+
+    def publish(self) -> None:
+        """重新生成页面渲染用的快照"""
+        with self.lock:
+            self.view = snapshot_view(self.state_manager)
+
+
+class GameRegistry:
+    """进程内所有web会话共享的对局登记表与回合线程池
+
+    每局同一时间只允许一个回合在生成；同一回合号的重复提交返回已有任务，不会重复调用模型。
+    回合生成中超过abandon_timeout秒没有页面轮询（标签页已关闭）时取消该回合，为0时不检查；
+    is_session_active判断web会话是否仍然连接，仍有会话显示的对局不会被移出登记表
+    """
+
+    def __init__(self, max_workers: int = 4, max_games: int = 500, idle_timeout: float = 3600.0,
+                 poll_interval: float = 0.5, abandon_timeout: float = 30.0,
+                 is_session_active: Optional[Callable[[str], bool]] = None):
+        self.max_games = max_games
+        self.is_session_active = is_session_active
+        # 页面轮询回合进度的间隔（秒）
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.abandon_timeout = abandon_timeout
+        self._games: "OrderedDict[str, GameEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="turn-worker")
+        # cancelled: 被取消的回合数；skipped: 取消时尚在排队、完全没有调用模型的回合数
+        self.stats = {'submitted': 0, 'deduplicated': 0, 'rejected': 0, 'failed': 0, 'cancelled': 0, 'skipped': 0}
+        self._stop_event = threading.Event()
+        if abandon_timeout > 0:
+            threading.Thread(target=self._watch, name="turn-watchdog", daemon=True).start()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any],
+                    is_session_active: Optional[Callable[[str], bool]] = None) -> 'GameRegistry':
+        """从config.json的turn_worker配置创建"""
+        worker = config.get("turn_worker", {})
+        return cls(
+            max_workers=worker.get("max_workers", 4),
+            max_games=worker.get("max_games", 500),
+            idle_timeout=worker.get("idle_timeout", 3600.0),
+            poll_interval=worker.get("poll_interval", 0.5),
+            abandon_timeout=worker.get("abandon_timeout", 30.0),
+            is_session_active=is_session_active
+        )
+
+    def _in_use(self, entry: GameEntry) -> bool:
+        if entry.job is not None and not entry.job.finished:
+            return True
+        if self.is_session_active is None:
+            return False
+        entry.sessions = {session_id for session_id in entry.sessions if self.is_session_active(session_id)}
+        return bool(entry.sessions)
+
+    def _evict(self) -> None:
+        """移除长时间无人访问或超出数量上限的对局；正在生成或仍有会话显示的对局保留"""
+        now = time.monotonic()
+        for play_id, entry in list(self._games.items()):
+            if now - entry.last_access <= self.idle_timeout and len(self._games) <= self.max_games:
+                continue
+            if not self._in_use(entry):
+                del self._games[play_id]
+
+    def register(self, engine, state_manager, replace: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        """登记一局新游戏并返回其标识；replace为同一会话之前的对局，会被移除，其正在生成的回合被取消；
+        session_id为显示这一局的web会话
+        """
+        play_id = uuid.uuid4().hex
+        entry = GameEntry(play_id, engine, state_manager)
+        entry.publish()
+        if session_id:
+            entry.sessions.add(session_id)
+        with self._lock:
+            old = self._games.pop(replace, None) if replace else None
+            self._games[play_id] = entry
+            self._evict()
+        if old is not None and old.job is not None:
+            self._cancel_job(old.job, "对局已被替换")
+        return play_id
+
+    def get(self, play_id: Optional[str]) -> Optional[GameEntry]:
+        """按标识取回对局（如刷新页面后）"""
+        if not play_id:
+            return None
+        with self._lock:
+            entry = self._games.get(play_id)
+            if entry is not None:
+                entry.last_access = time.monotonic()
+                self._games.move_to_end(play_id)
+            return entry
+
+    def attach(self, play_id: Optional[str], session_id: Optional[str]) -> Optional[GameEntry]:
+        """刷新页面等新会话接上已登记的对局"""
+        entry = self.get(play_id)
+        if entry is not None and session_id:
+            with self._lock:
+                entry.sessions.add(session_id)
+        return entry
+
+    def view(self, play_id: Optional[str]) -> Dict[str, Any]:
+        """页面渲染用的对局快照，回合生成期间是上一回合结束时的状态"""
+        entry = self.get(play_id)
+        return entry.view if entry is not None else {}
+
+    @contextlib.contextmanager
+    def locked(self, play_id: Optional[str]) -> Iterator[Optional[GameEntry]]:
+        """在该局的锁内修改对局状态（撤销、保存、读档等），结束后重新发布快照；该局未登记时不加锁"""
+        entry = self.get(play_id)
+        if entry is None:
+            yield None
+            return
+        with entry.lock:
+            yield entry
+            entry.publish()
+
+    def busy(self, play_id: Optional[str]) -> bool:
+        entry = self.get(play_id)
+        return entry is not None and entry.job is not None and not entry.job.finished
+
+    def submit(self, play_id: str, turn: int, func: Callable[..., Any], *args,
+               description: str = "") -> Optional[TurnJob]:
+        """提交一个回合；turn须等于该局已完成的回合数
+
+        同一回合重复提交时返回已有任务；该局有其他回合正在生成或turn已过期时返回None
+        """
+        with self._lock:
+            entry = self._games.get(play_id)
+            if entry is None:
+                self.stats['rejected'] += 1
+                return None
+            job = entry.job
+            if job is not None and job.turn == turn and job.status not in ("failed", "cancelled"):
+                self.stats['deduplicated'] += 1
+                return job
+            if (job is not None and not job.finished) or turn != entry.turns:
+                self.stats['rejected'] += 1
+                return None
+            job = TurnJob(play_id, turn, description)
+            entry.job = job
+            entry.last_access = time.monotonic()
+            self.stats['submitted'] += 1
+        self._executor.submit(self._run, entry, job, func, args)
+        return job
+
+    def _run(self, entry: GameEntry, job: TurnJob, func: Callable[..., Any], args) -> None:
+        if job.cancel_token.cancelled:
+            # 排队期间已被取消，不再调用模型
+            job.status = "cancelled"
+            self.stats['skipped'] += 1
+        else:
+            job.status = "running"
+            with entry.lock:
+                try:
+                    job.result = func(*args, cancel_token=job.cancel_token)
+                    status = "done"
+                except GenerationCancelled as e:
+                    job.error = str(e)
+                    status = "cancelled"
+                except Exception as e:
+                    print(f"后台生成回合失败: {e}")
+                    job.error = str(e)
+                    status = "failed"
+                    self.stats['failed'] += 1
+                # 先发布快照再标记完成，页面看到回合结束时快照已经是新的
+                entry.publish()
+            job.status = status
+        job.finished_at = time.time()
+        # 失败或取消的回合不计数，可以用同一回合号重新提交
+        if job.status == "done":
+            with self._lock:
+                entry.turns += 1
+        job.done_event.set()
+
+    def _cancel_job(self, job: TurnJob, reason: str) -> bool:
+        if job.finished or not job.cancel_token.cancel(reason):
+            return False
+        with self._lock:
+            self.stats['cancelled'] += 1
+        return True
+
+    def cancel(self, play_id: Optional[str], reason: str = "已取消", wait: float = 0.0) -> bool:
+        """取消该局正在生成的回合，wait大于0时最多等待该秒数让回合退出；返回回合是否已经结束"""
+        if not play_id:
+            return True
+        with self._lock:
+            entry = self._games.get(play_id)
+            job = entry.job if entry is not None else None
+        if job is None or job.finished:
+            return True
+        self._cancel_job(job, reason)
+        return job.done_event.wait(wait) if wait > 0 else job.finished
+
+    def cancel_abandoned(self) -> int:
+        """取消超过abandon_timeout没有页面轮询的回合，返回本次取消的数量"""
+        now = time.monotonic()
+        with self._lock:
+            jobs = [entry.job for entry in self._games.values()
+                    if entry.job is not None and not entry.job.finished
+                    and now - entry.last_access > self.abandon_timeout]
+        return sum(self._cancel_job(job, "页面已关闭") for job in jobs)
+
+    def _watch(self) -> None:
+        while not self._stop_event.wait(max(self.abandon_timeout / 2, self.poll_interval)):
+            self.cancel_abandoned()
+
+    def bump_turn(self, play_id: Optional[str]) -> None:
+        """回合之外改变了对局状态（撤销/重做）时推进回合号，旧页面上的选项提交会被拒绝"""
+        entry = self.get(play_id)
+        if entry is not None:
+            with self._lock:
+                entry.turns += 1
+
+    def collect(self, play_id: Optional[str]) -> Optional[TurnJob]:
+        """取出已完成但尚未被页面处理的任务，每个任务只返回一次"""
+        entry = self.get(play_id)
+        if entry is None:
+            return None
+        with self._lock:
+            job = entry.job
+            if job is None or not job.finished or job.collected:
+                return None
+            job.collected = True
+            return job
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = sum(1 for e in self._games.values() if e.job is not None and not e.job.finished)
+            return {'games': len(self._games), 'running': running, **self.stats}
+
+    def shutdown(self) -> None:
+        self._stop_event.set()
+        with self._lock:
+            jobs = [entry.job for entry in self._games.values() if entry.job is not None]
+        for job in jobs:
+            self._cancel_job(job, "服务关闭")
+        self._executor.shutdown(wait=False)
+
+
+def load_registry(config_path: str = "config.json",
+                  is_session_active: Optional[Callable[[str], bool]] = None) -> GameRegistry:
+    """按配置文件创建登记表"""
+    config = {}
+    if os.path.exists(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    return GameRegistry.from_config(config, is_session_active)
+
+
+if __name__ == "__main__":
+    from game_engine import GameEngine
+    from state_manager import GameStateManager
+
+    registry = GameRegistry(max_workers=2)
+    engine = GameEngine()
+    engine.toggle_ai_generation(False)
+    state_manager = GameStateManager()
+    state_manager.create_new_game("测试玩家")
+    play_id = registry.register(engine, state_manager)
+
+    job = registry.submit(play_id, 0, engine.start_new_game, state_manager)
+    # 重复提交同一回合返回同一个任务
+    assert registry.submit(play_id, 0, engine.start_new_game, state_manager) is job
+    while not job.finished:
+        time.sleep(0.01)
+    print("开局:", state_manager.story.current_description[:20], registry.collect(play_id) is job)
+    job = registry.submit(play_id, 1, engine.play_turn, "仔细观察房间", state_manager)
+    # 正在生成时提交其他回合会被拒绝
+    print("重复/过期提交:", registry.submit(play_id, 2, engine.play_turn, "x", state_manager))
+    while not job.finished:
+        time.sleep(0.01)
+    print("回合结果:", job.status, state_manager.story.current_scene_id)
+
+    # 模拟慢模型，返回主菜单时取消正在生成的回合
+    from tools.stub_model import StubScenePrompt
+    slow_engine = GameEngine(scene_prompt=StubScenePrompt(latency=5.0))
+    slow_state = GameStateManager()
+    slow_state.create_new_game("测试玩家")
+    slow_id = registry.register(slow_engine, slow_state)
+    job = registry.submit(slow_id, 0, slow_engine.start_new_game, slow_state)
+    time.sleep(0.1)
+    started = time.monotonic()
+    print("取消:", registry.cancel(slow_id, "返回主菜单", wait=1.0), job.status,
+          f"{time.monotonic() - started:.2f}s")
+    print("统计:", registry.get_stats())